@@ -1,28 +1,69 @@
+import errno
+import fcntl
+import itertools
+import json
+import os
+import subprocess
+import threading
+import time
+import urlparse
+
+from contextlib import contextmanager
+
 import requests
 from requests.exceptions import RequestException
 
 
+def _write_event(event_file, event):
+    """Write an event file durably. The file is written under a temporary name and renamed into place."""
+
+    new_file = os.path.join(os.path.dirname(event_file), '.' + os.path.basename(event_file) + '.new')
+    with open(new_file, 'w') as json_file:
+        json.dump(event, json_file)
+        json_file.flush()
+        os.fsync(json_file.fileno())
+
+    os.rename(new_file, event_file)
+
+
 class Callback:
-    """ Provides HTTP callbacks for notification. """
+    """ Provides HTTP callbacks for notification.
+
+    Callback events are written to the spool folder (one folder per service) and delivered by a
+    CallbackSender, so starting and stopping a service does not wait for the callback receiver.
+    """
+
+    # makes the names of events spooled by this process in the same microsecond unique
+    _sequence = itertools.count()
 
     def __init__(self, ctx):
         self.ctx = ctx
         self.connect_timeout = self.ctx.config.get('callback', 'connect_timeout')
         self.read_timeout = self.ctx.config.get('callback', 'read_timeout')
         self.ignore_callbacks = self.ctx.config.get('callback', 'ignore_callbacks') == 'true'
+        self.backoff = float(self.ctx.config.get('callback', 'backoff'))
+        self.max_backoff = float(self.ctx.config.get('callback', 'max_backoff'))
+        self.max_attempts = int(self.ctx.config.get('callback', 'max_attempts'))
+        self.batch_window = float(self.ctx.config.get('callback', 'batch_window'))
+        self.gcontainer = self.ctx.config.get('systemd', 'gcontainer')
+        self.spool_dir = self.ctx.fs.spool_dir
 
-    def running(self, uri, **payload):
+        # set if this process delivers the events itself, see start_sender
+        self.sender = None
+
+    def running(self, uri, mode='single', **payload):
         """ Hit the 'running' endpoint to report service being up."""
 
-        self._post(uri, 'running', payload)
+        self._post(uri, 'running', mode, payload)
 
-    def stopped(self, uri, **payload):
+    def stopped(self, uri, mode='single', **payload):
         """ Hit the 'stopped' endpoint to report service being down."""
 
-        self._post(uri, 'stopped', payload)
+        self._post(uri, 'stopped', mode, payload)
 
-    def _post(self, uri, endpoint, payload):
-        """Actual code to perform the callbacks."""
+    def _post(self, uri, endpoint, mode, payload):
+        """Spool a callback and make sure that a sender delivers it. The mode (single, batch or collapse)
+        is chosen by the receiver, see CallbackSender.deliver."""
 
         if self.ignore_callbacks:
             return
@@ -30,11 +71,305 @@ class Callback:
         if not uri[-1] == '/':
             uri += '/'
 
-        uri += endpoint
+        self._spool(payload['name'], {'uri': uri + endpoint,
+                                      'callback_uri': uri,
+                                      'event': endpoint,
+                                      'mode': mode,
+                                      'payload': payload,
+                                      'created': time.time(),
+                                      'attempts': 0,
+                                      'next_attempt': 0})
+
+        if self.sender:
+            self.sender.wake()
+        elif not CallbackSender(self).is_running():
+            self._spawn_sender()
+
+    def _spool(self, service_name, event):
+        """Write an event to the spool folder of a service. The file names sort in the order of the events."""
+
+        service_dir = os.path.join(self.spool_dir, service_name)
+        if not os.access(service_dir, os.F_OK):
+            try:
+                os.makedirs(service_dir, 0755)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+        file_name = '%017.6f-%d-%d.json' % (event['created'], os.getpid(), next(Callback._sequence))
+        _write_event(os.path.join(service_dir, file_name), event)
+
+    def _spawn_sender(self):
+        """Start a detached 'gcontainer send-callbacks' process that delivers the spooled events."""
+
+        args = [self.gcontainer]
+        if getattr(self.ctx, 'config_path', None):
+            args.extend(['--config', self.ctx.config_path])
+        args.append('send-callbacks')
+
+        try:
+            with open(os.devnull, 'r+') as devnull:
+                subprocess.Popen(args, stdin=devnull, stdout=devnull, stderr=devnull,
+                                 close_fds=True, preexec_fn=os.setsid)
+        except OSError:
+            pass  # the event stays in the spool and is delivered by the next sender
+
+    def drain(self):
+        """Deliver the spooled events from this process until the spool is empty."""
+
+        CallbackSender(self).drain()
+
+    def start_sender(self):
+        """Deliver the spooled events from a background thread of this process. Used by gcontainerd."""
+
+        self.sender = CallbackSender(self)
+
+        thread = threading.Thread(target=self.sender.run)
+        thread.daemon = True
+        thread.start()
+
+
+class CallbackSender(object):
+    """Delivers the spooled callback events.
+
+    The events of a service are delivered in order, an event that can not be delivered holds back the later
+    events of its service until it is delivered or dropped. Failed deliveries are retried with exponential
+    backoff; after max_attempts, the event is moved to the failed folder of the spool. Only one sender per
+    spool folder runs at any time.
+    """
+
+    LOCK_FILE_NAME = '.sender.lock'
+    FAILED_DIR_NAME = '.failed'
+
+    # batches of events are posted to this endpoint below the callback uri
+    BATCH_ENDPOINT = 'batch'
+
+    # gcontainerd looks for events from other processes this often (seconds)
+    POLL_INTERVAL = 1.0
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.spool_dir = callback.spool_dir
+        self.lock_file = os.path.join(self.spool_dir, CallbackSender.LOCK_FILE_NAME)
+        self.wakeup = threading.Event()
+
+        # (scheme, host) -> requests.Session
+        self.sessions = {}
+
+    @contextmanager
+    def _lock(self, blocking=True):
+        """Take the sender lock. Yields false if blocking is false and another sender holds the lock."""
+
+        lock_fd = open(self.lock_file, 'a')
+        try:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                yield False
+                return
+
+            yield True
+        finally:
+            lock_fd.close()
+
+    def is_running(self):
+        """Returns true if a sender is running for the spool folder."""
+
+        with self._lock(blocking=False) as locked:
+            return not locked
+
+    def wake(self):
+        """Deliver new events now instead of waiting for the next poll."""
+
+        self.wakeup.set()
+
+    def _events(self):
+        """Returns the event files of every service, oldest first."""
+
+        events = {}
+        for service_name in os.listdir(self.spool_dir):
+            service_dir = os.path.join(self.spool_dir, service_name)
+            if not service_name[0].isalnum() or not os.path.isdir(service_dir):
+                continue
+
+            event_files = sorted(name for name in os.listdir(service_dir) if name[0].isdigit())
+            if event_files:
+                events[service_name] = [os.path.join(service_dir, name) for name in event_files]
+
+        return events
+
+    def _session(self, uri):
+        """Returns the session for the host of a uri. Sessions keep their connections open between events."""
+
+        parts = urlparse.urlsplit(uri)
+        host = (parts.scheme, parts.netloc)
+        if host not in self.sessions:
+            self.sessions[host] = requests.Session()
+
+        return self.sessions[host]
+
+    def _post(self, uri, **kwargs):
+        """Post to a callback uri. Returns false if the delivery should be retried."""
 
         try:
-            requests.post(uri,
-                          data=payload,
-                          timeout=(float(self.connect_timeout), float(self.read_timeout)))
+            response = self._session(uri).post(uri,
+                                               timeout=(float(self.callback.connect_timeout),
+                                                        float(self.callback.read_timeout)),
+                                               **kwargs)
+            return response.status_code < 500
         except RequestException:
-            pass  # do nothing, if the hook fails, so be it
+            return False
+
+    def _send(self, entries):
+        """Deliver events. A single event is posted to its endpoint, multiple events of the same callback uri
+        are posted as a JSON list to its batch endpoint."""
+
+        if len(entries) == 1 and entries[0][2].get('mode', 'single') == 'single':
+            event = entries[0][2]
+            return self._post(event['uri'], data=event['payload'])
+
+        events = []
+        last = {}
+        for service_name, event_file, event in entries:
+            record = dict(event['payload'], event=event['event'], time=event['created'])
+
+            # the receiver only sees the start of a service that was stopped and started again
+            previous = last.get(service_name)
+            if event['mode'] == 'collapse' and event['event'] == 'running' and previous is not None \
+                    and events[previous]['event'] == 'stopped':
+                events[previous] = dict(record, restarted=True)
+            else:
+                last[service_name] = len(events)
+                events.append(record)
+
+        return self._post(entries[0][2]['callback_uri'] + CallbackSender.BATCH_ENDPOINT,
+                          data=json.dumps({'events': events}),
+                          headers={'Content-Type': 'application/json'})
+
+    def _fail(self, service_name, event_file):
+        """Move an event that can not be delivered out of the way."""
+
+        failed_dir = os.path.join(self.spool_dir, CallbackSender.FAILED_DIR_NAME, service_name)
+        if not os.access(failed_dir, os.F_OK):
+            os.makedirs(failed_dir, 0755)
+
+        os.rename(event_file, os.path.join(failed_dir, os.path.basename(event_file)))
+
+    def _finish(self, entries, delivered):
+        """Remove delivered events and schedule the next attempt of the others. Returns the time of the next
+        attempt or None if there is none."""
+
+        next_attempt = None
+        for service_name, event_file, event in entries:
+            if delivered:
+                os.unlink(event_file)
+                continue
+
+            event['attempts'] += 1
+            if event['attempts'] >= self.callback.max_attempts:
+                self._fail(service_name, event_file)
+                continue
+
+            backoff = self.callback.backoff * 2 ** (event['attempts'] - 1)
+            event['next_attempt'] = time.time() + min(backoff, self.callback.max_backoff)
+            _write_event(event_file, event)
+            next_attempt = event['next_attempt']
+
+        return next_attempt
+
+    def deliver(self):
+        """Deliver all events that are due. Returns the seconds until the next event is due or None if the
+        spool is empty. Must be called with the sender lock held.
+
+        Events in batch or collapse mode are held back until batch_window seconds after the oldest event for
+        their callback uri and then posted together with all other due events for the same callback uri."""
+
+        spooled = []
+        opened = {}
+        for service_name, event_files in sorted(self._events().items()):
+            events = []
+            for event_file in event_files:
+                try:
+                    with open(event_file, 'r') as json_file:
+                        event = json.load(json_file)
+                except ValueError:
+                    self._fail(service_name, event_file)
+                    continue
+
+                if event.get('mode', 'single') != 'single':
+                    opened[event['callback_uri']] = min(opened.get(event['callback_uri'], event['created']),
+                                                        event['created'])
+                events.append((event_file, event))
+
+            spooled.append((service_name, events))
+
+        now = time.time()
+        due = []
+        batches = {}
+
+        for service_name, events in spooled:
+            batched = False
+            for event_file, event in events:
+                mode = event.get('mode', 'single')
+                next_attempt = event['next_attempt']
+                if mode != 'single':
+                    next_attempt = max(next_attempt, opened[event['callback_uri']] + self.callback.batch_window)
+
+                # the later events of this service wait for this one
+                if next_attempt > now:
+                    due.append(next_attempt)
+                    break
+
+                if mode != 'single':
+                    batches.setdefault(event['callback_uri'], []).append((service_name, event_file, event))
+                    batched = True
+                    continue
+
+                # events are delivered in order, a single event waits until the batch before it is delivered
+                if batched:
+                    due.append(now)
+                    break
+
+                entries = [(service_name, event_file, event)]
+                retry = self._finish(entries, self._send(entries))
+                if retry is not None:
+                    due.append(retry)
+                    break
+
+        for callback_uri, entries in sorted(batches.items()):
+            retry = self._finish(entries, self._send(entries))
+            if retry is not None:
+                due.append(retry)
+
+        if not due:
+            return None
+        return max(min(due) - time.time(), 0)
+
+    def drain(self):
+        """Deliver events until the spool is empty. Returns right away if another sender is running."""
+
+        while True:
+            with self._lock(blocking=False) as locked:
+                if not locked:
+                    return
+
+                delay = self.deliver()
+                while delay is not None:
+                    time.sleep(delay)
+                    delay = self.deliver()
+
+            # events spooled while the lock was released are not seen by a sender that was started for them
+            if not self._events():
+                return
+
+    def run(self):
+        """Deliver events for the lifetime of the process."""
+
+        with self._lock():
+            while True:
+                delay = self.deliver()
+                self.wakeup.wait(CallbackSender.POLL_INTERVAL if delay is None
+                                 else min(delay, CallbackSender.POLL_INTERVAL))
+                self.wakeup.clear()
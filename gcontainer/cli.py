@@ -1,7 +1,10 @@
+import sys
+
 import click
 
 from .context import CmdContext
 from .output import error_wrapper
+from .util import is_pattern
 
 
 @click.group()
@@ -16,11 +19,36 @@ def main(ctx, config, json=False, verbose=False, raw=False):
 
     Manages containers on G hosts."""
 
-    # prep stuff for actual command
-    ctx_obj = CmdContext(json, verbose, raw)
+    if isinstance(ctx.obj, CmdContext) and not config:
+        # gcontainerd passes in its warm context, only reset the per command state.
+        ctx.obj = error_wrapper(CmdContext.reset, ctx.obj, *[ctx.obj, json, verbose, raw])
+    else:
+        # prep stuff for actual command
+        ctx_obj = CmdContext(json, verbose, raw)
+
+        # Use the error wrapper to catch any init errors in the controllers
+        ctx.obj = error_wrapper(CmdContext.init, ctx_obj, *[ctx_obj, config])
+
+
+def run():
+    """Entry point for the gcontainer command.
+
+    Hands the command to gcontainerd if the daemon is running, otherwise executes it in this process."""
 
-    # Use the error wrapper to catch any init errors in the controllers
-    ctx.obj = error_wrapper(CmdContext.init, ctx_obj, *[ctx_obj, config])
+    from .daemon import forward, forwardable
+
+    argv = sys.argv[1:]
+    if forwardable(argv):
+        config = CmdContext._load_configuration()
+        result = forward(argv, config.get('daemon', 'socket'))
+
+        if result is not None:
+            exit_code, stdout, stderr = result
+            click.echo(stdout, nl=False)
+            click.echo(stderr, nl=False, err=True)
+            sys.exit(exit_code)
+
+    main()
 
 
 @main.group("config")
@@ -85,70 +113,177 @@ def service_remove(ctx, service_name):
 
 @main.command("deploy")
 @click.option('--callback-uri', help='Callback URI when this service changes state.')
-@click.argument('service_name')
-@click.argument('deploy_id')
+@click.option('--callback-mode', type=click.Choice(['single', 'batch', 'collapse']), default='single',
+              help='Post every callback, batches of callbacks or batches with stop/start pairs collapsed.')
+@click.option('--manifest', type=click.File('r'),
+              help='Deploy all services listed in this file, one service=image:tag per line.')
+@click.option('--progress', type=click.Choice(['none', 'live', 'ndjson']), default='none',
+              help='Show the pull progress on stderr as a status line or as JSON lines.')
+@click.option('--pull-policy', type=click.Choice(['always', 'if-missing', 'never']),
+              help='Pull images always, only if they are missing locally or never. Default is from the config.')
+@click.argument('service_name', required=False)
+@click.argument('deploy_id', required=False)
 @click.pass_obj
-def service_deploy(ctx, service_name, deploy_id, callback_uri=None):
-    """Deploy an existing service."""
-    ctx.cmd.deploy(ctx, service_name, deploy_id, callback_uri=callback_uri)
+def service_deploy(ctx, service_name, deploy_id, callback_uri=None, callback_mode='single', manifest=None,
+                   progress='none', pull_policy=None):
+    """Deploy existing services."""
+    ctx.progress = progress
+    ctx.pull_policy = pull_policy
+    if manifest:
+        if service_name or deploy_id:
+            raise click.UsageError('A service name and a deploy id can not be combined with --manifest.')
+
+        exit_code = ctx.cmd.deploy_manifest(ctx, manifest.readlines(), callback_uri=callback_uri,
+                                            callback_mode=callback_mode)
+        if exit_code:
+            sys.exit(exit_code)
+    else:
+        if not service_name or not deploy_id:
+            raise click.UsageError('Missing argument "service_name" or "deploy_id".')
+
+        ctx.cmd.deploy(ctx, service_name, deploy_id, callback_uri=callback_uri, callback_mode=callback_mode)
+
+
+def _run_for_services(ctx, command, service_names, all_services):
+    """Run a command for one service, multiple services, glob patterns or all services."""
+
+    if not service_names and not all_services:
+        raise click.UsageError('Missing argument "service_names".')
+
+    if len(service_names) == 1 and not all_services and not is_pattern(service_names[0]):
+        getattr(ctx.cmd, command)(ctx, service_names[0])
+    else:
+        exit_code = ctx.cmd.bulk(ctx, command, service_names, all_services=all_services)
+        if exit_code:
+            sys.exit(exit_code)
 
 
 @main.command("start")
-@click.option('--block', is_flag=True, help='If true, blocks until the container exists.')
+@click.option('--block', is_flag=True, help='If true, waits until the container is ready, '
+              'reports it to systemd and blocks until the container exits.')
 @click.option('--ignore-started', is_flag=True, help='If true, ignore an already running container.')
-@click.argument('service_name')
+@click.option('--recreate', is_flag=True, help='If true, always create a new container.')
+@click.option('--all', 'all_services', is_flag=True, help='Start all services.')
+@click.argument('service_names', nargs=-1)
 @click.pass_obj
-def service_start(ctx, block, ignore_started, service_name):
-    """Start a deployed service."""
+def service_start(ctx, block, ignore_started, recreate, all_services, service_names):
+    """Start deployed services."""
     ctx.block_flag = block
     ctx.started_flag = ignore_started
-    ctx.cmd.start(ctx, service_name)
+    ctx.recreate_flag = recreate
+    _run_for_services(ctx, 'start', service_names, all_services)
 
 
 @main.command("stop")
 @click.option('--ignore-stopped', is_flag=True, help='If true, ignore an already stopped container.')
-@click.argument('service_name')
+@click.option('--all', 'all_services', is_flag=True, help='Stop all services.')
+@click.argument('service_names', nargs=-1)
 @click.pass_obj
-def service_stop(ctx, ignore_stopped, service_name):
-    """Stop a deployed service."""
+def service_stop(ctx, ignore_stopped, all_services, service_names):
+    """Stop deployed services."""
     ctx.stopped_flag = ignore_stopped
-    ctx.cmd.stop(ctx, service_name)
+    _run_for_services(ctx, 'stop', service_names, all_services)
 
 
 @main.command("restart")
-@click.argument('service_name')
+@click.option('--all', 'all_services', is_flag=True, help='Restart all services.')
+@click.argument('service_names', nargs=-1)
 @click.pass_obj
-def service_restart(ctx, service_name):
-    """Restart a deployed service if it is running."""
-    ctx.cmd.restart(ctx, service_name)
+def service_restart(ctx, all_services, service_names):
+    """Restart deployed services if they are running."""
+    _run_for_services(ctx, 'restart', service_names, all_services)
 
 
 @main.command("enable")
-@click.argument('service_name')
+@click.option('--all', 'all_services', is_flag=True, help='Enable all services.')
+@click.argument('service_names', nargs=-1)
 @click.pass_obj
-def service_enable(ctx, service_name):
-    """Enable a deployed service for autostart."""
-    ctx.cmd.enable(ctx, service_name)
+def service_enable(ctx, all_services, service_names):
+    """Enable deployed services for autostart."""
+    _run_for_services(ctx, 'enable', service_names, all_services)
 
 
 @main.command("disable")
+@click.option('--all', 'all_services', is_flag=True, help='Disable all services.')
+@click.argument('service_names', nargs=-1)
+@click.pass_obj
+def service_disable(ctx, all_services, service_names):
+    """Disable deployed services for autostart."""
+    _run_for_services(ctx, 'disable', service_names, all_services)
+
+
+@main.command("set")
+@click.option('--priority', type=int, help='Boot priority, services with a higher priority are started first.')
+@click.option('--after', multiple=True, help='Start the service after this service at boot (can be repeated).')
+@click.option('--no-after', is_flag=True, help='Remove all boot dependencies.')
+@click.option('--readiness-timeout', type=int, help='Seconds to wait for the container to become ready.')
 @click.argument('service_name')
 @click.pass_obj
-def service_disable(ctx, service_name):
-    """Disable a deployed service for autostart."""
-    ctx.cmd.disable(ctx, service_name)
+def service_set(ctx, service_name, priority=None, after=(), no_after=False, readiness_timeout=None):
+    """Set boot priority, dependencies and readiness timeout of a service."""
+    ctx.cmd.set(ctx, service_name, priority=priority, after=list(after) if after or no_after else None,
+                readiness_timeout=readiness_timeout)
+
+
+@main.command("boot")
+@click.pass_obj
+def service_boot(ctx):
+    """Start all enabled services in dependency order."""
+    exit_code = ctx.cmd.boot(ctx)
+    if exit_code:
+        sys.exit(exit_code)
+
+
+@main.command("gc")
+@click.option('--dry-run', is_flag=True, help='Only list the images that would be removed.')
+@click.option('--keep', type=int, help='Number of previous deploy ids to keep per service. Default is from the config.')
+@click.pass_obj
+def service_gc(ctx, dry_run=False, keep=None):
+    """Remove images that are no longer deployed."""
+    ctx.cmd.gc(ctx, dry_run=dry_run, keep=keep)
+
+
+@main.command("reconcile")
+@click.option('--dry-run', is_flag=True, help='Only print the differences and the repairs.')
+@click.pass_obj
+def service_reconcile(ctx, dry_run=False):
+    """Repair differences between the state and docker or systemd."""
+    exit_code = ctx.cmd.reconcile(ctx, dry_run=dry_run)
+    if exit_code:
+        sys.exit(exit_code)
+
+
+@main.command("watch")
+@click.option('--callbacks', is_flag=True, help='Report state changes found by watch to the callback URIs.')
+@click.pass_obj
+def service_watch(ctx, callbacks=False):
+    """Keep the state of all services in sync with docker."""
+    ctx.cmd.watch(ctx, callbacks=callbacks)
+
+
+@main.command("send-callbacks")
+@click.pass_obj
+def service_send_callbacks(ctx):
+    """Deliver spooled callbacks."""
+    ctx.cmd.send_callbacks(ctx)
+
+
+def _fields(fields):
+    return [field.strip() for field in fields.split(',') if field.strip()] if fields else None
 
 
 @main.command("status")
+@click.option('--fields', help='Comma separated list of fields to show, e.g. running,deployment.')
 @click.argument('service_name')
 @click.pass_obj
-def service_status(ctx, service_name):
+def service_status(ctx, service_name, fields=None):
     """Display status of an installed service."""
-    ctx.cmd.status(ctx, service_name)
+    ctx.cmd.status(ctx, service_name, fields=_fields(fields))
 
 
 @main.command("list")
+@click.option('--fields', help='Comma separated list of fields to show, e.g. running,deployment.')
 @click.pass_obj
-def service_list(ctx):
+def service_list(ctx, fields=None):
     """List all installed services."""
-    ctx.cmd.list(ctx)
+    ctx.cmd.list(ctx, fields=_fields(fields))
@@ -2,15 +2,41 @@ import os
 
 from ConfigParser import SafeConfigParser
 
-from .callback import Callback
 from .config import Config
-from .deploy_controller import DeployController
-from .docker_controller import Docker
 from .error import GContainerException, ErrorConstants
 from .file_manager import FileSystemController
 from .output import print_errors, print_json
 from .service import Service
-from .systemd import Systemd
+
+
+# Controller factories. The controller modules (and the third party libraries they use) are only
+# imported when a command accesses the controller for the first time.
+
+def _file_system_controller(ctx):
+    return FileSystemController(ctx)
+
+
+def _deploy_controller(ctx):
+    from .deploy_controller import DeployController
+    return DeployController(ctx.fs.root, ctx.config.get('state', 'backend'),
+                            journal=ctx.config.get('state', 'journal') == 'true',
+                            journal_fsync=ctx.config.get('state', 'journal_fsync') == 'true',
+                            journal_compact_size=int(ctx.config.get('state', 'journal_compact_size')))
+
+
+def _docker(ctx):
+    from .docker_controller import Docker
+    return Docker(ctx)
+
+
+def _systemd(ctx):
+    from .systemd import Systemd
+    return Systemd(ctx)
+
+
+def _callback(ctx):
+    from .callback import Callback
+    return Callback(ctx)
 
 
 class CmdContext(object):
@@ -19,6 +45,13 @@ class CmdContext(object):
     Commands = {'service_group': Service(),
                 'config_group': Config()}
 
+    # controllers are created on first access, see __getattr__
+    Controllers = {'fs': _file_system_controller,
+                   'deploy': _deploy_controller,
+                   'docker': _docker,
+                   'systemd': _systemd,
+                   'callback': _callback}
+
     # to guarantee that a section and/or setting exists, add a default value here
     DefaultValues = {
         'general': {
@@ -31,22 +64,49 @@ class CmdContext(object):
             'log_dir': 'log',
             'script_dir': 'script',
             'archive_dir': 'archive',
+            'spool_dir': 'spool',
             },
         'docker': {
             'socket': 'unix://var/run/docker.sock',
             'disable_latest_tag': 'true',
             'allow_insecure_registry': 'false',
+            'parallelism': '8',
+            'pull_parallelism': '4',
+            'pull_policy': 'always',
             },
         'systemd': {
             'config_dir': '/etc/systemd/system',
             'gcontainer': '/usr/bin/gcontainer',
             'systemctl': '/usr/bin/systemctl',
-            'timeout': '30s'
+            'timeout': '30s',
+            'backend': 'auto',
+            'unit_mode': 'file',
+            'notify': 'false',
+            'readiness_timeout': '60',
         },
         'callback': {
             'connect_timeout': '1',
             'read_timeout': '5',
             'ignore_callbacks': 'false',
+            'backoff': '1',
+            'max_backoff': '300',
+            'max_attempts': '10',
+            'batch_window': '0.5',
+        },
+        'daemon': {
+            'socket': '/var/run/gcontainerd.sock',
+        },
+        'gc': {
+            'keep': '2',
+            'high_watermark': '0',
+            'docker_root': '/var/lib/docker',
+            'after_deploy': 'false',
+        },
+        'state': {
+            'backend': 'json',
+            'journal': 'false',
+            'journal_fsync': 'false',
+            'journal_compact_size': '65536',
         }
     }
 
@@ -61,9 +121,29 @@ class CmdContext(object):
         self.verbose = verbose_flag
         self.raw = raw_flag
 
+        # progress display and pull policy (None for the configured policy), set by commands that pull images
+        self.progress = 'none'
+        self.pull_policy = None
+
+        # recreate containers even if they did not change, set by start
+        self.recreate_flag = False
+
+        # fields selected by status and list, the text formatters show only these (None shows all)
+        self.fields = None
+
         for name, group in CmdContext.Commands.iteritems():
             self.__setattr__(name, group)
 
+    def __getattr__(self, name):
+        """Create a controller when it is used for the first time. Only called for missing attributes."""
+
+        if name in CmdContext.Controllers and 'config' in self.__dict__:
+            controller = CmdContext.Controllers[name](self)
+            self.__setattr__(name, controller)
+            return controller
+
+        raise AttributeError(name)
+
     @classmethod
     def _load_configuration(cls, config_file=None):
         """Check the configuration files and load the global 'config' object from them."""
@@ -89,27 +169,51 @@ class CmdContext(object):
         return config
 
     @classmethod
-    def init(cls, ctx, config_path, skip_root_check=False):
+    def _set_format_function(cls, ctx):
         if ctx.json:
             # default formatter for JSON
             ctx.format_function = print_json
         else:
             ctx.format_function = print_errors
 
+    @classmethod
+    def init(cls, ctx, config_path, skip_root_check=False):
+        CmdContext._set_format_function(ctx)
+
         ctx.config = CmdContext._load_configuration(config_path)
+        ctx.config_path = config_path
 
         if not skip_root_check:
             require_root = ctx.config.get('general', 'require_root') == 'true'
             if require_root and os.getuid() != 0:
                 raise GContainerException(ErrorConstants.MUST_RUN_AS_ROOT)
 
-        ctx.fs = FileSystemController(ctx)
-        ctx.deploy = DeployController(ctx.fs.root)
-        ctx.docker = Docker(ctx)
-        ctx.systemd = Systemd(ctx)
-        ctx.callback = Callback(ctx)
+        # drop controllers from an earlier init, they are recreated from the new configuration on first use
+        for name in CmdContext.Controllers:
+            ctx.__dict__.pop(name, None)
 
         # default commmands are in Service, this may change depending on subgroups.
         ctx.cmd = ctx.service_group
 
         return ctx
+
+    @classmethod
+    def reset(cls, ctx, json_flag=False, verbose_flag=False, raw_flag=False):
+        """Prepare an initialized context for the next command. gcontainerd uses this to keep the
+        configuration and the controllers between commands."""
+
+        ctx.json = json_flag
+        ctx.verbose = verbose_flag
+        ctx.raw = raw_flag
+        ctx.recreate_flag = False
+        ctx.fields = None
+
+        CmdContext._set_format_function(ctx)
+
+        # the container inventory is only valid for a single command
+        if 'docker' in ctx.__dict__:
+            ctx.docker.refresh()
+
+        ctx.cmd = ctx.service_group
+
+        return ctx
@@ -0,0 +1,169 @@
+import json
+import os
+import signal
+import socket
+import SocketServer
+import sys
+
+from StringIO import StringIO
+
+import click
+
+from .cli import main as gcontainer_main
+from .context import CmdContext
+from .output import error_wrapper
+
+
+# Commands with these options are always executed in the calling process. A blocking start would tie up the
+# daemon, an explicit configuration file may be different from the one the daemon has loaded, a manifest
+# is read relative to the working directory of the caller and the pull progress must be shown while it happens.
+LOCAL_OPTIONS = ('--config', '--block', '--manifest', '--progress')
+
+# Long running commands, also executed in the calling process.
+LOCAL_COMMANDS = ('boot', 'send-callbacks', 'watch')
+
+
+def forwardable(argv):
+    """Returns true if the given command line can be executed by gcontainerd."""
+
+    if not argv:
+        return False
+
+    for arg in argv:
+        if arg in LOCAL_COMMANDS:
+            return False
+
+        for option in LOCAL_OPTIONS:
+            if arg == option or arg.startswith(option + '='):
+                return False
+
+    return True
+
+
+def forward(argv, socket_path):
+    """Send a command line to gcontainerd and return its exit code and output.
+
+    Returns None if no daemon is listening on the socket, the caller should then execute the command itself.
+    """
+
+    if not os.path.exists(socket_path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(socket_path)
+        except socket.error:
+            return None
+
+        sock.sendall(json.dumps({'argv': argv}) + '\n')
+        response = sock.makefile('r').readline()
+    finally:
+        sock.close()
+
+    # The daemon accepted the command, do not run it a second time if it went away.
+    if not response:
+        return 1, '', 'gcontainerd did not return a result.\n'
+
+    result = json.loads(response)
+    return result['exit_code'], result['stdout'], result['stderr']
+
+
+class _CommandHandler(SocketServer.StreamRequestHandler):
+    """Reads a single JSON encoded command line from the client and writes back the result."""
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+
+        exit_code, stdout, stderr = self.server.execute(request.get('argv', []))
+
+        self.wfile.write(json.dumps({'exit_code': exit_code,
+                                     'stdout': stdout,
+                                     'stderr': stderr}) + '\n')
+
+
+class DaemonServer(SocketServer.UnixStreamServer):
+    """Executes gcontainer commands with a warm context.
+
+    The configuration, the controllers and the docker connection are created once when the daemon starts and
+    are reused for every command. Commands are executed one at a time in the order they arrive.
+    """
+
+    def __init__(self, socket_path, ctx):
+        self.socket_path = socket_path
+        self.ctx = ctx
+
+        # remove a stale socket from a previous run
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+        SocketServer.UnixStreamServer.__init__(self, socket_path, _CommandHandler)
+
+        # Only root may talk to the daemon, it executes every command as root.
+        os.chmod(socket_path, 0600)
+
+    def execute(self, argv):
+        """Run a gcontainer command line and capture its exit code and output."""
+
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO(), StringIO()
+
+        try:
+            try:
+                gcontainer_main.main(args=argv, prog_name='gcontainer', obj=self.ctx, standalone_mode=False)
+                exit_code = 0
+            except click.ClickException as e:
+                e.show()
+                exit_code = e.exit_code
+            except click.Abort:
+                click.echo('Aborted!', err=True)
+                exit_code = 1
+            except SystemExit as e:
+                if e.code is None or isinstance(e.code, int):
+                    exit_code = e.code or 0
+                else:
+                    exit_code = 1
+
+            return exit_code, sys.stdout.getvalue(), sys.stderr.getvalue()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+def _terminate(signum, frame):
+    sys.exit(0)
+
+
+@click.command()
+@click.version_option()
+@click.option('--config', type=click.Path(dir_okay=False), help='Configuration file to use.')
+@click.option('--socket', 'socket_path', help='Unix socket to listen on.')
+def main(config=None, socket_path=None):
+    """G Container Management daemon.
+
+    Keeps the gcontainer configuration, deployment state and docker connection
+    loaded and executes gcontainer commands received over a unix socket."""
+
+    ctx_obj = CmdContext()
+    ctx = error_wrapper(CmdContext.init, ctx_obj, *[ctx_obj, config])
+
+    server = DaemonServer(socket_path or ctx.config.get('daemon', 'socket'), ctx)
+
+    # callbacks of commands executed by the daemon are delivered from the daemon
+    error_wrapper(ctx.callback.start_sender, ctx)
+    signal.signal(signal.SIGTERM, _terminate)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1,228 +1,235 @@
-import fcntl
-import json
+import threading
 
-import os
+from contextlib import contextmanager
 
+from .deploy_state import JsonDeployState, add_op, apply_ops, remove_op, update_op
 from .error import GContainerException, ErrorConstants
-from .file_manager import FileSystemController
 
 
-class DeployStatus(dict):
-    """Wrapper around a dictionary that ensures that the default keys are present with default values."""
+def _json_state(root, **options):
+    return JsonDeployState(root, **options)
 
-    DEPLOY_VERSION = 1
 
-    COUNT_KEY = 'count'
-    DEPLOYS_KEY = 'deploys'
-    VERSION_KEY = 'version'
+def _sqlite_state(root, **options):
+    from .sqlite_state import SqliteDeployState
+    return SqliteDeployState(root)
 
-    def __init__(self, values={}):
-        super(DeployStatus, self).__init__(values)
 
-    @classmethod
-    def __missing__(cls, key):
-        if key == DeployStatus.COUNT_KEY:
-            return 0
-        elif key == DeployStatus.DEPLOYS_KEY:
-            return {}
-        elif key == DeployStatus.VERSION_KEY:
-            return DeployStatus.DEPLOY_VERSION
+def _sharded_state(root, **options):
+    from .sharded_state import ShardedDeployState
+    return ShardedDeployState(root)
 
 
-class DeployLock():
-    """Lock for the deploy region to ensure single threaded access. """
+class DeployTransaction:
+    """Collects changes to the deployment state and writes all of them at once when the transaction ends.
 
-    LOCK_FILE_NAME = '.lock'
+    Reads within the transaction see the collected changes. The changes are applied to the current state
+    under a single exclusive lock with a single write when the transaction commits, so a command that changes
+    multiple fields or services pays for locking, serialization and writing only once. The exclusive lock is
+    only held while the changes are written, not for the lifetime of the transaction. Transactions can be
+    shared between worker threads.
+    """
 
-    def __init__(self, root, mode):
-        self.lock_file = FileSystemController.create_path_name(root, DeployLock.LOCK_FILE_NAME)
+    # number of previous deploy ids kept in the history of a deployment (see gc)
+    HISTORY_SIZE = 10
 
-        # create lock file if it does not exist.
-        if not os.access(self.lock_file, os.F_OK):
-            with open(self.lock_file, "w"):
-                pass
+    def __init__(self, state):
+        self.state = state
+        self.ops = []
+        self.lock = threading.RLock()
 
-        self.mode = mode
-        self.lock_fd = None
+        # deploy records as seen by this transaction, None for services that do not exist.
+        self._view = {}
 
-    def __enter__(self):
-        if self.lock_fd is not None:
-            raise GContainerException(ErrorConstants.ANOTHER_OPERATION_IN_PROGRESS)
+    def _record(self, op):
+        """Check a mutation against the view of this transaction and keep it for the commit. Raises if the
+        mutation does not fit, e.g. when adding an existing service."""
 
-        if self.mode == fcntl.LOCK_EX:
-            self.lock_fd = open(self.lock_file, "w")
-        else:
-            self.lock_fd = open(self.lock_file, "r")
+        with self.lock:
+            deploy_name = op[1]
+            deploys = {}
+            if self._lookup(deploy_name) is not None:
+                deploys[deploy_name] = dict(self._view[deploy_name])
 
-        fcntl.lockf(self.lock_fd, self.mode)
+            apply_ops(deploys, [op])
 
-    def __exit__(self, type, val, tb):
-        if self.lock_fd is None:
-            raise GContainerException(ErrorConstants.LOCK_UNAVAILABLE)
+            self._view[deploy_name] = deploys.get(deploy_name)
+            self.ops.append(op)
 
-        self.lock_fd.close()
-        return False
+    def _lookup(self, deploy_name):
+        with self.lock:
+            if deploy_name not in self._view:
+                self._view[deploy_name] = self.state.info(deploy_name)
+            return self._view[deploy_name]
 
+    def info(self, deploy_name):
+        """ Return status for a single service, including the changes of this transaction. """
 
-class DeployController:
-    """Manages the list of deployments."""
+        deploy_info = self._lookup(deploy_name)
 
-    DEPLOY_FILE_NAME = 'deploy.json'
+        if deploy_info is None:
+            raise GContainerException(ErrorConstants.NO_SUCH_DEPLOY, deploy_name)
 
-    def __init__(self, root):
-        self.root = root
-        self.deploy_file = FileSystemController.create_path_name(root, DeployController.DEPLOY_FILE_NAME)
+        return dict(deploy_info)
 
-        # if the deploy file does not exist, create it on the fly.
-        if not os.access(self.deploy_file, os.F_OK):
-            with self._create_lock(fcntl.LOCK_EX), open(self.deploy_file, 'w') as json_file:
-                json.dump(DeployStatus({}), json_file, indent=2)
-                json_file.flush()
+    def exists(self, deploy_name):
+        """ Check whether a given service exists, including the changes of this transaction. """
 
-    def _create_lock(self, mode):
-        """Returns a new deploy lock for use in with statements."""
-        return DeployLock(self.root, mode)
+        try:
+            self.info(deploy_name)
+            return True
+        except GContainerException:
+            return False
 
-    def _load_deploy(self):
-        """ Load the deployment file and does some very basic version checking. """
+    def add(self, service_name):
+        """Add a deployment."""
 
-        with self._create_lock(fcntl.LOCK_SH), open(self.deploy_file, 'r') as json_file:
-            file_contents = DeployStatus(json.load(json_file))
-            if file_contents[DeployStatus.VERSION_KEY] != DeployStatus.DEPLOY_VERSION:
-                raise GContainerException(ErrorConstants.BAD_DEPLOY_VERSION,
-                                          file_contents[DeployStatus.VERSION_KEY], DeployStatus.DEPLOY_VERSION)
+        deploy_info = {'name': service_name,
+                       'running': False,
+                       'enabled': False,
+                       'deployment': '-'
+                       }
 
-            return file_contents
+        self._record(add_op(service_name, deploy_info))
+        return dict(deploy_info)
 
-    def load(self):
-        """ Load the existing deployments as a dict. """
+    def remove(self, deploy_name):
+        """Remove a deployment."""
 
-        # _load_deploy does the required locking.
-        file_contents = self._load_deploy()
-        return file_contents[DeployStatus.DEPLOYS_KEY], file_contents[DeployStatus.COUNT_KEY]
+        self._record(remove_op(deploy_name))
 
-    def info(self, deploy_name):
-        """ Return status for a single service. """
+    def update(self, deploy_name, fields, removed_fields=()):
+        """Set fields of a deployment and remove the fields in removed_fields."""
 
-        # _load_deploy does the required locking.
-        file_contents = self._load_deploy()
-        if deploy_name not in file_contents[DeployStatus.DEPLOYS_KEY]:
-            raise GContainerException(ErrorConstants.NO_SUCH_DEPLOY, deploy_name)
+        self._record(update_op(deploy_name, fields, removed_fields))
 
-        return file_contents[DeployStatus.DEPLOYS_KEY][deploy_name]
+    def set_enabled(self, deploy_name, enabled=True):
+        """Mark a deployment as enabled."""
 
-    def exists(self, deploy_name):
-        """ Check whether a given service exists. """
+        self.update(deploy_name, {'enabled': enabled})
 
-        # _load_deploy does the required locking.
-        file_contents = self._load_deploy()
-        return deploy_name in file_contents[DeployStatus.DEPLOYS_KEY]
+    def set_running(self, deploy_name, running=True):
+        """Mark a deployment as running."""
 
-    def add(self, service_name):
-        """Add a deployment to the deployment file. The file is exclusively locked for writing. """
+        self.update(deploy_name, {'running': running})
 
-        with self._create_lock(fcntl.LOCK_EX):
-            file_contents = self._load_deploy()
-            deploys = file_contents[DeployStatus.DEPLOYS_KEY]
+    def save_deploy(self, deploy_name, deploy_id='-', callback_uri=None, callback_mode=None):
+        """Save deploy id and callback. The replaced deploy id goes to the front of the deploy history."""
 
-            if service_name in deploys:
-                raise GContainerException(ErrorConstants.DEPLOY_EXISTS, service_name)
+        deploy_info = self.info(deploy_name)
+        history = deploy_info.get('history', [])
+        if deploy_info['deployment'] not in ('-', deploy_id):
+            history = [deploy_info['deployment']] + history
 
-            deploy_info = {'name': service_name,
-                           'running': False,
-                           'enabled': False,
-                           'deployment': '-'
-                           }
+        # every deploy id is only listed once and the current one is not part of the history
+        history = [h for i, h in enumerate(history) if h != deploy_id and h not in history[:i]]
 
-            deploys[service_name] = deploy_info
+        fields = {'deployment': deploy_id, 'history': history[:DeployTransaction.HISTORY_SIZE]}
+        removed_fields = []
 
-            file_contents[DeployStatus.COUNT_KEY] += 1
-            file_contents[DeployStatus.DEPLOYS_KEY] = deploys
-            self._save_atomic(file_contents)
+        if callback_uri:
+            fields['callback_uri'] = callback_uri
+        else:
+            removed_fields.append('callback_uri')
 
-            return deploy_info
+        # the default mode (single) is not stored
+        if callback_uri and callback_mode and callback_mode != 'single':
+            fields['callback_mode'] = callback_mode
+        else:
+            removed_fields.append('callback_mode')
 
-    def remove(self, deploy_name):
-        """Remove a deployment from the deployment file. The file is exclusively locked for writing. """
+        self.update(deploy_name, fields, removed_fields=removed_fields)
 
-        with self._create_lock(fcntl.LOCK_EX):
-            file_contents = self._load_deploy()
-            deploys = file_contents[DeployStatus.DEPLOYS_KEY]
+    def commit(self):
+        """Write all collected changes."""
 
-            if deploy_name not in deploys:
-                raise GContainerException(ErrorConstants.NO_SUCH_DEPLOY, deploy_name)
+        with self.lock:
+            if self.ops:
+                self.state.apply(self.ops)
+            self.ops = []
+            self._view = {}
 
-            del deploys[deploy_name]
 
-            file_contents[DeployStatus.COUNT_KEY] += 1
-            file_contents[DeployStatus.DEPLOYS_KEY] = deploys
-            self._save_atomic(file_contents)
+class DeployController:
+    """Manages the list of deployments."""
 
-    def set_enabled(self, deploy_name, enabled=True):
-        """Mark a deployment as enabled."""
+    DEPLOY_FILE_NAME = JsonDeployState.DEPLOY_FILE_NAME
 
-        with self._create_lock(fcntl.LOCK_EX):
-            file_contents = self._load_deploy()
-            deploys = file_contents[DeployStatus.DEPLOYS_KEY]
+    # storage backends for the deployment state, selected with the [state] backend setting
+    Backends = {'json': _json_state,
+                'sqlite': _sqlite_state,
+                'sharded': _sharded_state}
 
-            if deploy_name not in deploys:
-                raise GContainerException(ErrorConstants.NO_SUCH_DEPLOY, deploy_name)
+    def __init__(self, root, backend='json', **options):
+        """options are passed on to the backend, the json backend takes the journal settings."""
 
-            deploys[deploy_name]['enabled'] = enabled
+        self.root = root
 
-            file_contents[DeployStatus.COUNT_KEY] += 1
-            file_contents[DeployStatus.DEPLOYS_KEY] = deploys
-            self._save_atomic(file_contents)
+        if backend not in DeployController.Backends:
+            raise GContainerException(ErrorConstants.UNKNOWN_STATE_BACKEND, backend)
 
-    def set_running(self, deploy_name, running=True):
-        """Mark a deployment as running."""
+        self.state = DeployController.Backends[backend](root, **options)
 
-        with self._create_lock(fcntl.LOCK_EX):
-            file_contents = self._load_deploy()
-            deploys = file_contents[DeployStatus.DEPLOYS_KEY]
+    @contextmanager
+    def transaction(self):
+        """Group changes to the deployment state:
 
-            if deploy_name not in deploys:
-                raise GContainerException(ErrorConstants.NO_SUCH_DEPLOY, deploy_name)
+        with ctx.deploy.transaction() as tx:
+            tx.set_running(service_name, True)
+            ...
 
-            deploys[deploy_name]['running'] = running
+        The changes are written when the with block ends and discarded if it raises an exception.
+        """
 
-            file_contents[DeployStatus.COUNT_KEY] += 1
-            file_contents[DeployStatus.DEPLOYS_KEY] = deploys
-            self._save_atomic(file_contents)
+        tx = DeployTransaction(self.state)
+        yield tx
+        tx.commit()
 
-    def save_deploy(self, deploy_name, deploy_id='-', callback_uri=None):
-        """Save deploy id."""
+    def load(self):
+        """ Load the existing deployments as a dict. """
 
-        with self._create_lock(fcntl.LOCK_EX):
-            file_contents = self._load_deploy()
-            deploys = file_contents[DeployStatus.DEPLOYS_KEY]
+        return self.state.load()
 
-            if deploy_name not in deploys:
-                raise GContainerException(ErrorConstants.NO_SUCH_DEPLOY, deploy_name)
+    def info(self, deploy_name):
+        """ Return status for a single service. """
 
-            deploys[deploy_name]['deployment'] = deploy_id
-            if callback_uri:
-                deploys[deploy_name]['callback_uri'] = callback_uri
-            elif 'callback_uri' in deploys[deploy_name]:
-                del deploys[deploy_name]['callback_uri']
+        deploy_info = self.state.info(deploy_name)
+        if deploy_info is None:
+            raise GContainerException(ErrorConstants.NO_SUCH_DEPLOY, deploy_name)
 
-            file_contents[DeployStatus.COUNT_KEY] += 1
-            file_contents[DeployStatus.DEPLOYS_KEY] = deploys
-            self._save_atomic(file_contents)
+        return deploy_info
 
-    def _save_atomic(self, file_contents):
-        """Do an atomic save and swap of the deploy file.
+    def exists(self, deploy_name):
+        """ Check whether a given service exists. """
 
-        This probably wants some error checking.
-        """
+        return self.state.exists(deploy_name)
+
+    def add(self, service_name):
+        """Add a deployment to the deployment state."""
+
+        with self.transaction() as tx:
+            return tx.add(service_name)
+
+    def remove(self, deploy_name):
+        """Remove a deployment from the deployment state."""
+
+        with self.transaction() as tx:
+            tx.remove(deploy_name)
+
+    def set_enabled(self, deploy_name, enabled=True):
+        """Mark a deployment as enabled."""
+
+        with self.transaction() as tx:
+            tx.set_enabled(deploy_name, enabled)
+
+    def set_running(self, deploy_name, running=True):
+        """Mark a deployment as running."""
 
-        new_file = self.deploy_file + ".new"
-        old_file = self.deploy_file + ".old"
+        with self.transaction() as tx:
+            tx.set_running(deploy_name, running)
 
-        with open(new_file, 'w') as new_json_file:
-            json.dump(file_contents, new_json_file, indent=2)
+    def save_deploy(self, deploy_name, deploy_id='-', callback_uri=None, callback_mode=None):
+        """Save deploy id and callback."""
 
-            if os.access(old_file, os.F_OK):
-                os.remove(old_file)
-            os.rename(self.deploy_file, old_file)
-            os.rename(new_file, self.deploy_file)
+        with self.transaction() as tx:
+            tx.save_deploy(deploy_name, deploy_id, callback_uri, callback_mode)
@@ -0,0 +1,443 @@
+import errno
+import fcntl
+import json
+import re
+import threading
+
+import os
+
+from collections import OrderedDict
+
+from .error import GContainerException, ErrorConstants
+from .file_manager import FileSystemController
+
+
+class DeployStatus(dict):
+    """Wrapper around a dictionary that ensures that the default keys are present with default values."""
+
+    DEPLOY_VERSION = 1
+
+    COUNT_KEY = 'count'
+    DEPLOYS_KEY = 'deploys'
+    VERSION_KEY = 'version'
+
+    def __init__(self, values={}):
+        super(DeployStatus, self).__init__(values)
+
+    @classmethod
+    def __missing__(cls, key):
+        if key == DeployStatus.COUNT_KEY:
+            return 0
+        elif key == DeployStatus.DEPLOYS_KEY:
+            return {}
+        elif key == DeployStatus.VERSION_KEY:
+            return DeployStatus.DEPLOY_VERSION
+
+
+class DeployLock():
+    """Lock for the deploy region to ensure single threaded access. """
+
+    LOCK_FILE_NAME = '.lock'
+
+    # File locks are held per process, so threads of the same process also need to lock each other out.
+    _thread_locks = {}
+    _thread_locks_lock = threading.Lock()
+
+    def __init__(self, root, mode, lock_file_name=LOCK_FILE_NAME):
+        self.lock_file = FileSystemController.create_path_name(root, lock_file_name)
+
+        with DeployLock._thread_locks_lock:
+            self.thread_lock = DeployLock._thread_locks.setdefault(self.lock_file, threading.Lock())
+
+        self.mode = mode
+        self.lock_fd = None
+
+    def __enter__(self):
+        if self.lock_fd is not None:
+            raise GContainerException(ErrorConstants.ANOTHER_OPERATION_IN_PROGRESS)
+
+        self.thread_lock.acquire()
+        try:
+            while not self._lock():
+                self.lock_fd.close()
+                self.lock_fd = None
+        except Exception:
+            if self.lock_fd is not None:
+                self.lock_fd.close()
+                self.lock_fd = None
+            self.thread_lock.release()
+            raise
+
+    def _lock(self):
+        """Open and lock the lock file. Returns false if the lock file was removed while waiting for the lock
+        (see ShardedDeployState), the lock must then be taken again on the new file."""
+
+        # create lock file if it does not exist.
+        if not os.access(self.lock_file, os.F_OK):
+            with open(self.lock_file, "w"):
+                pass
+
+        try:
+            if self.mode == fcntl.LOCK_EX:
+                self.lock_fd = open(self.lock_file, "w")
+            else:
+                self.lock_fd = open(self.lock_file, "r")
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return self._lock()
+            raise
+
+        fcntl.lockf(self.lock_fd, self.mode)
+
+        try:
+            return os.stat(self.lock_file).st_ino == os.fstat(self.lock_fd.fileno()).st_ino
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return False
+            raise
+
+    def __exit__(self, type, val, tb):
+        if self.lock_fd is None:
+            raise GContainerException(ErrorConstants.LOCK_UNAVAILABLE)
+
+        self.lock_fd.close()
+        self.thread_lock.release()
+        return False
+
+
+# Mutations of the deployment state. A mutation is a list (so that it can be stored as JSON) of the action, the
+# service name and the action arguments. All backends apply a list of mutations atomically.
+
+ADD = 'add'
+REMOVE = 'remove'
+UPDATE = 'update'
+
+
+def add_op(deploy_name, deploy_info):
+    """Mutation that adds a new deploy record."""
+    return [ADD, deploy_name, deploy_info]
+
+
+def remove_op(deploy_name):
+    """Mutation that removes an existing deploy record."""
+    return [REMOVE, deploy_name]
+
+
+def update_op(deploy_name, fields, removed_fields=()):
+    """Mutation that sets fields of an existing deploy record and removes the fields in removed_fields."""
+    return [UPDATE, deploy_name, fields, list(removed_fields)]
+
+
+def apply_ops(deploys, ops):
+    """Apply a list of mutations to a dict of deploy records (indexed by name)."""
+
+    for op in ops:
+        action, deploy_name = op[0], op[1]
+
+        if action == ADD:
+            if deploy_name in deploys:
+                raise GContainerException(ErrorConstants.DEPLOY_EXISTS, deploy_name)
+            deploys[deploy_name] = dict(op[2])
+
+        elif deploy_name not in deploys:
+            raise GContainerException(ErrorConstants.NO_SUCH_DEPLOY, deploy_name)
+
+        elif action == REMOVE:
+            del deploys[deploy_name]
+
+        elif action == UPDATE:
+            deploys[deploy_name].update(op[2])
+            for field in op[3]:
+                deploys[deploy_name].pop(field, None)
+
+    return deploys
+
+
+def migrate_json_state(root, store):
+    """One-shot migration of an existing deploy.json file into another backend.
+
+    store is called with the deploy records (including the journal) and the count while the json lock is held.
+    It must only return once the records are stored for good (e.g. committed). Then the deploy file and the
+    journal are renamed so that they are not migrated a second time. If store raises, they stay in place.
+    Returns false if there was nothing to migrate.
+    """
+
+    deploy_file = FileSystemController.create_path_name(root, JsonDeployState.DEPLOY_FILE_NAME)
+    if not os.access(deploy_file, os.F_OK):
+        return False
+
+    # keep json writers out until the files have been moved away
+    with DeployLock(root, fcntl.LOCK_EX):
+        # another process may have migrated the files in the meantime
+        if not os.access(deploy_file, os.F_OK):
+            return False
+
+        json_state = JsonDeployState(root)
+        file_contents = json_state._load_deploy(lock=False)
+
+        store(file_contents[DeployStatus.DEPLOYS_KEY], file_contents[DeployStatus.COUNT_KEY])
+
+        os.rename(deploy_file, deploy_file + JsonDeployState.MIGRATED_SUFFIX)
+        if os.access(json_state.journal_file, os.F_OK):
+            os.rename(json_state.journal_file, json_state.journal_file + JsonDeployState.MIGRATED_SUFFIX)
+
+    return True
+
+
+class DeployState(object):
+    """Storage backend for the deployment state.
+
+    Backends store one record (a dict) per service and a count that is increased with every change."""
+
+    def load(self):
+        """Return all deploy records as a dict indexed by name and the current count."""
+        raise NotImplementedError()
+
+    def info(self, deploy_name):
+        """Return the deploy record for a service or None if the service does not exist."""
+        raise NotImplementedError()
+
+    def exists(self, deploy_name):
+        """Check whether a given service exists."""
+        return self.info(deploy_name) is not None
+
+    def apply(self, ops):
+        """Apply a list of mutations atomically. Either all mutations are applied or none."""
+        raise NotImplementedError()
+
+
+class JsonDeployState(DeployState):
+    """Keeps all deploy records in a single JSON file.
+
+    Without the journal, every change rewrites the whole file. With the journal, changes are appended as small
+    records (the count and the mutations) to a journal file next to the deploy file. Readers replay the journal
+    on top of the deploy file (the snapshot). Once the journal grows past journal_compact_size bytes, the next
+    change writes a new snapshot and empties the journal.
+
+    Journal records that are already contained in the snapshot (their count is not larger than the snapshot
+    count) are skipped, so a compaction that is interrupted between writing the snapshot and emptying the
+    journal loses nothing. An incomplete last record (a crash while appending) is ignored and overwritten by
+    the next change.
+    """
+
+    DEPLOY_FILE_NAME = 'deploy.json'
+    JOURNAL_FILE_NAME = 'deploy.journal'
+    MIGRATED_SUFFIX = '.migrated'
+
+    JOURNAL_COMPACT_SIZE = 65536
+
+    # The count is written first (see _dump), so it can be read from the head of the file without parsing it.
+    COUNT_HEAD_SIZE = 64
+    COUNT_HEAD_PATTERN = re.compile(r'\s*\{\s*"%s":\s*(\d+)' % DeployStatus.COUNT_KEY)
+
+    def __init__(self, root, journal=False, journal_fsync=False, journal_compact_size=JOURNAL_COMPACT_SIZE):
+        self.root = root
+        self.deploy_file = FileSystemController.create_path_name(root, JsonDeployState.DEPLOY_FILE_NAME)
+        self.journal_file = FileSystemController.create_path_name(root, JsonDeployState.JOURNAL_FILE_NAME)
+
+        self.journal = journal
+        self.journal_fsync = journal_fsync
+        self.journal_compact_size = journal_compact_size
+
+        # Current state as (snapshot key, journal offset, contents), see _current.
+        self._cache = None
+
+        # if the deploy file does not exist, create it on the fly.
+        if not os.access(self.deploy_file, os.F_OK):
+            with self._create_lock(fcntl.LOCK_EX), open(self.deploy_file, 'w') as json_file:
+                JsonDeployState._dump(DeployStatus({}), json_file)
+                json_file.flush()
+
+    def _create_lock(self, mode):
+        """Returns a new deploy lock for use in with statements."""
+        return DeployLock(self.root, mode)
+
+    @classmethod
+    def _dump(cls, file_contents, json_file):
+        """Write the file contents with the count as the first key."""
+        ordered = OrderedDict([(DeployStatus.COUNT_KEY, file_contents[DeployStatus.COUNT_KEY])])
+        ordered.update(sorted(file_contents.iteritems()))
+        json.dump(ordered, json_file, indent=2)
+
+    @classmethod
+    def _file_key(cls, json_file):
+        """Identifies a version of the deploy file by inode, mtime and count. Every save writes a new file,
+        but inodes are reused and two saves can share an mtime, so the count tells them apart.
+
+        Returns None if the count can not be read (a file written by an older version), which never matches.
+        The file position is left at the start of the file.
+        """
+
+        stat = os.fstat(json_file.fileno())
+        match = JsonDeployState.COUNT_HEAD_PATTERN.match(json_file.read(JsonDeployState.COUNT_HEAD_SIZE))
+        json_file.seek(0)
+        return None if match is None else (stat.st_ino, stat.st_mtime, int(match.group(1)))
+
+    def _journal_size(self):
+        try:
+            return os.stat(self.journal_file).st_size
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return 0
+            raise
+
+    @classmethod
+    def _copy(cls, file_contents):
+        """Copy the file contents down to the deploy records, so callers can modify what they get."""
+
+        contents = DeployStatus(file_contents)
+        contents[DeployStatus.DEPLOYS_KEY] = dict((name, dict(deploy_info)) for name, deploy_info
+                                                  in file_contents[DeployStatus.DEPLOYS_KEY].iteritems())
+        return contents
+
+    def _remember(self, key, offset, file_contents):
+        self._cache = (key, offset, file_contents)
+
+    def _current(self, lock=True):
+        """ Return the current state as (snapshot key, journal offset, contents). The contents must not be
+        modified.
+
+        The state is cached. As long as the deploy file has not been replaced (same inode, mtime and count) and
+        the journal has not grown, the cached state is returned without locking or parsing anything. If only
+        the journal has grown, just the new journal records are read. Changes from other processes are picked
+        up by the next call.
+
+        Callers that already hold the exclusive lock must pass lock=False. Locks are held per process, so
+        taking and releasing a shared lock would drop the exclusive lock as well.
+        """
+
+        cache = self._cache
+        if cache is not None and cache[0] is not None:
+            with open(self.deploy_file, 'r') as json_file:
+                key = JsonDeployState._file_key(json_file)
+            if cache[0] == key and cache[1] == self._journal_size():
+                return cache
+
+        if lock:
+            with self._create_lock(fcntl.LOCK_SH):
+                return self._current(lock=False)
+
+        with open(self.deploy_file, 'r') as json_file:
+            key = JsonDeployState._file_key(json_file)
+
+            if cache is not None and key is not None and cache[0] == key:
+                file_contents, offset = JsonDeployState._copy(cache[2]), cache[1]
+            else:
+                # copying fills in the deploy records, the journal is replayed onto them
+                file_contents, offset = JsonDeployState._copy(DeployStatus(json.load(json_file))), 0
+                if file_contents[DeployStatus.VERSION_KEY] != DeployStatus.DEPLOY_VERSION:
+                    raise GContainerException(ErrorConstants.BAD_DEPLOY_VERSION,
+                                              file_contents[DeployStatus.VERSION_KEY], DeployStatus.DEPLOY_VERSION)
+
+        offset = self._replay(file_contents, offset)
+        self._remember(key, offset, file_contents)
+        return self._cache
+
+    def _replay(self, file_contents, offset):
+        """Apply the journal records after offset to the file contents. Returns the offset after the last
+        complete record."""
+
+        try:
+            journal_file = open(self.journal_file, 'r')
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return offset
+            raise
+
+        with journal_file:
+            journal_file.seek(offset)
+            while True:
+                line = journal_file.readline()
+                if not line.endswith('\n'):
+                    break
+
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+
+                if record[DeployStatus.COUNT_KEY] > file_contents[DeployStatus.COUNT_KEY]:
+                    apply_ops(file_contents[DeployStatus.DEPLOYS_KEY], record['ops'])
+                    file_contents[DeployStatus.COUNT_KEY] = record[DeployStatus.COUNT_KEY]
+
+                offset += len(line)
+
+        return offset
+
+    def _load_deploy(self, lock=True):
+        """ Load the deployment state and does some very basic version checking. """
+        return JsonDeployState._copy(self._current(lock)[2])
+
+    def load(self):
+        file_contents = self._current()[2]
+        return JsonDeployState._copy(file_contents)[DeployStatus.DEPLOYS_KEY], file_contents[DeployStatus.COUNT_KEY]
+
+    def info(self, deploy_name):
+        deploy_info = self._current()[2][DeployStatus.DEPLOYS_KEY].get(deploy_name)
+        return None if deploy_info is None else dict(deploy_info)
+
+    def apply(self, ops):
+        """Apply the mutations to the deploy file or append them to the journal. The file is exclusively locked
+        for writing."""
+
+        with self._create_lock(fcntl.LOCK_EX):
+            key, offset, file_contents = self._current(lock=False)
+            file_contents = JsonDeployState._copy(file_contents)
+
+            apply_ops(file_contents[DeployStatus.DEPLOYS_KEY], ops)
+            file_contents[DeployStatus.COUNT_KEY] += 1
+
+            record = json.dumps({DeployStatus.COUNT_KEY: file_contents[DeployStatus.COUNT_KEY], 'ops': ops}) + '\n'
+
+            if self.journal and offset + len(record) <= self.journal_compact_size:
+                self._append(key, offset, record, file_contents)
+            else:
+                self._save_atomic(file_contents)
+
+    def _append(self, key, offset, record, file_contents):
+        """Append a record to the journal, dropping an incomplete record left behind by a crash."""
+
+        with open(self.journal_file, 'a') as journal_file:
+            if self._journal_size() != offset:
+                os.ftruncate(journal_file.fileno(), offset)
+
+            journal_file.write(record)
+            journal_file.flush()
+            if self.journal_fsync:
+                os.fsync(journal_file.fileno())
+
+        self._remember(key, offset + len(record), file_contents)
+
+    def _save_atomic(self, file_contents):
+        """Do an atomic save and swap of the deploy file and empty the journal.
+
+        This probably wants some error checking.
+        """
+
+        new_file = self.deploy_file + ".new"
+        old_file = self.deploy_file + ".old"
+
+        # the cached state is replaced with what is written, or dropped if the save fails
+        self._cache = None
+
+        with open(new_file, 'w') as new_json_file:
+            JsonDeployState._dump(file_contents, new_json_file)
+
+            # the journal is emptied next, so the snapshot must be on disk before
+            if self.journal_fsync:
+                new_json_file.flush()
+                os.fsync(new_json_file.fileno())
+
+            if os.access(old_file, os.F_OK):
+                os.remove(old_file)
+            os.rename(self.deploy_file, old_file)
+            os.rename(new_file, self.deploy_file)
+
+        # the new snapshot contains all journal records, they would be skipped from now on
+        if os.access(self.journal_file, os.F_OK):
+            with open(self.journal_file, 'w'):
+                pass
+
+        # writers hold the exclusive lock, so the file can not have been replaced since
+        with open(self.deploy_file, 'r') as json_file:
+            self._remember(JsonDeployState._file_key(json_file), 0, file_contents)
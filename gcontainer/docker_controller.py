@@ -1,11 +1,17 @@
+import hashlib
 import json
+import threading
+import time
 import click
 import urllib3.contrib.pyopenssl
 
 from docker import Client
-from docker.utils.utils import parse_repository_tag, create_host_config
+from docker.errors import APIError
+from docker.utils.utils import parse_repository_tag, create_container_config, create_host_config
 
 from .error import GContainerException, ErrorConstants
+from .progress import ProgressRenderer, PullProgress, StreamDecoder
+from .util import REPLACEMENT_SUFFIX, RETIRED_SUFFIX
 
 
 class Docker:
@@ -17,14 +23,40 @@ class Docker:
 
     def __init__(self, ctx):
         self.docker_socket = ctx.config.get('docker', 'socket')
+        self.parallelism = int(ctx.config.get('docker', 'parallelism'))
+        self.pull_parallelism = int(ctx.config.get('docker', 'pull_parallelism'))
+        self.pull_policy = ctx.config.get('docker', 'pull_policy')
         self.ctx = ctx
         self.cli = Client(base_url=self.docker_socket,
                           version='auto')
 
         urllib3.contrib.pyopenssl.inject_into_urllib3()
 
+        # Container inventory for the current command. The container list is loaded with a single
+        # API call on first use and containers are only inspected when a caller needs their details.
+        self._containers = None
+        self._inspected = {}
+        self._inventory_lock = threading.Lock()
+
+    # container events that change the state of a service, see events
+    WATCH_EVENTS = ('start', 'die', 'oom')
+
+    # label with the fingerprint of the image and the configuration a container was created from
+    FINGERPRINT_LABEL = 'gcontainer.fingerprint'
+
+    # container names of the new and the old container while a service is restarted, see replace_container
+    REPLACEMENT_SUFFIX = REPLACEMENT_SUFFIX
+    RETIRED_SUFFIX = RETIRED_SUFFIX
+
+    # always pulls, if-missing only pulls images that are not in the local image store, never does not pull
+    PULL_POLICIES = ('always', 'if-missing', 'never')
+
     def _parse_deploy_id(self, deploy_id):
-        """Read a full deploy uri with tag and split into repository reference and tag."""
+        """Read a full deploy uri with tag (or digest) and split into repository reference and tag."""
+
+        # images pinned by digest (repo@sha256:...) are pulled with the digest as the tag
+        if '@' in deploy_id:
+            return tuple(deploy_id.split('@', 1))
 
         (repo, tag) = parse_repository_tag(deploy_id)
         disable_latest_tag = self.ctx.config.get('docker', 'disable_latest_tag') == 'True'
@@ -53,17 +85,51 @@ class Docker:
 
         return create_host_config(binds=binds, network_mode='host')
 
+    def _inventory(self):
+        """Return all containers known to the docker daemon indexed by name. The list is loaded once per command."""
+
+        with self._inventory_lock:
+            if self._containers is None:
+                containers = {}
+                for container in self.cli.containers(all=True):
+                    for name in container.get('Names') or []:
+                        # linked containers show up as '/<container>/<alias>', only the first level is a name
+                        name = name.lstrip('/')
+                        if '/' not in name:
+                            containers[name] = container
+
+                self._containers = containers
+
+        return self._containers
+
     def _info(self, service_name):
         """Inspect a docker container through the API and return its current state."""
 
-        container_name = "/%s" % service_name
-        containers = self.cli.containers(all=True)
-        for container in containers:
-            names = container.get('Names')
-            if container_name in names:
-                return self.cli.inspect_container(service_name)
+        if service_name not in self._inspected:
+            container_info = None
+            if service_name in self._inventory():
+                container_info = self.cli.inspect_container(service_name)
 
-        return None
+            self._inspected[service_name] = container_info
+
+        return self._inspected[service_name]
+
+    def _changed(self, service_name, container=None, removed=False):
+        """Update the inventory after the container for a service was created, removed or changed state."""
+
+        self._inspected.pop(service_name, None)
+
+        if self._containers is not None:
+            if removed:
+                self._containers.pop(service_name, None)
+            elif container is not None:
+                self._containers[service_name] = container
+
+    def refresh(self):
+        """Drop the container inventory. The next call reloads it from the docker daemon."""
+
+        self._containers = None
+        self._inspected = {}
 
     def connected(self):
         """Returns true if the API is connected to the docker daemon."""
@@ -82,6 +148,38 @@ class Docker:
             return container_info['State']['Running']
         return False
 
+    def readiness(self, service_name):
+        """Returns the readiness of the container for the given service name: 'stopped', 'running' for a
+        running container without a healthcheck or the health status ('starting', 'healthy', 'unhealthy').
+        The container is always inspected again."""
+
+        self._changed(service_name)
+        container_info = self._info(service_name)
+        if not container_info or not container_info['State']['Running']:
+            return 'stopped'
+
+        health = container_info['State'].get('Health')
+        if health:
+            return health['Status']
+        return 'running'
+
+    def containers(self):
+        """Returns whether the container of every service is running and its image, from a single API call."""
+
+        return dict((name, {'running': (container.get('Status') or '').startswith('Up'),
+                            'image': container.get('Image')})
+                    for name, container in self._inventory().items())
+
+    def image_references(self):
+        """Returns all tags and digests of the local images, from a single API call."""
+
+        references = set()
+        for image in self.cli.images():
+            references.update(image.get('RepoTags') or [])
+            references.update(image.get('RepoDigests') or [])
+
+        return references
+
     def status(self, service_name):
         """Returns a somewhat sanitized status dict for a given service."""
 
@@ -102,43 +200,224 @@ class Docker:
 
         return status
 
-    def pull_image(self, deploy_id):
-        """Pull an image referenced by the deploy_id from a repo server and make it available for local deploy."""
+    def events(self, since=None):
+        """Stream the start, die and oom events of all containers. Ends when the docker daemon closes the stream."""
+
+        decoder = StreamDecoder()
+        for chunk in self.cli.events(since=since, filters={'event': list(Docker.WATCH_EVENTS)}):
+            for event in decoder.feed(chunk):
+                yield event
+
+    def service_name(self, container_id):
+        """Returns the service name for a container id or None if it is not the container of a service."""
+
+        for reload_inventory in (False, True):
+            # the container may have been created after the inventory was loaded
+            if reload_inventory:
+                self.refresh()
+
+            for name, container in self._inventory().items():
+                if container['Id'] == container_id:
+                    return name
+
+        return None
+
+    def has_image(self, deploy_id):
+        """Returns true if the image (by repo:tag or digest) is in the local image store."""
+
+        return self._image_id(deploy_id) is not None
+
+    def ensure_image(self, deploy_id, pull_policy=None, renderer=None):
+        """Make the image for the deploy_id available according to the pull policy (default: the configured
+        policy). Returns true if the image was pulled."""
+
+        pull_policy = pull_policy or self.pull_policy
+        if pull_policy not in Docker.PULL_POLICIES:
+            raise GContainerException(ErrorConstants.UNKNOWN_PULL_POLICY, pull_policy)
+
+        # check the deploy id even if nothing is pulled
+        self._parse_deploy_id(deploy_id)
+
+        if pull_policy != 'always' and self.has_image(deploy_id):
+            return False
+
+        if pull_policy == 'never':
+            raise GContainerException(ErrorConstants.IMAGE_NOT_AVAILABLE, deploy_id, 'not in the local image store')
+
+        self.pull_image(deploy_id, renderer)
+        return True
+
+    def pull_image(self, deploy_id, renderer=None):
+        """Pull an image referenced by the deploy_id from a repo server and make it available for local deploy.
+
+        The progress stream is decoded as it arrives and only the aggregated state of the layers is kept,
+        see PullProgress. The renderer shows the progress while the image is pulled. Returns the summary
+        of the pull."""
 
         (repo, tag) = self._parse_deploy_id(deploy_id)
 
-        msg = []
-        errors = []
-        allow_insecure_registry = self.ctx.config.get('docker', 'allow_insecure_registry') == 'True'
-        for line in self.cli.pull(repository=repo,
-                                  tag=tag,
-                                  stream=True,
-                                  insecure_registry=allow_insecure_registry):
-            fields = json.loads(line)
-            if 'status' in fields:
-                msg.append(fields['status'])
+        renderer = renderer or ProgressRenderer()
+        progress = PullProgress(deploy_id)
+        decoder = StreamDecoder()
+
+        renderer.start(progress)
+        try:
+            allow_insecure_registry = self.ctx.config.get('docker', 'allow_insecure_registry') == 'True'
+            for chunk in self.cli.pull(repository=repo,
+                                       tag=tag,
+                                       stream=True,
+                                       insecure_registry=allow_insecure_registry):
+                for fields in decoder.feed(chunk):
+                    progress.update(fields)
+                    renderer.update(progress, fields)
+
+                    if self.ctx.raw:
+                        click.echo(json.dumps(fields))
+        finally:
+            renderer.finish(progress)
+
+        if progress.errors:
+            raise GContainerException(ErrorConstants.IMAGE_NOT_AVAILABLE, deploy_id, progress.errors)
+        return progress.summary()
 
-            if 'error' in fields:
-                errors.append(fields['error'])
+    def repository(self, deploy_id):
+        """Returns the repository of a deploy id (repo:tag or repo@digest)."""
+
+        if '@' in deploy_id:
+            return deploy_id.split('@', 1)[0]
+
+        return parse_repository_tag(deploy_id)[0]
+
+    def _image_id(self, image):
+        """Returns the id of an image (by repo:tag, digest or id) or None if it is not in the local image store."""
+
+        try:
+            return self.cli.inspect_image(image)['Id']
+        except APIError as e:
+            if e.response is not None and e.response.status_code == 404:
+                return None
+            raise
 
-            if self.ctx.raw:
-                click.echo(json.dumps(fields, indent=2))
+    def unused_images(self, keep, repositories):
+        """Returns the local images of the given repositories that are not in keep (deploy ids) and not used
+        by any container, oldest first. Every image is returned with the tags in these repositories."""
 
-        if errors:
-            raise GContainerException(ErrorConstants.IMAGE_NOT_AVAILABLE, deploy_id, errors)
-        return msg
+        used = set(keep) | set(container['Image'] for container in self._inventory().values())
+        used_ids = set(self._image_id(image) for image in used)
 
-    def create_container(self, service_name, deploy_id, destroy_existing=True, environment={}):
+        images = []
+        for image in sorted(self.cli.images(), key=lambda image: image.get('Created', 0)):
+            if image['Id'] in used_ids:
+                continue
+
+            tags = [tag for tag in image.get('RepoTags') or [] if self.repository(tag) in repositories]
+            if tags:
+                images.append({'id': image['Id'],
+                               'tags': sorted(tags),
+                               'size': image.get('VirtualSize', image.get('Size', 0))})
+
+        return images
+
+    def remove_image(self, tag):
+        """Remove an image tag. The image itself is removed with its last tag."""
+
+        try:
+            self.cli.remove_image(tag)
+        except APIError as e:
+            raise GContainerException(ErrorConstants.IMAGE_NOT_REMOVED, tag, e)
+
+    def _fingerprint(self, deploy_id, environment, host_config):
+        """Returns a fingerprint of the image id, the environment and the host configuration (binds, network)
+        of a container."""
+
+        fingerprint = json.dumps({'image': self._image_id(deploy_id),
+                                  'environment': environment,
+                                  'host_config': host_config},
+                                 sort_keys=True)
+
+        return hashlib.sha256(fingerprint).hexdigest()
+
+    def create_container(self, service_name, deploy_id, destroy_existing=True, environment={}, container_name=None,
+                         recreate=False):
         """Create a new container instance for the given container. If necessary, destroy an
-        existing container for the same service."""
+        existing container for the same service. The container is named after the service unless
+        a container_name is given.
+
+        An existing container that was created from the same image, environment and host configuration
+        is kept (unless recreate is set), so it keeps its writable layer. Returns true if a new container
+        was created."""
+
+        container_name = container_name or service_name
+        host_config = self._host_config(service_name)
+        fingerprint = self._fingerprint(deploy_id, environment, host_config)
+
+        container_info = self._info(container_name)
+        if container_info and not recreate:
+            labels = container_info['Config'].get('Labels') or {}
+            if labels.get(Docker.FINGERPRINT_LABEL) == fingerprint:
+                return False
 
         if destroy_existing:
-            self.destroy_container(service_name)
+            self.destroy_container(container_name)
+
+        # docker-py does not support labels, they are added to the container configuration
+        config = create_container_config(self.cli._version, deploy_id, None,
+                                         environment=environment,
+                                         host_config=host_config)
+        config['Labels'] = {Docker.FINGERPRINT_LABEL: fingerprint}
+
+        container = self.cli.create_container_from_config(config, container_name)
+
+        self._changed(container_name, container={'Id': container['Id'], 'Names': ['/%s' % container_name]})
+        return True
+
+    def prepare_container(self, service_name, deploy_id, environment={}):
+        """Create the replacement container for a service next to its running container, see replace_container.
+        A replacement left over from a failed restart is destroyed first."""
+
+        self.create_container(service_name, deploy_id,
+                              environment=environment,
+                              container_name=service_name + Docker.REPLACEMENT_SUFFIX,
+                              recreate=True)
+
+    def replace_container(self, service_name):
+        """Replace the running container of a service with the container created by prepare_container. The
+        old container is stopped and moved aside, the replacement takes its name and is started. The old
+        container is only removed after the replacement started. If any step fails, the renames are undone
+        and the old container is started again.
+
+        Returns the seconds between stopping the old and starting the new container."""
+
+        replacement = service_name + Docker.REPLACEMENT_SUFFIX
+        retired = service_name + Docker.RETIRED_SUFFIX
+
+        self.destroy_container(retired)
+
+        # (old name, new name) of the renames done so far
+        renamed = []
+
+        stopped = time.time()
+        try:
+            self.cli.stop(service_name)
+
+            for name, new_name in ((service_name, retired), (replacement, service_name)):
+                self.cli.rename(name, new_name)
+                renamed.append((name, new_name))
+
+            self.cli.start(service_name)
+            downtime = time.time() - stopped
+        except Exception:
+            for name, new_name in reversed(renamed):
+                self.cli.rename(new_name, name)
+
+            if not self.cli.inspect_container(service_name)['State']['Running']:
+                self.cli.start(service_name)
+            raise
+        finally:
+            self.refresh()
 
-        self.cli.create_container(image=deploy_id,
-                                  name=service_name,
-                                  environment=environment,
-                                  host_config=self._host_config(service_name))
+        self.destroy_container(retired)
+        return downtime
 
     def destroy_container(self, service_name):
         """Remove an existing container for the given service name."""
@@ -146,6 +425,7 @@ class Docker:
         container_info = self._info(service_name)
         if container_info:
             self.cli.remove_container(service_name)
+            self._changed(service_name, removed=True)
 
     def start(self, service_name):
         """Start a container for the given service name. The container must be created first."""
@@ -153,6 +433,7 @@ class Docker:
         container_info = self._info(service_name)
         if container_info:
             self.cli.start(service_name)
+            self._changed(service_name)
 
     def stop(self, service_name):
         """Stop a container for the given serivce name if it exists and is running."""
@@ -162,6 +443,7 @@ class Docker:
         if container_info:
             self.cli.stop(service_name)
             result = container_info['State']['Running']
+            self._changed(service_name)
 
         return result
 
@@ -172,3 +454,4 @@ class Docker:
         container_info = self._info(service_name)
         if container_info:
             self.cli.wait(service_name)
+            self._changed(service_name)
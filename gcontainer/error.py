@@ -16,6 +16,9 @@ class ErrorConstants(Enum):
     GENERAL_ERROR = 1
     OS_ERROR = 2
     MUST_RUN_AS_ROOT = 3
+    SERVICES_FAILED = 4
+    UNKNOWN_FIELD = 5
+    IMAGES_NOT_REMOVED = 6
 
     # file system manager error codes
     PATH_EXISTS = 100
@@ -35,6 +38,8 @@ class ErrorConstants(Enum):
     DEPLOY_EXISTS = 202
     ANOTHER_OPERATION_IN_PROGRESS = 203
     LOCK_UNAVAILABLE = 204
+    UNKNOWN_STATE_BACKEND = 205
+    DEPLOY_NOT_SAVED = 206
 
     # docker error codes
     DOCKER_NOT_CONNECTED = 300
@@ -43,16 +48,32 @@ class ErrorConstants(Enum):
     LATEST_TAG_DISABLED = 303
     IMAGE_NOT_AVAILABLE = 304
     NO_IMAGE_ASSIGNED = 305
+    UNKNOWN_PULL_POLICY = 306
+    SERVICE_NOT_READY = 307
+    IMAGE_NOT_REMOVED = 308
 
     # config error codes
     ILLEGAL_CONFIG_NAME = 400
     ILLEGAL_SERVICE_NAME = 401
 
+    # boot error codes
+    DEPENDENCY_FAILED = 500
+    DEPENDENCY_CYCLE = 501
+
+    # systemd error codes
+    UNKNOWN_SYSTEMD_BACKEND = 600
+    SYSTEMD_NOT_AVAILABLE = 601
+    UNKNOWN_UNIT_MODE = 602
+    SYSTEMD_CALL_FAILED = 603
+
     @property
     def template(self):
         _templates = {
             ErrorConstants.GENERAL_ERROR: 'General Error appears. He hands you an exception.',
             ErrorConstants.MUST_RUN_AS_ROOT: 'This tool must be executed as superuser.',
+            ErrorConstants.SERVICES_FAILED: "%d of %d services failed.",
+            ErrorConstants.IMAGES_NOT_REMOVED: "%d of %d images not removed.",
+            ErrorConstants.UNKNOWN_FIELD: "unknown field '%s', known fields are %s.",
             ErrorConstants.PATH_EXISTS: "path '%s' already exists.",
             ErrorConstants.PATH_NOT_EXISTS: "path '%s' does not exist.",
             ErrorConstants.FOLDER_NOT_ACCESSIBLE: "cannot access folder '%s'.",
@@ -67,6 +88,8 @@ class ErrorConstants(Enum):
             ErrorConstants.DEPLOY_EXISTS: "deploy '%s' already exists.",
             ErrorConstants.ANOTHER_OPERATION_IN_PROGRESS: "another exclusive operation is in progress.",
             ErrorConstants.LOCK_UNAVAILABLE: "could not acquire deployment lock.",
+            ErrorConstants.UNKNOWN_STATE_BACKEND: "unknown deployment state backend '%s'.",
+            ErrorConstants.DEPLOY_NOT_SAVED: "deploy of '%s' not saved, not all images could be pulled.",
             ErrorConstants.BAD_DEPLOY_VERSION: "deploy file version is %s, only version %s is supported.",
             ErrorConstants.DOCKER_NOT_CONNECTED: "docker daemon not available.",
             ErrorConstants.SERVICE_IS_RUNNING: "service '%s' is running.",
@@ -74,8 +97,17 @@ class ErrorConstants(Enum):
             ErrorConstants.LATEST_TAG_DISABLED: "'latest' tag is disabled and can not be used for a deploy.",
             ErrorConstants.IMAGE_NOT_AVAILABLE: "docker image '%s' not available (%s).",
             ErrorConstants.NO_IMAGE_ASSIGNED: "no docker image assigned for '%s'.",
+            ErrorConstants.UNKNOWN_PULL_POLICY: "unknown pull policy '%s'.",
+            ErrorConstants.SERVICE_NOT_READY: "service '%s' is not ready after %s seconds (%s).",
+            ErrorConstants.IMAGE_NOT_REMOVED: "docker image '%s' not removed (%s).",
             ErrorConstants.ILLEGAL_CONFIG_NAME: "configuration name '%s' is illegal.",
             ErrorConstants.ILLEGAL_SERVICE_NAME: "service name '%s' is illegal.",
+            ErrorConstants.DEPENDENCY_FAILED: "service '%s' was not started, '%s' failed to start.",
+            ErrorConstants.DEPENDENCY_CYCLE: "service '%s' is part of or depends on a dependency cycle.",
+            ErrorConstants.UNKNOWN_SYSTEMD_BACKEND: "unknown systemd backend '%s'.",
+            ErrorConstants.SYSTEMD_NOT_AVAILABLE: "systemd is not available through D-Bus (%s).",
+            ErrorConstants.UNKNOWN_UNIT_MODE: "unknown systemd unit mode '%s'.",
+            ErrorConstants.SYSTEMD_CALL_FAILED: "systemd call %s failed (%s).",
         }
 
         if self in _templates:
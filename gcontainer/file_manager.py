@@ -1,5 +1,4 @@
 import shutil
-import iso8601
 import os
 import os.path
 
@@ -24,6 +23,7 @@ class FileSystemController:
         self.log_dir = FileSystemController._create_folder(self.root, ctx.config.get('layout', 'log_dir'))
         self.script_dir = FileSystemController._create_folder(self.root, ctx.config.get('layout', 'script_dir'))
         self.archive_dir = FileSystemController._create_folder(self.root, ctx.config.get('layout', 'archive_dir'))
+        self.spool_dir = FileSystemController._create_folder(self.root, ctx.config.get('layout', 'spool_dir'))
 
     @classmethod
     def create_path_name(cls, base, path=None):
@@ -224,6 +224,7 @@ class FileSystemController:
 
         contents[current]['current'] = True
 
+        import iso8601
         configs = sorted(contents.values(), key=lambda config: iso8601.parse_date(config['mtime']))
 
         return configs
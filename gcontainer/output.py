@@ -43,31 +43,8 @@ def error_wrapper(f, ctx, *args, **kwargs):
     else:
         try:
             return f(*args, **kwargs)
-
-        except (OSError, IOError) as e:
-            result = {
-                'error_code': ErrorConstants.OS_ERROR.value,
-                'strerror': e.strerror,
-                'errno': e.errno,
-                'filename': e.filename,
-                'msg': str(e)
-            }
-
-        except GContainerException as e:
-            result = {
-                'error_code': e.error_code,
-                'msg': e.message
-            }
-
         except Exception as e:
-            result = {
-                'msg': e.message
-            }
-
-            if hasattr(e, 'error_code'):
-                result['error_code'] = e.error_code
-            else:
-                result['error_code'] = ErrorConstants.GENERAL_ERROR.value
+            result = error_result(e)
 
         res = ctx.format_function(result, ctx=ctx)
         if res is not None:
@@ -76,6 +53,36 @@ def error_wrapper(f, ctx, *args, **kwargs):
         sys.exit(1)
 
 
+def error_result(e):
+    """Turn an exception into a result with error code and message."""
+
+    if isinstance(e, (OSError, IOError)):
+        return {
+            'error_code': ErrorConstants.OS_ERROR.value,
+            'strerror': e.strerror,
+            'errno': e.errno,
+            'filename': e.filename,
+            'msg': str(e)
+        }
+
+    if isinstance(e, GContainerException):
+        return {
+            'error_code': e.error_code,
+            'msg': e.message
+        }
+
+    result = {
+        'msg': e.message
+    }
+
+    if hasattr(e, 'error_code'):
+        result['error_code'] = e.error_code
+    else:
+        result['error_code'] = ErrorConstants.GENERAL_ERROR.value
+
+    return result
+
+
 def _has_error_code(res):
     """Returns true if the passed in result has an error code > 0."""
 
@@ -99,12 +106,27 @@ def print_json(res, ctx):
     return json.dumps(res)
 
 
+def _field_value(value):
+    """Format the value of a selected status field."""
+
+    if isinstance(value, list):
+        return ",".join(value)
+    if isinstance(value, dict):
+        return json.dumps(value, sort_keys=True)
+    return str(value)
+
+
 def _service_status(res, ctx):
     """Print output of the main status or create commands as text. This is a formatter function."""
 
     if _has_error_code(res):
         return print_errors(res, ctx)
 
+    # only the selected fields, one per line
+    if ctx.fields:
+        return "\n".join("{field}: {value}".format(field=field, value=_field_value(res.get(field, '')))
+                         for field in ctx.fields)
+
     template = '''\
 name:              {name}
 config-location:   {config_location}
@@ -129,6 +151,21 @@ config:            {config}'''
     if 'callback_uri' in res:
         result += "\ncallback-uri:      {callback_uri}".format(callback_uri=res['callback_uri'])
 
+    if 'callback_mode' in res:
+        result += "\ncallback-mode:     {callback_mode}".format(callback_mode=res['callback_mode'])
+
+    if 'priority' in res:
+        result += "\npriority:          {priority}".format(priority=res['priority'])
+
+    if res.get('after'):
+        result += "\nafter:             {after}".format(after=" ".join(res['after']))
+
+    if 'readiness_timeout' in res:
+        result += "\nreadiness-timeout: {timeout}".format(timeout=res['readiness_timeout'])
+
+    if 'last_oom' in res:
+        result += "\nlast-oom:          {last_oom}".format(last_oom=res['last_oom'])
+
     return result
 
 
@@ -138,6 +175,9 @@ def _service_list(res, ctx):
     if _has_error_code(res):
         return print_errors(res, ctx)
 
+    if ctx.fields:
+        return _field_list(res, ctx.fields)
+
     max_len = {'name': 10,
                'flags': 5,
                'deployment': 20,
@@ -168,6 +208,21 @@ def _service_list(res, ctx):
     return "\n".join(lines)
 
 
+def _field_list(res, fields):
+    """Print the selected fields of every service as a table."""
+
+    columns = ['name'] + fields
+    rows = [[_field_value(deploy.get(column, '')) for column in columns]
+            for name, deploy in sorted(res['deploys'].items())]
+
+    widths = [max([len(column)] + [len(row[i]) for row in rows]) for i, column in enumerate(columns)]
+
+    lines = [" ".join(column.upper().ljust(width) for column, width in zip(columns, widths)).rstrip()]
+    lines.extend(" ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip() for row in rows)
+
+    return "\n".join(lines)
+
+
 def _build_flags(deploy):
     """Build the list of flags for the text output of the list command."""
 
@@ -184,6 +239,77 @@ def _build_flags(deploy):
     return "".join(flags)
 
 
+def _service_results(res, ctx):
+    """Print output of commands that act on multiple services as text. This is a formatter function."""
+
+    if 'results' not in res:
+        return print_errors(res, ctx)
+
+    lines = []
+    for result in res['results']:
+        if _has_error_code(result):
+            lines.append("{name}: {msg}".format(name=result['name'], msg=result.get('msg', '')))
+        elif ctx.verbose and 'downtime' in result:
+            lines.append("{name}: ok, down for {downtime:.3f}s".format(**result))
+        elif ctx.verbose:
+            lines.append("{name}: ok".format(name=result['name']))
+
+    if _has_error_code(res):
+        lines.append(res.get('msg', ''))
+
+    return "\n".join(lines) if lines else None
+
+
+def _restart(res, ctx):
+    """Print output of the restart command as text. This is a formatter function."""
+
+    if _has_error_code(res):
+        return print_errors(res, ctx)
+
+    if ctx.verbose:
+        return "{name}: down for {downtime:.3f}s".format(**res)
+
+
+def _gc(res, ctx):
+    """Print output of the gc command as text. This is a formatter function."""
+
+    # images that could not be removed are listed with the removed ones
+    if 'removed' not in res:
+        return print_errors(res, ctx)
+
+    prefix = 'would remove ' if res['dry_run'] else 'removed '
+    lines = [prefix + tag for tag in res['removed']]
+    lines.extend("not removed %s: %s" % (result['tag'], result['msg']) for result in res['failed'])
+
+    if ctx.verbose:
+        lines.extend('kept ' + deploy_id for deploy_id in res['kept'])
+
+    return "\n".join(lines) if lines else None
+
+
+def _reconcile(res, ctx):
+    """Print output of the reconcile command as text. This is a formatter function."""
+
+    if 'results' not in res:
+        return print_errors(res, ctx)
+
+    lines = []
+    for result in res['results']:
+        for drift in result['drift']:
+            line = "{name}: {kind}".format(name=result['name'], kind=drift['kind'])
+            if drift['action']:
+                line += " -> " + drift['action']
+            lines.append(line)
+
+        if _has_error_code(result):
+            lines.append("{name}: {msg}".format(name=result['name'], msg=result.get('msg', '')))
+
+    if _has_error_code(res):
+        lines.append(res.get('msg', ''))
+
+    return "\n".join(lines) if lines else None
+
+
 def _config_list(res, ctx):
     """Print output of the config list command as text. This is a formatter function."""
 
@@ -214,6 +340,10 @@ def _config_path(res, ctx):
 
 _formatter_functions = {'status': _service_status,
                         'list': _service_list,
+                        'results': _service_results,
+                        'restart': _restart,
+                        'gc': _gc,
+                        'reconcile': _reconcile,
                         'config_list': _config_list,
                         'config_path': _config_path,
                         }
@@ -0,0 +1,209 @@
+import json
+import threading
+import time
+
+import click
+
+
+class StreamDecoder(object):
+    """Decodes a stream of concatenated JSON objects that arrives in arbitrary chunks.
+
+    Docker sends pull progress as JSON objects, but the chunks of the HTTP response do not line up with
+    them. Only the undecoded rest of the stream (at most one incomplete object) is kept between chunks.
+
+    Docker writes one object per line and JSON strings can not contain newlines, so an object that does not
+    decode although a newline follows it is malformed rather than incomplete. It is skipped up to and including
+    the newline.
+    """
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+
+    def feed(self, chunk):
+        """Add a chunk of the stream and return the objects that are complete now."""
+
+        buf = self.buffer + chunk
+        objects = []
+        pos = 0
+
+        while True:
+            # skip the whitespace (usually newlines) between objects
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+
+            if pos == len(buf):
+                break
+
+            try:
+                obj, pos = self.decoder.raw_decode(buf, pos)
+            except ValueError:
+                end = buf.find('\n', pos)
+                if end == -1:
+                    # incomplete object, wait for the next chunk
+                    break
+
+                pos = end + 1
+                continue
+
+            objects.append(obj)
+
+        self.buffer = buf[pos:]
+        return objects
+
+
+class PullProgress(object):
+    """Aggregated progress of an image pull. Keeps the latest state of every layer, not the messages."""
+
+    DONE = ('Pull complete', 'Already exists')
+
+    def __init__(self, deploy_id):
+        self.deploy_id = deploy_id
+
+        # layer id -> [status, bytes downloaded, bytes total]
+        self.layers = {}
+        self.status = None
+        self.errors = []
+
+    def update(self, fields):
+        """Apply a progress message from docker."""
+
+        if 'error' in fields:
+            self.errors.append(fields['error'])
+            return
+
+        status = fields.get('status')
+
+        # messages about the image itself (e.g. 'Pulling from ...', 'Digest: ...') carry no progress details
+        if 'id' not in fields or 'progressDetail' not in fields:
+            self.status = status
+            return
+
+        layer = self.layers.setdefault(fields['id'], [status, 0, 0])
+        layer[0] = status
+
+        detail = fields['progressDetail'] or {}
+        if status == 'Downloading':
+            layer[1] = detail.get('current', layer[1])
+            layer[2] = detail.get('total', layer[2])
+        elif status in ('Download complete', 'Extracting') + PullProgress.DONE:
+            layer[1] = layer[2]
+
+    def summary(self):
+        # values() copies the layer list, renderers call this while other threads update the layers
+        layers = self.layers.values()
+
+        return {'image': self.deploy_id,
+                'layers': len(layers),
+                'complete': len([layer for layer in layers if layer[0] in PullProgress.DONE]),
+                'current': sum(layer[1] for layer in layers),
+                'total': sum(layer[2] for layer in layers),
+                'status': self.status}
+
+
+class ProgressRenderer(object):
+    """Shows the progress of image pulls. This one shows nothing.
+
+    A renderer can be shared by pulls that run at the same time on different threads."""
+
+    def start(self, progress):
+        pass
+
+    def update(self, progress, fields):
+        pass
+
+    def finish(self, progress):
+        pass
+
+
+class NdjsonRenderer(ProgressRenderer):
+    """Writes every progress message as a single line of JSON to stderr."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def _write(self, record):
+        with self.lock:
+            click.echo(json.dumps(record, separators=(',', ':'), sort_keys=True), err=True)
+
+    def update(self, progress, fields):
+        record = {'image': progress.deploy_id}
+
+        if 'error' in fields:
+            record['error'] = fields['error']
+        else:
+            record['status'] = fields.get('status')
+            if fields.get('id') in progress.layers:
+                status, current, total = progress.layers[fields['id']]
+                record.update({'layer': fields['id'], 'current': current, 'total': total})
+
+        self._write(record)
+
+    def finish(self, progress):
+        record = progress.summary()
+        record['status'] = 'error' if progress.errors else 'done'
+        self._write(record)
+
+
+def _size(size):
+    for unit in ('B', 'kB', 'MB'):
+        if size < 1024:
+            return '%.1f %s' % (size, unit)
+        size /= 1024.0
+    return '%.1f GB' % size
+
+
+class LiveRenderer(ProgressRenderer):
+    """Keeps a single status line for all running pulls up to date on stderr."""
+
+    INTERVAL = 0.2
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pulls = {}
+        self.running = 0
+        self.last_render = 0
+
+    def _render(self, force=False):
+        now = time.time()
+        if not force and now - self.last_render < LiveRenderer.INTERVAL:
+            return
+        self.last_render = now
+
+        summaries = [progress.summary() for progress in self.pulls.values()]
+        complete = sum(summary['complete'] for summary in summaries)
+        layers = sum(summary['layers'] for summary in summaries)
+        current = sum(summary['current'] for summary in summaries)
+        total = sum(summary['total'] for summary in summaries)
+
+        line = 'pulling %d image(s): %d/%d layers, %s/%s' % (len(summaries), complete, layers,
+                                                             _size(current), _size(total))
+
+        click.echo('\r' + line.ljust(70), nl=False, err=True)
+
+    def start(self, progress):
+        with self.lock:
+            self.pulls[progress.deploy_id] = progress
+            self.running += 1
+
+    def update(self, progress, fields):
+        with self.lock:
+            self._render()
+
+    def finish(self, progress):
+        with self.lock:
+            self.running -= 1
+            if self.running == 0:
+                self._render(force=True)
+                click.echo('', err=True)
+
+
+Renderers = {'none': ProgressRenderer,
+             'live': LiveRenderer,
+             'ndjson': NdjsonRenderer}
+
+
+def progress_renderer(mode):
+    """Returns a new renderer for a progress mode (none, live or ndjson)."""
+
+    return Renderers[mode]()
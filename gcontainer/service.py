@@ -1,7 +1,14 @@
-from .output import output, formatter
+import fnmatch
+import json
+import time
+
+import click
+
+from .output import output, formatter, error_result
+from .progress import progress_renderer
 from .error import GContainerException, ErrorConstants
 from .file_manager import FileSystemController
-from .util import legal_name
+from .util import disk_usage, is_pattern, legal_name, parallel_map, parse_environment, sd_notify
 
 
 class Service(object):
@@ -13,16 +20,18 @@ class Service(object):
         if not legal_name(service_name):
             raise GContainerException(ErrorConstants.ILLEGAL_SERVICE_NAME, service_name)
 
-        if ctx.deploy.exists(service_name):
-            raise GContainerException(ErrorConstants.DEPLOY_EXISTS, service_name)
+        with ctx.deploy.transaction() as tx:
+            if tx.exists(service_name):
+                raise GContainerException(ErrorConstants.DEPLOY_EXISTS, service_name)
 
-        deploy_dirs = ctx.fs.create_deploy(service_name)
+            deploy_dirs = ctx.fs.create_deploy(service_name)
 
-        config_name = FileSystemController.INITIAL_CONFIG_NAME
-        config_dir = ctx.fs.create_config(service_name, config_name)
-        ctx.fs.select_config(service_name, config_name)
+            config_name = FileSystemController.INITIAL_CONFIG_NAME
+            config_dir = ctx.fs.create_config(service_name, config_name)
+            ctx.fs.select_config(service_name, config_name)
+
+            deploy_info = tx.add(service_name)
 
-        deploy_info = ctx.deploy.add(service_name)
         docker_status = ctx.docker.status(service_name)
 
         return {'name': service_name,
@@ -58,22 +67,159 @@ class Service(object):
         ctx.fs.remove_deploy(service_name)
 
     @output
-    def deploy(self, ctx, service_name, deploy_id, callback_uri=None):
+    def deploy(self, ctx, service_name, deploy_id, callback_uri=None, callback_mode=None):
         if not legal_name(service_name):
             raise GContainerException(ErrorConstants.ILLEGAL_SERVICE_NAME, service_name)
 
         if not ctx.deploy.exists(service_name):
             raise GContainerException(ErrorConstants.NO_SUCH_DEPLOY, service_name)
 
-        ctx.docker.pull_image(deploy_id)
+        pulled = ctx.docker.ensure_image(deploy_id, ctx.pull_policy, progress_renderer(ctx.progress))
 
-        ctx.deploy.save_deploy(service_name, deploy_id, callback_uri)
-
-        deploy_info = ctx.deploy.info(service_name)
+        with ctx.deploy.transaction() as tx:
+            tx.save_deploy(service_name, deploy_id, callback_uri, callback_mode)
+            deploy_info = tx.info(service_name)
 
         if deploy_info['enabled']:
             ctx.systemd.enable(service_name)
 
+        res = {'pulled': pulled}
+        Service._gc_after_deploy(ctx, res)
+        return res
+
+    @formatter('results')
+    @output
+    def deploy_manifest(self, ctx, manifest, callback_uri=None, callback_mode=None):
+        """Deploy multiple services. The manifest lists one 'service=image:tag' pair per line. Every image is
+        resolved (and pulled if necessary) once, up to pull_parallelism images at the same time. The deploy
+        ids are only saved (all at once) if all images are available."""
+
+        deploys = parse_environment(manifest)
+
+        for service_name in sorted(deploys):
+            if not legal_name(service_name):
+                raise GContainerException(ErrorConstants.ILLEGAL_SERVICE_NAME, service_name)
+
+            if not ctx.deploy.exists(service_name):
+                raise GContainerException(ErrorConstants.NO_SUCH_DEPLOY, service_name)
+
+        # one renderer shows the progress of all pulls
+        renderer = progress_renderer(ctx.progress)
+
+        def _pull(deploy_id):
+            try:
+                pulled = ctx.docker.ensure_image(deploy_id, ctx.pull_policy, renderer)
+                return {'error_code': ErrorConstants.NO_ERROR.value, 'pulled': pulled}
+            except Exception as e:
+                return error_result(e)
+
+        deploy_ids = sorted(set(deploys.values()))
+        pulls = dict(zip(deploy_ids, parallel_map(_pull, deploy_ids, ctx.docker.pull_parallelism)))
+        pulled = all(pull['error_code'] == ErrorConstants.NO_ERROR.value for pull in pulls.values())
+
+        results = []
+        for service_name in sorted(deploys):
+            result = dict(pulls[deploys[service_name]])
+
+            # nothing is saved if any pull failed, also report the services whose image was pulled
+            if not pulled and result['error_code'] == ErrorConstants.NO_ERROR.value:
+                result = error_result(GContainerException(ErrorConstants.DEPLOY_NOT_SAVED, service_name))
+
+            result['name'] = service_name
+            result['deployment'] = deploys[service_name]
+            results.append(result)
+
+        if pulled:
+            with ctx.deploy.transaction() as tx:
+                for service_name, deploy_id in deploys.iteritems():
+                    tx.save_deploy(service_name, deploy_id, callback_uri, callback_mode)
+
+                enabled = sorted(service_name for service_name in deploys if tx.info(service_name)['enabled'])
+
+            with ctx.systemd.batch():
+                for service_name in enabled:
+                    ctx.systemd.enable(service_name)
+
+        res = Service._results(results)
+        if pulled:
+            Service._gc_after_deploy(ctx, res)
+        return res
+
+    @formatter('gc')
+    @output
+    def gc(self, ctx, dry_run=False, keep=None):
+        if not ctx.docker.connected():
+            raise GContainerException(ErrorConstants.DOCKER_NOT_CONNECTED)
+
+        return Service._gc(ctx, dry_run, keep)
+
+    @classmethod
+    def _gc(cls, ctx, dry_run=False, keep=None):
+        """Remove the images of deployed repositories that are neither the current deployment nor one of the
+        last 'keep' deploy ids of any service, oldest first. With a high watermark, images are only removed
+        while the disk usage of the docker root is above it. Tags that can not be removed (e.g. an image that
+        is used by a container of another tool) are reported and skipped."""
+
+        keep = int(ctx.config.get('gc', 'keep')) if keep is None else keep
+        high_watermark = int(ctx.config.get('gc', 'high_watermark'))
+        docker_root = ctx.config.get('gc', 'docker_root')
+
+        deploys, count = ctx.deploy.load()
+
+        kept = set()
+        repositories = set()
+        for deploy_info in deploys.values():
+            deploy_ids = [deploy_info['deployment']] + deploy_info.get('history', [])
+            deploy_ids = [deploy_id for deploy_id in deploy_ids if deploy_id != '-']
+
+            kept.update(deploy_ids[:keep + 1])
+            repositories.update(ctx.docker.repository(deploy_id) for deploy_id in deploy_ids)
+
+        usage = disk_usage(docker_root) if high_watermark else None
+
+        removed = []
+        failed = []
+        for image in ctx.docker.unused_images(kept, repositories):
+            # a dry run can not tell how much space is freed, it lists all images that may be removed
+            if high_watermark and disk_usage(docker_root) < high_watermark:
+                break
+
+            for tag in image['tags']:
+                if not dry_run:
+                    try:
+                        ctx.docker.remove_image(tag)
+                    except GContainerException as e:
+                        result = error_result(e)
+                        result['tag'] = tag
+                        failed.append(result)
+                        continue
+                removed.append(tag)
+
+        res = {'removed': removed,
+               'failed': failed,
+               'kept': sorted(kept),
+               'dry_run': dry_run,
+               'disk_usage': usage}
+
+        if failed:
+            res['error_code'] = ErrorConstants.IMAGES_NOT_REMOVED.value
+            res['msg'] = ErrorConstants.IMAGES_NOT_REMOVED.template % (len(failed), len(failed) + len(removed))
+
+        return res
+
+    @classmethod
+    def _gc_after_deploy(cls, ctx, res):
+        """Run gc after a successful deploy if configured. The deploy is done at this point, so a failing
+        gc is reported with the result but does not fail the deploy."""
+
+        if ctx.config.get('gc', 'after_deploy') != 'true':
+            return
+
+        try:
+            res['gc'] = Service._gc(ctx)
+        except Exception as e:
+            res['gc'] = error_result(e)
+
     @output
     def start(self, ctx, service_name):
         if not legal_name(service_name):
@@ -85,18 +231,30 @@ class Service(object):
         if not ctx.docker.connected():
             raise GContainerException(ErrorConstants.DOCKER_NOT_CONNECTED)
 
+        with ctx.deploy.transaction() as tx:
+            Service._start_service(ctx, service_name, tx)
+
+        if ctx.block_flag:
+            if Service._notify_mode(ctx):
+                Service._wait_ready(ctx, service_name)
+                sd_notify('READY=1')
+            ctx.docker.wait(service_name)
+
+    @classmethod
+    def _start_service(cls, ctx, service_name, deploy):
         if ctx.docker.is_running(service_name):
             if not ctx.started_flag:
                 raise GContainerException(ErrorConstants.SERVICE_IS_RUNNING, service_name)
         else:
-            Service._start(ctx, service_name)
-
-        if ctx.block_flag:
-            ctx.docker.wait(service_name)
+            Service._start(ctx, service_name, deploy)
 
     @classmethod
-    def _start(cls, ctx, service_name):
-        deploy_info = ctx.deploy.info(service_name)
+    def _start(cls, ctx, service_name, deploy=None):
+        """Start the container of a service. Changes to the deployment state are recorded in deploy, which
+        is either a transaction or the deploy controller itself."""
+
+        deploy = deploy or ctx.deploy
+        deploy_info = deploy.info(service_name)
 
         if deploy_info['deployment'] == '-':
             raise GContainerException(ErrorConstants.NO_IMAGE_ASSIGNED, service_name)
@@ -104,17 +262,71 @@ class Service(object):
         environment = ctx.fs.load_environment(service_name)
         ctx.docker.create_container(service_name, deploy_info['deployment'],
                                     destroy_existing=True,
-                                    environment=environment)
+                                    environment=environment,
+                                    recreate=ctx.recreate_flag)
 
         ctx.docker.start(service_name)
+        Service._callback(ctx, service_name, deploy_info, True)
 
-        if 'callback_uri' in deploy_info:
-            ctx.callback.running(deploy_info['callback_uri'],
-                                 deployment=deploy_info['deployment'],
-                                 name=service_name,
-                                 config=ctx.fs.current_config(service_name))
+        deploy.set_running(service_name, True)
+
+    @classmethod
+    def _notify_mode(cls, ctx):
+        """Whether units are Type=notify. Only then does start --block wait for readiness, a Type=simple unit
+        is started as soon as the command runs and its container is never stopped for being slow."""
+        return ctx.config.get('systemd', 'notify') == 'true'
 
-        ctx.deploy.set_running(service_name, True)
+    # ready states of a container, see Docker.readiness
+    READY = ('running', 'healthy')
+    READINESS_POLL_INTERVAL = 0.5
+
+    @classmethod
+    def _wait_ready(cls, ctx, service_name, deploy=None):
+        """Wait until the container of a service is running and, if it has a healthcheck, healthy. A service
+        that is not ready within its readiness timeout is stopped. See _start for deploy."""
+
+        deploy = deploy or ctx.deploy
+        default_timeout = ctx.config.get('systemd', 'readiness_timeout')
+        timeout = float(deploy.info(service_name).get('readiness_timeout', default_timeout))
+        deadline = time.time() + timeout
+
+        readiness = ctx.docker.readiness(service_name)
+        while readiness not in Service.READY + ('stopped',) and time.time() < deadline:
+            time.sleep(Service.READINESS_POLL_INTERVAL)
+            readiness = ctx.docker.readiness(service_name)
+
+        if readiness not in Service.READY:
+            Service._stop(ctx, service_name, deploy)
+            raise GContainerException(ErrorConstants.SERVICE_NOT_READY, service_name, timeout, readiness)
+
+    @classmethod
+    def _wait_ready_results(cls, ctx, results):
+        """Wait for the services of all successful results to become ready. The results of services that
+        do not become ready are replaced with their errors."""
+
+        started = [result['name'] for result in results if result['error_code'] == ErrorConstants.NO_ERROR.value]
+
+        with ctx.deploy.transaction() as tx:
+            def _ready(service_name):
+                return Service._service_result(Service._wait_ready, ctx, service_name, tx)
+
+            not_ready = dict((result['name'], result)
+                             for result in parallel_map(_ready, started, ctx.docker.parallelism)
+                             if result['error_code'] != ErrorConstants.NO_ERROR.value)
+
+        return [not_ready.get(result['name'], result) for result in results]
+
+    @classmethod
+    def _callback(cls, ctx, service_name, deploy_info, running):
+        """Report that a service started or stopped to its callback uri, if it has one."""
+
+        if 'callback_uri' in deploy_info:
+            report = ctx.callback.running if running else ctx.callback.stopped
+            report(deploy_info['callback_uri'],
+                   mode=deploy_info.get('callback_mode', 'single'),
+                   deployment=deploy_info['deployment'],
+                   name=service_name,
+                   config=ctx.fs.current_config(service_name))
 
     @output
     def stop(self, ctx, service_name):
@@ -127,32 +339,35 @@ class Service(object):
         if not ctx.docker.connected():
             raise GContainerException(ErrorConstants.DOCKER_NOT_CONNECTED)
 
+        with ctx.deploy.transaction() as tx:
+            Service._stop_service(ctx, service_name, tx)
+
+    @classmethod
+    def _stop_service(cls, ctx, service_name, deploy):
         if not ctx.docker.is_running(service_name):
             if not ctx.stopped_flag:
                 raise GContainerException(ErrorConstants.SERVICE_IS_NOT_RUNNING, service_name)
         else:
-            Service._stop(ctx, service_name)
+            Service._stop(ctx, service_name, deploy)
 
     @classmethod
-    def _stop(cls, ctx, service_name):
+    def _stop(cls, ctx, service_name, deploy=None):
+        """Stop the container of a service, see _start for deploy."""
 
+        deploy = deploy or ctx.deploy
         state = False  # did not stop a container
 
-        deploy_info = ctx.deploy.info(service_name)
+        deploy_info = deploy.info(service_name)
         if deploy_info:
             state = ctx.docker.stop(service_name)
+            Service._callback(ctx, service_name, deploy_info, False)
 
-            if 'callback_uri' in deploy_info:
-                ctx.callback.stopped(deploy_info['callback_uri'],
-                                     deployment=deploy_info['deployment'],
-                                     name=service_name,
-                                     config=ctx.fs.current_config(service_name))
-
-        ctx.deploy.set_running(service_name, False)
+        deploy.set_running(service_name, False)
 
         # Return the actual stop state (True if a container was stopped) for restart command
         return state
 
+    @formatter('restart')
     @output
     def restart(self, ctx, service_name):
         if not legal_name(service_name):
@@ -164,12 +379,34 @@ class Service(object):
         if not ctx.docker.connected():
             raise GContainerException(ErrorConstants.DOCKER_NOT_CONNECTED)
 
+        res = Service._restart_service(ctx, service_name, ctx.deploy)
+        res['name'] = service_name
+        return res
+
+    @classmethod
+    def _restart_service(cls, ctx, service_name, deploy):
+        """Restart a running service. The new container is created while the old container is still running,
+        so only stopping the old and starting the new container is on the path of the outage. Returns the
+        measured downtime in seconds."""
+
         if not ctx.docker.is_running(service_name):
             raise GContainerException(ErrorConstants.SERVICE_IS_NOT_RUNNING, service_name)
 
-        result = Service._stop(ctx, service_name)
-        if result:
-            Service._start(ctx, service_name)
+        deploy_info = deploy.info(service_name)
+        if deploy_info['deployment'] == '-':
+            raise GContainerException(ErrorConstants.NO_IMAGE_ASSIGNED, service_name)
+
+        environment = ctx.fs.load_environment(service_name)
+        ctx.docker.prepare_container(service_name, deploy_info['deployment'], environment=environment)
+
+        # if the new container does not start, the old container runs again and no callbacks are sent
+        downtime = ctx.docker.replace_container(service_name)
+
+        Service._callback(ctx, service_name, deploy_info, False)
+        Service._callback(ctx, service_name, deploy_info, True)
+        deploy.set_running(service_name, True)
+
+        return {'downtime': round(downtime, 3)}
 
     @output
     def enable(self, ctx, service_name):
@@ -179,9 +416,14 @@ class Service(object):
         if not ctx.deploy.exists(service_name):
             raise GContainerException(ErrorConstants.NO_SUCH_DEPLOY, service_name)
 
-        deploy_info = ctx.deploy.info(service_name)
+        with ctx.deploy.transaction() as tx:
+            Service._enable_service(ctx, service_name, tx)
+
+    @classmethod
+    def _enable_service(cls, ctx, service_name, deploy):
+        deploy_info = deploy.info(service_name)
         if deploy_info:
-            ctx.deploy.set_enabled(service_name, True)
+            deploy.set_enabled(service_name, True)
 
             # Defer enabling if no deployment is present. Then deploy will implictly enable
             if deploy_info['deployment'] != '-':
@@ -195,55 +437,499 @@ class Service(object):
         if not ctx.deploy.exists(service_name):
             raise GContainerException(ErrorConstants.NO_SUCH_DEPLOY, service_name)
 
-        if ctx.deploy.info(service_name):
-            ctx.deploy.set_enabled(service_name, False)
+        with ctx.deploy.transaction() as tx:
+            Service._disable_service(ctx, service_name, tx)
+
+    @classmethod
+    def _disable_service(cls, ctx, service_name, deploy):
+        if deploy.info(service_name):
+            deploy.set_enabled(service_name, False)
             ctx.systemd.disable(service_name)
 
-    @formatter('status')
+    # Commands that can act on multiple services, see bulk. The flag tells whether the command needs docker.
+    BulkCommands = {'start': ('_start_service', True),
+                    'stop': ('_stop_service', True),
+                    'restart': ('_restart_service', True),
+                    'enable': ('_enable_service', False),
+                    'disable': ('_disable_service', False)}
+
+    @formatter('results')
+    @output
+    def bulk(self, ctx, command, service_names, all_services=False):
+        """Run a command for multiple services. service_names may contain glob patterns, all_services selects
+        every service. The services are processed on the worker pool and all changes to the deployment
+        state are written at once. Failures are reported per service and do not stop the other services."""
+
+        method_name, needs_docker = Service.BulkCommands[command]
+        service_method = getattr(Service, method_name)
+
+        deploys, count = ctx.deploy.load()
+        service_names = Service._select(deploys, service_names, all_services)
+
+        if needs_docker and not ctx.docker.connected():
+            raise GContainerException(ErrorConstants.DOCKER_NOT_CONNECTED)
+
+        # create the controllers up front, the workers share them
+        for controller in ('fs', 'systemd', 'callback') + (('docker',) if needs_docker else ()):
+            getattr(ctx, controller)
+
+        # unit files are enabled and disabled with a single systemd call when all services are done
+        with ctx.deploy.transaction() as tx, ctx.systemd.batch():
+            def _run(service_name):
+                return Service._service_result(service_method, ctx, service_name, tx)
+
+            results = parallel_map(_run, service_names, Service._parallelism(ctx, needs_docker))
+
+        if command == 'start' and ctx.block_flag:
+            if Service._notify_mode(ctx):
+                results = Service._wait_ready_results(ctx, results)
+                sd_notify('READY=1')
+
+            for result in results:
+                if result['error_code'] == ErrorConstants.NO_ERROR.value:
+                    ctx.docker.wait(result['name'])
+
+        return Service._results(results)
+
+    @classmethod
+    def _parallelism(cls, ctx, needs_docker=True):
+        """The size of the worker pool. Commands that do not need docker must not create the docker controller,
+        it connects to the daemon."""
+
+        if needs_docker:
+            return ctx.docker.parallelism
+        return int(ctx.config.get('docker', 'parallelism'))
+
+    @classmethod
+    def _service_result(cls, service_method, ctx, service_name, deploy, must_exist=True):
+        """Run a per service method and turn its outcome into a result for the service. Unless must_exist is
+        false, the service must have a deploy record."""
+
+        try:
+            # a pattern that matched no service, see _select
+            if is_pattern(service_name):
+                raise GContainerException(ErrorConstants.NO_SUCH_DEPLOY, service_name)
+
+            if not legal_name(service_name):
+                raise GContainerException(ErrorConstants.ILLEGAL_SERVICE_NAME, service_name)
+
+            if must_exist and not deploy.exists(service_name):
+                raise GContainerException(ErrorConstants.NO_SUCH_DEPLOY, service_name)
+
+            # per service methods may return details for the result
+            result = service_method(ctx, service_name, deploy) or {}
+            result['error_code'] = ErrorConstants.NO_ERROR.value
+        except Exception as e:
+            result = error_result(e)
+
+        result['name'] = service_name
+        return result
+
+    @classmethod
+    def _results(cls, results):
+        failed = [result for result in results if result['error_code'] != ErrorConstants.NO_ERROR.value]
+
+        res = {'results': results}
+        if failed:
+            res['error_code'] = ErrorConstants.SERVICES_FAILED.value
+            res['msg'] = ErrorConstants.SERVICES_FAILED.template % (len(failed), len(results))
+
+        return res
+
+    # differences between the deployment state and docker or systemd, with the action that repairs them
+    # (None: reported only)
+    DriftActions = {'container_not_running': 'start',
+                    'flag_not_running': 'set_running',
+                    'unit_missing': 'enable',
+                    'unit_stale': 'disable',
+                    'image_missing': None,
+                    'image_mismatch': None}
+
+    @formatter('reconcile')
+    @output
+    def reconcile(self, ctx, dry_run=False):
+        """Compare the deployment state of all services with their containers, images and unit files and
+        repair the differences. The inventories are loaded once, the repairs run on the worker pool and all
+        changes to the deployment state are written at once."""
+
+        if not ctx.docker.connected():
+            raise GContainerException(ErrorConstants.DOCKER_NOT_CONNECTED)
+
+        deploys, count = ctx.deploy.load()
+        containers = ctx.docker.containers()
+        images = ctx.docker.image_references()
+        units = ctx.systemd.units()
+
+        plan = {}
+        for service_name in sorted(deploys):
+            drift = Service._drift(deploys[service_name], containers.get(service_name), images,
+                                   service_name in units)
+            if drift:
+                plan[service_name] = drift
+
+        # unit files of services that were removed outside of gcontainer
+        removed = units - set(deploys)
+        for service_name in removed:
+            plan[service_name] = ['unit_stale']
+
+        if dry_run:
+            results = [{'name': service_name, 'error_code': ErrorConstants.NO_ERROR.value}
+                       for service_name in sorted(plan)]
+        else:
+            for controller in ('fs', 'systemd', 'callback'):
+                getattr(ctx, controller)
+
+            def _repair(ctx, service_name, deploy):
+                for drift in plan[service_name]:
+                    if drift == 'container_not_running':
+                        Service._start(ctx, service_name, deploy)
+                    elif drift == 'flag_not_running':
+                        deploy.set_running(service_name, True)
+                    elif drift == 'unit_missing':
+                        ctx.systemd.enable(service_name)
+                    elif drift == 'unit_stale':
+                        ctx.systemd.disable(service_name)
+
+            with ctx.deploy.transaction() as tx, ctx.systemd.batch():
+                def _run(service_name):
+                    return Service._service_result(_repair, ctx, service_name, tx,
+                                                   must_exist=service_name not in removed)
+
+                results = parallel_map(_run, sorted(plan), ctx.docker.parallelism)
+
+        for result in results:
+            result['drift'] = [{'kind': kind, 'action': Service.DriftActions[kind]}
+                               for kind in plan[result['name']]]
+
+        res = Service._results(results)
+        res['dry_run'] = dry_run
+        return res
+
+    @classmethod
+    def _drift(cls, deploy_info, container, images, has_unit):
+        """Returns the differences between the deploy record of a service and its container (None if there is
+        no container), the local images and its unit file."""
+
+        drift = []
+        deployment = deploy_info['deployment']
+        container_running = container is not None and container['running']
+
+        if deployment != '-':
+            if deployment not in images:
+                drift.append('image_missing')
+
+            if container is not None and container['image'] != deployment:
+                drift.append('image_mismatch')
+
+            if deploy_info['running'] and not container_running:
+                drift.append('container_not_running')
+
+            if deploy_info['enabled'] and not has_unit:
+                drift.append('unit_missing')
+
+        if container_running and not deploy_info['running']:
+            drift.append('flag_not_running')
+
+        if not deploy_info['enabled'] and has_unit:
+            drift.append('unit_stale')
+
+        return drift
+
     @output
-    def status(self, ctx, service_name):
+    def set(self, ctx, service_name, priority=None, after=None, readiness_timeout=None):
+        """Set the boot priority, the boot dependencies and the readiness timeout of a service. None leaves
+        a setting alone."""
+
         if not legal_name(service_name):
             raise GContainerException(ErrorConstants.ILLEGAL_SERVICE_NAME, service_name)
 
-        if not ctx.deploy.exists(service_name):
-            raise GContainerException(ErrorConstants.NO_SUCH_DEPLOY, service_name)
+        for dependency in after or ():
+            if not legal_name(dependency):
+                raise GContainerException(ErrorConstants.ILLEGAL_SERVICE_NAME, dependency)
+            if dependency == service_name:
+                raise GContainerException(ErrorConstants.DEPENDENCY_CYCLE, service_name)
+
+        with ctx.deploy.transaction() as tx:
+            if not tx.exists(service_name):
+                raise GContainerException(ErrorConstants.NO_SUCH_DEPLOY, service_name)
+
+            fields = {}
+            if priority is not None:
+                fields['priority'] = priority
+            if after is not None:
+                fields['after'] = sorted(set(after))
+            if readiness_timeout is not None:
+                fields['readiness_timeout'] = readiness_timeout
+
+            if fields:
+                tx.update(service_name, fields)
+
+    @formatter('results')
+    @output
+    def boot(self, ctx):
+        """Start all enabled services in waves. A service is started once all services it must start after
+        have been started, the services of a wave are started concurrently in order of their priority.
+        Services that are already running are left alone."""
 
         if not ctx.docker.connected():
             raise GContainerException(ErrorConstants.DOCKER_NOT_CONNECTED)
 
-        deploy_dirs = ctx.fs.info_deploy(service_name)
-        current_config = ctx.fs.current_config(service_name)
+        deploys, count = ctx.deploy.load()
+        deploys = dict((name, deploy_info) for name, deploy_info in deploys.iteritems()
+                       if deploy_info['enabled'] and deploy_info['deployment'] != '-')
 
-        deploy_info = ctx.deploy.info(service_name)
-        docker_status = ctx.docker.status(service_name)
+        waves, blocked = Service._boot_waves(deploys)
 
-        res = {'name': service_name,
-               'config_location': deploy_dirs['config'],
-               'log_location': deploy_dirs['log'],
-               'script_location': deploy_dirs['script'],
-               'running': deploy_info['running'],
-               'enabled': deploy_info['enabled'],
-               'deployment': deploy_info['deployment'],
-               'config': current_config,
-               'container_status': docker_status,
-               }
+        for controller in ('fs', 'docker', 'callback'):
+            getattr(ctx, controller)
 
-        if 'callback_uri' in deploy_info:
-            res['callback_uri'] = deploy_info['callback_uri']
+        ctx.started_flag = True
+        failed = set()
+        results = []
 
-        return res
+        def _start_after_dependencies(ctx, service_name, deploy):
+            for dependency in Service._dependencies(deploys, service_name):
+                if dependency in failed:
+                    raise GContainerException(ErrorConstants.DEPENDENCY_FAILED, service_name, dependency)
+
+            Service._start_service(ctx, service_name, deploy)
+
+        for wave, service_names in enumerate(waves):
+            # the state is written after every wave
+            with ctx.deploy.transaction() as tx:
+                def _boot(service_name):
+                    return Service._service_result(_start_after_dependencies, ctx, service_name, tx)
+
+                wave_results = parallel_map(_boot, service_names, ctx.docker.parallelism)
+
+            # the next wave starts once the services of this wave are ready
+            if wave < len(waves) - 1:
+                wave_results = Service._wait_ready_results(ctx, wave_results)
+
+            for result in wave_results:
+                result['wave'] = wave
+                if result['error_code'] != ErrorConstants.NO_ERROR.value:
+                    failed.add(result['name'])
+
+            results.extend(wave_results)
+
+        for service_name in blocked:
+            result = error_result(GContainerException(ErrorConstants.DEPENDENCY_CYCLE, service_name))
+            result['name'] = service_name
+            results.append(result)
+
+        return Service._results(results)
+
+    @classmethod
+    def _dependencies(cls, deploys, service_name):
+        """The services that service_name must start after. Services that are not booted are ignored."""
+
+        return [name for name in deploys[service_name].get('after', []) if name in deploys and name != service_name]
+
+    @classmethod
+    def _boot_waves(cls, deploys):
+        """Order services into waves. Every service comes after all of its dependencies, services within
+        a wave are ordered by descending priority and name. Returns the waves and the services that can not
+        be started because of a dependency cycle."""
+
+        remaining = set(deploys)
+        started = set()
+        waves = []
+
+        while remaining:
+            wave = [name for name in remaining
+                    if all(dependency in started for dependency in Service._dependencies(deploys, name))]
+            if not wave:
+                break
+
+            wave.sort(key=lambda name: (-deploys[name].get('priority', 0), name))
+            waves.append(wave)
+
+            started.update(wave)
+            remaining.difference_update(wave)
+
+        return waves, sorted(remaining)
+
+    @classmethod
+    def _select(cls, deploys, service_names, all_services):
+        """Expand glob patterns in service_names against the existing services. Services are returned in
+        order and only once. Plain names and patterns that match no service are kept, so that they are
+        reported as missing."""
+
+        if all_services:
+            return sorted(deploys)
+
+        selected = []
+        seen = set()
+        for service_name in service_names:
+            matches = [service_name]
+            if is_pattern(service_name) and service_name not in deploys:
+                matches = fnmatch.filter(sorted(deploys), service_name) or matches
+
+            for match in matches:
+                if match not in seen:
+                    seen.add(match)
+                    selected.append(match)
+
+        return selected
 
-    @formatter('list')
     @output
-    def list(self, ctx):
+    def watch(self, ctx, callbacks=False):
+        """Follow the docker events and keep the running flag of all services in sync with their containers.
+        With callbacks, every change of the running flag is reported to the callback uri of the service. This
+        includes changes that start, stop or restart already reported, if the event arrives before they record
+        the flag. Runs until the docker daemon closes the event stream."""
+
         if not ctx.docker.connected():
             raise GContainerException(ErrorConstants.DOCKER_NOT_CONNECTED)
 
+        # subscribe from before the state is synced, so no change is lost in between
+        since = int(time.time())
+
+        deploys, count = ctx.deploy.load()
+        with ctx.deploy.transaction() as tx:
+            for service_name in sorted(deploys):
+                Service._watch_update(ctx, tx, service_name, ctx.docker.is_running(service_name), callbacks)
+
+        # container id -> service name, None for containers that do not belong to a service
+        names = {}
+
+        for event in ctx.docker.events(since):
+            container_id = event.get('id')
+            if container_id not in names:
+                names[container_id] = ctx.docker.service_name(container_id)
+
+            service_name = names[container_id]
+            if service_name is None or not ctx.deploy.exists(service_name):
+                continue
+
+            with ctx.deploy.transaction() as tx:
+                if event['status'] == 'oom':
+                    tx.update(service_name, {'last_oom': event.get('time', since)})
+                    Service._watch_echo(ctx, service_name, 'oom')
+                else:
+                    Service._watch_update(ctx, tx, service_name, event['status'] == 'start', callbacks)
+
+    @classmethod
+    def _watch_update(cls, ctx, deploy, service_name, running, callbacks):
+        """Record the state of a container if it differs from the deployment state."""
+
+        deploy_info = deploy.info(service_name)
+        if deploy_info['running'] == running:
+            return
+
+        deploy.set_running(service_name, running)
+        if callbacks:
+            Service._callback(ctx, service_name, deploy_info, running)
+
+        Service._watch_echo(ctx, service_name, 'running' if running else 'stopped')
+
+    @classmethod
+    def _watch_echo(cls, ctx, service_name, state):
+        if ctx.json:
+            click.echo(json.dumps({'name': service_name, 'state': state}))
+        else:
+            click.echo('%s: %s' % (service_name, state))
+
+    @output
+    def send_callbacks(self, ctx):
+        """Deliver the spooled callbacks until the spool is empty, unless another sender is running."""
+
+        ctx.callback.drain()
+
+    # fields of status and list that come from the deployment state, the file system and docker
+    STATE_FIELDS = ('running', 'enabled', 'deployment', 'callback_uri', 'callback_mode', 'priority', 'after',
+                    'readiness_timeout', 'last_oom')
+    LOCATION_FIELDS = ('config_location', 'log_location', 'script_location')
+    STATUS_FIELDS = LOCATION_FIELDS + STATE_FIELDS + ('config', 'container_status')
+
+    @classmethod
+    def _check_fields(cls, fields):
+        """Check a selection of status fields, None selects all fields. Returns true if the fields need docker."""
+
+        for field in fields or ():
+            if field not in Service.STATUS_FIELDS:
+                raise GContainerException(ErrorConstants.UNKNOWN_FIELD, field, ", ".join(Service.STATUS_FIELDS))
+
+        return fields is None or 'container_status' in fields
+
+    @classmethod
+    def _status_fields(cls, ctx, service_name, deploy_info, fields):
+        """Returns the name and the selected status fields of a service. The file system and docker are only
+        asked for fields that were selected."""
+
+        res = {'name': service_name}
+
+        if any(field in Service.LOCATION_FIELDS for field in fields):
+            deploy_dirs = ctx.fs.info_deploy(service_name)
+            res.update(config_location=deploy_dirs['config'],
+                       log_location=deploy_dirs['log'],
+                       script_location=deploy_dirs['script'])
+
+        if 'config' in fields:
+            res['config'] = ctx.fs.current_config(service_name)
+
+        if 'container_status' in fields:
+            res['container_status'] = ctx.docker.status(service_name)
+
+        for key in Service.STATE_FIELDS:
+            if key in deploy_info:
+                res[key] = deploy_info[key]
+
+        return dict((key, value) for key, value in res.iteritems() if key == 'name' or key in fields)
+
+    @formatter('status')
+    @output
+    def status(self, ctx, service_name, fields=None):
+        """Show the status of a service. fields selects the fields to show, None shows all fields."""
+
+        if not legal_name(service_name):
+            raise GContainerException(ErrorConstants.ILLEGAL_SERVICE_NAME, service_name)
+
+        needs_docker = Service._check_fields(fields)
+
+        deploy_info = ctx.deploy.info(service_name)
+
+        if needs_docker and not ctx.docker.connected():
+            raise GContainerException(ErrorConstants.DOCKER_NOT_CONNECTED)
+
+        ctx.fields = fields
+        return Service._status_fields(ctx, service_name, deploy_info, fields or Service.STATUS_FIELDS)
+
+    @formatter('list')
+    @output
+    def list(self, ctx, fields=None):
+        """List all services. fields selects the fields to show, None shows the deployment state of every
+        service with its container status and config."""
+
+        needs_docker = Service._check_fields(fields)
+        if needs_docker and not ctx.docker.connected():
+            raise GContainerException(ErrorConstants.DOCKER_NOT_CONNECTED)
+
         services, count = ctx.deploy.load()
+        service_names = sorted(services)
+
+        ctx.fields = fields
+        if fields:
+            def _lookup(service):
+                return Service._status_fields(ctx, service, services[service], fields)
+
+            # only use the worker pool if the fields need the file system or docker
+            parallelism = 1
+            if any(field not in Service.STATE_FIELDS for field in fields):
+                parallelism = Service._parallelism(ctx, needs_docker)
+
+            results = parallel_map(_lookup, service_names, parallelism)
+            return {'deploys': dict(zip(service_names, results))}
+
+        def _lookup(service):
+            return ctx.docker.status(service), ctx.fs.current_config(service)
+
+        # inspect the containers and read the configs on the worker pool, results come back in order
+        results = parallel_map(_lookup, service_names, ctx.docker.parallelism)
 
-        for service in services:
-            docker_status = ctx.docker.status(service)
+        for service, (docker_status, current_config) in zip(service_names, results):
             services[service]['container_status'] = docker_status
-            services[service]['config'] = ctx.fs.current_config(service)
+            services[service]['config'] = current_config
 
         return {"deploys": services}
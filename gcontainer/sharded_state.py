@@ -0,0 +1,179 @@
+import errno
+import fcntl
+import json
+
+import os
+
+from .deploy_state import ADD, REMOVE, DeployLock, DeployState, DeployStatus, apply_ops, migrate_json_state
+from .error import GContainerException, ErrorConstants
+from .file_manager import FileSystemController
+
+
+class ShardedDeployState(DeployState):
+    """Keeps the deploy record of every service in its own file with its own lock.
+
+    Changes to a service only lock that service, so unrelated services can be started, stopped and deployed
+    at the same time. An index file lists all services for the host wide operations (add, remove and load).
+
+    The record files are authoritative. Services are added to the index before their record is written and
+    removed from it after their record is gone, so an interrupted change leaves at most a stale index entry,
+    which is ignored. The count in the index only changes when services are added or removed.
+    """
+
+    SHARD_DIR_NAME = 'deploys'
+    INDEX_FILE_NAME = '.index.json'
+    INDEX_LOCK_FILE_NAME = '.index.lock'
+    RECORD_SUFFIX = '.json'
+    LOCK_SUFFIX = '.lock'
+
+    def __init__(self, root):
+        self.root = root
+        self.shard_dir = FileSystemController.create_path_name(root, ShardedDeployState.SHARD_DIR_NAME)
+        self.index_file = FileSystemController.create_path_name(self.shard_dir, ShardedDeployState.INDEX_FILE_NAME)
+
+        if not os.access(self.index_file, os.F_OK):
+            if not os.access(self.shard_dir, os.F_OK):
+                os.makedirs(self.shard_dir, 0755)
+
+            with self._index_lock(fcntl.LOCK_EX):
+                if not os.access(self.index_file, os.F_OK):
+                    migrate_json_state(self.root, self._migrate)
+
+                if not os.access(self.index_file, os.F_OK):
+                    self._save_index(DeployStatus({DeployStatus.DEPLOYS_KEY: []}))
+
+    def _index_lock(self, mode):
+        return DeployLock(self.shard_dir, mode, ShardedDeployState.INDEX_LOCK_FILE_NAME)
+
+    def _service_lock(self, deploy_name, mode):
+        return DeployLock(self.shard_dir, mode, deploy_name + ShardedDeployState.LOCK_SUFFIX)
+
+    def _lock_file(self, deploy_name):
+        return FileSystemController.create_path_name(self.shard_dir, deploy_name + ShardedDeployState.LOCK_SUFFIX)
+
+    def _record_file(self, deploy_name):
+        return FileSystemController.create_path_name(self.shard_dir, deploy_name + ShardedDeployState.RECORD_SUFFIX)
+
+    @classmethod
+    def _save_atomic(cls, file_name, contents):
+        """Write a new version of a file and rename it into place."""
+
+        new_file = file_name + ".new"
+        with open(new_file, 'w') as new_json_file:
+            json.dump(contents, new_json_file, indent=2)
+
+        os.rename(new_file, file_name)
+
+    def _load_index(self):
+        with open(self.index_file, 'r') as json_file:
+            index = DeployStatus(json.load(json_file))
+            if index[DeployStatus.VERSION_KEY] != DeployStatus.DEPLOY_VERSION:
+                raise GContainerException(ErrorConstants.BAD_DEPLOY_VERSION,
+                                          index[DeployStatus.VERSION_KEY], DeployStatus.DEPLOY_VERSION)
+            return index
+
+    def _save_index(self, index):
+        index[DeployStatus.VERSION_KEY] = DeployStatus.DEPLOY_VERSION
+        ShardedDeployState._save_atomic(self.index_file, index)
+
+    def _load_record(self, deploy_name):
+        try:
+            with open(self._record_file(deploy_name), 'r') as json_file:
+                return json.load(json_file)
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+
+    def _migrate(self, deploys, count):
+        for deploy_name, deploy_info in deploys.iteritems():
+            ShardedDeployState._save_atomic(self._record_file(deploy_name), deploy_info)
+
+        self._save_index(DeployStatus({DeployStatus.COUNT_KEY: count,
+                                       DeployStatus.DEPLOYS_KEY: sorted(deploys)}))
+
+    def load(self):
+        with self._index_lock(fcntl.LOCK_SH):
+            index = self._load_index()
+
+        deploys = {}
+        for deploy_name in index[DeployStatus.DEPLOYS_KEY]:
+            deploy_info = self.info(deploy_name)
+            if deploy_info is not None:
+                deploys[deploy_name] = deploy_info
+
+        return deploys, index[DeployStatus.COUNT_KEY]
+
+    def info(self, deploy_name):
+        # reads of services that do not exist must not leave lock files behind
+        if not self.exists(deploy_name):
+            return None
+
+        with self._service_lock(deploy_name, fcntl.LOCK_SH):
+            return self._load_record(deploy_name)
+
+    def exists(self, deploy_name):
+        return os.access(self._record_file(deploy_name), os.F_OK)
+
+    def apply(self, ops):
+        """Apply the mutations. Only the affected services are locked, the index is locked if services are
+        added or removed. Locks are always taken in the same order (index first, then services by name)."""
+
+        deploy_names = sorted(set(op[1] for op in ops))
+        changes_index = any(op[0] in (ADD, REMOVE) for op in ops)
+
+        # fail before locking (and creating lock files for) services that do not exist
+        added = set(op[1] for op in ops if op[0] == ADD)
+        for deploy_name in deploy_names:
+            if deploy_name not in added and not self.exists(deploy_name):
+                raise GContainerException(ErrorConstants.NO_SUCH_DEPLOY, deploy_name)
+
+        locks = [self._service_lock(deploy_name, fcntl.LOCK_EX) for deploy_name in deploy_names]
+        if changes_index:
+            locks.insert(0, self._index_lock(fcntl.LOCK_EX))
+
+        entered = []
+        try:
+            for lock in locks:
+                lock.__enter__()
+                entered.append(lock)
+
+            self._apply(deploy_names, ops, changes_index)
+        finally:
+            for lock in reversed(entered):
+                lock.__exit__(None, None, None)
+
+    def _apply(self, deploy_names, ops, changes_index):
+        deploys = {}
+        for deploy_name in deploy_names:
+            deploy_info = self._load_record(deploy_name)
+            if deploy_info is not None:
+                deploys[deploy_name] = deploy_info
+
+        existing = set(deploys)
+        apply_ops(deploys, ops)
+
+        added = set(deploys) - existing
+        removed = existing - set(deploys)
+
+        index = None
+        if changes_index:
+            index = self._load_index()
+            index[DeployStatus.COUNT_KEY] += 1
+
+        if added:
+            index[DeployStatus.DEPLOYS_KEY] = sorted(set(index[DeployStatus.DEPLOYS_KEY]) | added)
+            self._save_index(index)
+
+        for deploy_name in deploy_names:
+            if deploy_name in deploys:
+                ShardedDeployState._save_atomic(self._record_file(deploy_name), deploys[deploy_name])
+            elif deploy_name in removed:
+                # the index lock keeps other changes out, readers that wait for the lock file notice that it
+                # is gone and take the lock again
+                os.unlink(self._record_file(deploy_name))
+                os.unlink(self._lock_file(deploy_name))
+
+        if index is not None and (removed or not added):
+            index[DeployStatus.DEPLOYS_KEY] = sorted(set(index[DeployStatus.DEPLOYS_KEY]) - removed)
+            self._save_index(index)
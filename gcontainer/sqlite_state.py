@@ -0,0 +1,127 @@
+import json
+import sqlite3
+import threading
+
+from .deploy_state import DeployState, DeployStatus, apply_ops, migrate_json_state
+from .error import GContainerException, ErrorConstants
+from .file_manager import FileSystemController
+
+
+class SqliteDeployState(DeployState):
+    """Keeps the deploy records in an SQLite database in WAL mode.
+
+    Every service is a row indexed by its name, so changes only touch the affected rows and readers
+    do not block writers. An existing deploy.json file is migrated into the database on first use.
+    """
+
+    DATABASE_FILE_NAME = 'deploy.db'
+
+    # sqlite waits up to this many seconds for another writer to finish
+    BUSY_TIMEOUT = 30.0
+
+    def __init__(self, root):
+        self.root = root
+        self.database_file = FileSystemController.create_path_name(root, SqliteDeployState.DATABASE_FILE_NAME)
+
+        # Autocommit mode, transactions are started explicitly. The connection is shared between worker
+        # threads of a command, the lock serializes its use.
+        self.connection = sqlite3.connect(self.database_file,
+                                          timeout=SqliteDeployState.BUSY_TIMEOUT,
+                                          isolation_level=None,
+                                          check_same_thread=False)
+        self.lock = threading.RLock()
+
+        with self.lock:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS deploys '
+                                    '(name TEXT PRIMARY KEY, record TEXT NOT NULL)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS meta '
+                                    '(key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+
+            if self._meta(DeployStatus.VERSION_KEY) is None:
+                # the json files are only moved away once the migrated records are committed
+                if not migrate_json_state(self.root, lambda deploys, count:
+                                          self._transaction(self._initialize, deploys, count)):
+                    self._transaction(self._initialize, {}, 0)
+            elif self._meta(DeployStatus.VERSION_KEY) != DeployStatus.DEPLOY_VERSION:
+                raise GContainerException(ErrorConstants.BAD_DEPLOY_VERSION,
+                                          self._meta(DeployStatus.VERSION_KEY), DeployStatus.DEPLOY_VERSION)
+
+    def _transaction(self, f, *args):
+        """Run f inside of a write transaction. The transaction is rolled back if f raises an exception."""
+
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                result = f(*args)
+                self.connection.execute('COMMIT')
+                return result
+            except Exception:
+                self.connection.execute('ROLLBACK')
+                raise
+
+    def _meta(self, key):
+        row = self.connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def _initialize(self, deploys, count):
+        """Set up a new database with the given deploy records, which are migrated from a deploy.json file."""
+
+        # another process may have won the race to set up the database
+        if self._meta(DeployStatus.VERSION_KEY) is not None:
+            return
+
+        self.connection.executemany('INSERT INTO deploys (name, record) VALUES (?, ?)',
+                                    [(name, json.dumps(record)) for name, record in deploys.iteritems()])
+        self.connection.executemany('INSERT INTO meta (key, value) VALUES (?, ?)',
+                                    [(DeployStatus.VERSION_KEY, DeployStatus.DEPLOY_VERSION),
+                                     (DeployStatus.COUNT_KEY, count)])
+
+    def load(self):
+        # the rows and the count are read from the same snapshot
+        with self.lock:
+            self.connection.execute('BEGIN')
+            try:
+                rows = self.connection.execute('SELECT name, record FROM deploys').fetchall()
+                count = self._meta(DeployStatus.COUNT_KEY)
+            finally:
+                self.connection.execute('COMMIT')
+
+        return dict((name, json.loads(record)) for name, record in rows), count
+
+    def info(self, deploy_name):
+        with self.lock:
+            row = self.connection.execute('SELECT record FROM deploys WHERE name = ?', (deploy_name,)).fetchone()
+
+        return json.loads(row[0]) if row else None
+
+    def exists(self, deploy_name):
+        with self.lock:
+            row = self.connection.execute('SELECT 1 FROM deploys WHERE name = ?', (deploy_name,)).fetchone()
+
+        return row is not None
+
+    def apply(self, ops):
+        self._transaction(self._apply, ops)
+
+    def _apply(self, ops):
+        """Apply the mutations to the rows of the affected services only."""
+
+        deploys = {}
+        for deploy_name in set(op[1] for op in ops):
+            record = self.info(deploy_name)
+            if record is not None:
+                deploys[deploy_name] = record
+
+        touched = set(deploys)
+        apply_ops(deploys, ops)
+
+        for deploy_name in touched | set(deploys):
+            if deploy_name in deploys:
+                self.connection.execute('INSERT OR REPLACE INTO deploys (name, record) VALUES (?, ?)',
+                                        (deploy_name, json.dumps(deploys[deploy_name])))
+            else:
+                self.connection.execute('DELETE FROM deploys WHERE name = ?', (deploy_name,))
+
+        self.connection.execute('UPDATE meta SET value = value + 1 WHERE key = ?', (DeployStatus.COUNT_KEY,))
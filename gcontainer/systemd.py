@@ -1,14 +1,74 @@
 import os
+import re
+import shutil
+import threading
+
+from contextlib import contextmanager
 
 from file_manager import FileSystemController
 from subprocess import call
 
+from .error import GContainerException, ErrorConstants
+
+
+class SystemctlManager:
+    """Changes unit files by running systemctl. Multiple units are handled by a single systemctl call."""
+
+    def __init__(self, systemctl):
+        self.systemctl = systemctl
+
+    def enable(self, units):
+        call([self.systemctl, 'preset'] + units)
+        call([self.systemctl, '--quiet', 'enable'] + units)
+
+    def disable(self, units):
+        call([self.systemctl, '--quiet', 'disable'] + units)
+
+    def reload(self):
+        call([self.systemctl, 'daemon-reload'])
+
+
+class DbusManager:
+    """Changes unit files through the systemd manager D-Bus API. Needs the dbus module (python-dbus).
+
+    Unlike systemctl, the manager does not add the .service suffix to unit names and does not reload after
+    enabling units."""
+
+    def __init__(self):
+        import dbus
+
+        self.dbus = dbus
+        systemd = dbus.SystemBus().get_object('org.freedesktop.systemd1', '/org/freedesktop/systemd1')
+        self.manager = dbus.Interface(systemd, 'org.freedesktop.systemd1.Manager')
+
+    def _call(self, method, *args):
+        try:
+            return getattr(self.manager, method)(*args)
+        except self.dbus.exceptions.DBusException as e:
+            raise GContainerException(ErrorConstants.SYSTEMD_CALL_FAILED, method, e)
+
+    def enable(self, units):
+        # not runtime only, do not replace existing symlinks
+        self._call('PresetUnitFiles', units, False, False)
+        self._call('EnableUnitFiles', units, False, False)
+        self._call('Reload')
+
+    def disable(self, units):
+        self._call('DisableUnitFiles', units, False)
+
+    def reload(self):
+        self._call('Reload')
+
 
 class Systemd:
     """ Interface with systemd.
 
-    TODO - This can probably talk to systemd directly through DBus. Investigate more. The current code
-    is pretty ghetto and may be somewhat brittle.
+    Unit files are changed through D-Bus if the dbus module is available and through systemctl otherwise,
+    see the [systemd] backend setting. Within a batch, all changes are sent at once when the batch ends.
+
+    With the [systemd] unit_mode setting 'template', all services share the gcontainer@.service template unit.
+    Enabling a service links its instance into multi-user.target.wants, the scripts of a service go into a
+    drop-in of its instance.
     """
 
     SCRIPTS = {'ExecStartPre': 'exec-start-pre.sh',
@@ -26,62 +86,317 @@ class Systemd:
 #
 [Unit]
 Description=gcontainer deployment of '{name}'
-After=docker.service
+After=docker.service gcontainerd-boot.service
 
 [Install]
 WantedBy=multi-user.target
 
 [Service]
-Type=simple
+{service_type}
 ExecStart={gcontainer} start --block --ignore-started {name}
 ExecStop={gcontainer} stop {name}
 TimeoutStopSec={timeout}
 '''
 
+    # the template unit for unit_mode 'template', %I is the (unescaped) service name
+    UNIT_TEMPLATE = '''\
+#
+# GContainer created configuration file
+#
+# DO NOT MODIFY! THIS FILE WILL BE OVERWRITTEN BY GCONTAINER!
+#
+# Template unit for all services
+#
+[Unit]
+Description=gcontainer deployment of '%I'
+After=docker.service gcontainerd-boot.service
+
+[Install]
+WantedBy=multi-user.target
+
+[Service]
+{service_type}
+ExecStart={gcontainer} start --block --ignore-started %I
+ExecStop={gcontainer} stop %I
+TimeoutStopSec={timeout}
+'''
+
+    # with [systemd] notify, 'start --block' reports the service as started once its container is ready and
+    # enforces the readiness timeout itself
+    SERVICE_TYPES = {False: 'Type=simple',
+                     True: 'Type=notify\nNotifyAccess=main\nTimeoutStartSec=0'}
+
+    TEMPLATE_NAME = 'gcontainer@.service'
+    DROP_IN_NAME = 'scripts.conf'
+    WANTS_DIR_NAME = 'multi-user.target.wants'
+
+    BACKENDS = ('auto', 'dbus', 'systemctl')
+    UNIT_MODES = ('file', 'template')
+
     def __init__(self, ctx):
         self.ctx = ctx
         self.config_dir = FileSystemController.create_path_name(ctx.config.get('systemd', 'config_dir'))
         self.gcontainer = ctx.config.get('systemd', 'gcontainer')
         self.systemctl = ctx.config.get('systemd', 'systemctl')
         self.timeout = ctx.config.get('systemd', 'timeout')
+        self.backend = ctx.config.get('systemd', 'backend')
+        self.unit_mode = ctx.config.get('systemd', 'unit_mode')
+        self.service_type = Systemd.SERVICE_TYPES[ctx.config.get('systemd', 'notify') == 'true']
+
+        if self.backend not in Systemd.BACKENDS:
+            raise GContainerException(ErrorConstants.UNKNOWN_SYSTEMD_BACKEND, self.backend)
+
+        if self.unit_mode not in Systemd.UNIT_MODES:
+            raise GContainerException(ErrorConstants.UNKNOWN_UNIT_MODE, self.unit_mode)
+
+        self.template_file = FileSystemController.create_path_name(self.config_dir, Systemd.TEMPLATE_NAME)
+        self.wants_dir = FileSystemController.create_path_name(self.config_dir, Systemd.WANTS_DIR_NAME)
+
+        # created on first use, see _manager
+        self.manager = None
+
+        # changes to apply when the current batch ends, None outside of a batch
+        self.pending = None
+        self.lock = threading.RLock()
+
+    def _manager(self):
+        """Returns the unit file manager for the configured backend. 'auto' uses D-Bus if it is available."""
+
+        with self.lock:
+            if self.manager is None:
+                if self.backend == 'systemctl':
+                    self.manager = SystemctlManager(self.systemctl)
+                else:
+                    try:
+                        self.manager = DbusManager()
+                    except Exception as e:
+                        if self.backend == 'dbus':
+                            raise GContainerException(ErrorConstants.SYSTEMD_NOT_AVAILABLE, e)
+                        self.manager = SystemctlManager(self.systemctl)
+
+            return self.manager
+
+    def _config_file(self, unit_name):
+        return FileSystemController.create_path_name(self.config_dir, unit_name)
+
+    @classmethod
+    def _unit_name(cls, name):
+        """Returns the unit name of the unit file of a service."""
+
+        return "gcontainer-%s.service" % name
+
+    @classmethod
+    def _escape(cls, name):
+        """Escape a name for a unit name like systemd-escape does. %I in the template unit reverses this."""
+
+        return ''.join('-' if c == '/' else
+                       c if c.isalnum() or c in ':_' or (c == '.' and i > 0) else
+                       '\\x%02x' % ord(c)
+                       for i, c in enumerate(name))
+
+    @classmethod
+    def _unescape(cls, escaped):
+        """Reverse _escape."""
 
-    def _config_file(self, name):
-        return FileSystemController.create_path_name(self.config_dir, "%s.service" % name)
+        return re.sub(r'\\x([0-9a-f]{2})', lambda m: chr(int(m.group(1), 16)), escaped.replace('-', '/'))
 
     @classmethod
-    def _name(cls, name):
-        return "gcontainer-%s" % name
+    def _instance_name(cls, name):
+        """Returns the unit name of the template instance for a service."""
+
+        return "gcontainer@%s.service" % Systemd._escape(name)
+
+    @contextmanager
+    def batch(self):
+        """Collect the enable and disable calls and apply all of them at once, with a single reload:
+
+        with ctx.systemd.batch():
+            ctx.systemd.enable(service_name)
+            ...
+
+        Batches can be nested, the changes are applied when the outermost batch ends.
+        """
+
+        with self.lock:
+            outermost = self.pending is None
+            if outermost:
+                self.pending = {'enable': [], 'disable': [], 'reload': False}
+
+        try:
+            yield self
+        finally:
+            if outermost:
+                with self.lock:
+                    pending, self.pending = self.pending, None
+                self._apply(pending['enable'], pending['disable'], pending['reload'])
+
+    def _apply(self, enable=(), disable=(), reload=False):
+        if enable:
+            try:
+                self._manager().enable(list(enable))
+            except Exception:
+                # remove the unit files, so the next enable writes and enables them again
+                for unit_name in enable:
+                    os.unlink(self._config_file(unit_name))
+                raise
+
+        if disable:
+            self._manager().disable(list(disable))
+            for unit_name in disable:
+                os.unlink(self._config_file(unit_name))
+
+        if disable or reload:
+            self._manager().reload()
+
+    def _reload(self):
+        """Reload the systemd configuration now or, within a batch, when the batch ends."""
+
+        with self.lock:
+            if self.pending is not None:
+                self.pending['reload'] = True
+                return
+
+        self._apply(reload=True)
+
+    def units(self):
+        """Returns the names of all services that have a unit file or an enabled template instance."""
+
+        prefix = Systemd._unit_name('')[:-len('.service')]
+        units = set(name[len(prefix):-len('.service')] for name in os.listdir(self.config_dir)
+                    if name.startswith(prefix) and name.endswith('.service'))
+
+        if os.path.isdir(self.wants_dir):
+            prefix = Systemd._instance_name('')[:-len('.service')]
+            units.update(Systemd._unescape(name[len(prefix):-len('.service')])
+                         for name in os.listdir(self.wants_dir)
+                         if name.startswith(prefix) and name.endswith('.service'))
+
+        return units
+
+    def _scripts(self, service_name):
+        """Returns the unit settings that run the scripts of a service."""
+
+        script_dir = self.ctx.fs.info_deploy(service_name)['script']
+        script_files = self.ctx.fs.load_scripts(service_name)
+
+        settings = ''
+        for key, script_name in sorted(Systemd.SCRIPTS.iteritems()):
+            if script_name in script_files:
+                script_file = FileSystemController.create_path_name(script_dir, script_name)
+                os.chmod(script_file, 0755)
+                settings += "%s=%s\n" % (key, script_file)
+
+        return settings
 
     def enable(self, service_name):
-        gcontainer_name = Systemd._name(service_name)
-        config_file = self._config_file(gcontainer_name)
+        if self.unit_mode == 'template':
+            self._enable_instance(service_name)
+        else:
+            self._enable_file(service_name)
+
+    def disable(self, service_name):
+        self._disable_file(service_name)
+        self._disable_instance(service_name)
+
+    def _enable_file(self, service_name):
+        unit_name = Systemd._unit_name(service_name)
+        config_file = self._config_file(unit_name)
+
+        with self.lock:
+            # disabled and enabled again in the same batch, the unit stays as it is
+            if self.pending is not None and unit_name in self.pending['disable']:
+                self.pending['disable'].remove(unit_name)
+                return
 
         if not os.access(config_file, os.F_OK):
             systemd_config = Systemd.TEMPLATE.format(name=service_name,
                                                      gcontainer=self.gcontainer,
-                                                     timeout=self.timeout)
-
-            script_dir = self.ctx.fs.info_deploy(service_name)['script']
-            script_files = self.ctx.fs.load_scripts(service_name)
-
-            for key, script_name in Systemd.SCRIPTS.iteritems():
-                if script_name in script_files:
-                    script_file = FileSystemController.create_path_name(script_dir, script_name)
-                    os.chmod(script_file, 0755)
-                    systemd_config += "%s=%s\n" % (key, script_file)
+                                                     timeout=self.timeout,
+                                                     service_type=self.service_type)
+            systemd_config += self._scripts(service_name)
 
             with open(config_file, 'w', 0644) as config_file:
                 config_file.write(systemd_config)
                 config_file.flush()
 
-            call([self.systemctl, 'preset', gcontainer_name])
-            call([self.systemctl, '--quiet', 'enable', gcontainer_name])
+            with self.lock:
+                if self.pending is not None:
+                    self.pending['enable'].append(unit_name)
+                    return
 
-    def disable(self, service_name):
-        gcontainer_name = Systemd._name(service_name)
-        config_file = self._config_file(gcontainer_name)
+            self._apply(enable=[unit_name])
+
+    def _disable_file(self, service_name):
+        unit_name = Systemd._unit_name(service_name)
+        config_file = self._config_file(unit_name)
 
         if os.access(config_file, os.F_OK):
-            call([self.systemctl, '--quiet', 'disable', gcontainer_name])
-            os.unlink(config_file)
-            call([self.systemctl, 'daemon-reload'])
+            with self.lock:
+                if self.pending is not None:
+                    if unit_name not in self.pending['disable']:
+                        self.pending['disable'].append(unit_name)
+                    return
+
+            self._apply(disable=[unit_name])
+
+    @classmethod
+    def _write(cls, file_name, contents):
+        """Write a file unless it already has the given contents. Returns true if the file was written."""
+
+        if os.access(file_name, os.F_OK):
+            with open(file_name, 'r') as current_file:
+                if current_file.read() == contents:
+                    return False
+
+        with open(file_name + '.new', 'w', 0644) as new_file:
+            new_file.write(contents)
+            new_file.flush()
+
+        os.rename(file_name + '.new', file_name)
+        return True
+
+    def _enable_instance(self, service_name):
+        """Link the template instance of a service into multi-user.target.wants. systemd is only reloaded
+        if the template unit or the drop-in of the service changed."""
+
+        # a service that was enabled with its own unit file moves to the template
+        self._disable_file(service_name)
+
+        instance_name = Systemd._instance_name(service_name)
+        changed = Systemd._write(self.template_file, Systemd.UNIT_TEMPLATE.format(gcontainer=self.gcontainer,
+                                                                                  timeout=self.timeout,
+                                                                                  service_type=self.service_type))
+
+        drop_in_dir = self._config_file(instance_name) + '.d'
+        drop_in_file = FileSystemController.create_path_name(drop_in_dir, Systemd.DROP_IN_NAME)
+        scripts = self._scripts(service_name)
+
+        if scripts:
+            if not os.path.isdir(drop_in_dir):
+                os.makedirs(drop_in_dir, 0755)
+            changed = Systemd._write(drop_in_file, "[Service]\n" + scripts) or changed
+        elif os.path.isdir(drop_in_dir):
+            shutil.rmtree(drop_in_dir)
+            changed = True
+
+        if not os.path.isdir(self.wants_dir):
+            os.makedirs(self.wants_dir, 0755)
+
+        link = FileSystemController.create_path_name(self.wants_dir, instance_name)
+        if not os.path.lexists(link):
+            os.symlink(self.template_file, link)
+
+        if changed:
+            self._reload()
+
+    def _disable_instance(self, service_name):
+        instance_name = Systemd._instance_name(service_name)
+
+        link = FileSystemController.create_path_name(self.wants_dir, instance_name)
+        if os.path.lexists(link):
+            os.unlink(link)
+
+        drop_in_dir = self._config_file(instance_name) + '.d'
+        if os.path.isdir(drop_in_dir):
+            shutil.rmtree(drop_in_dir)
+            self._reload()
@@ -1,4 +1,14 @@
 
+import os
+import socket
+
+
+# suffixes of the temporary container names while a service restarts, see Docker.replace_container. Docker
+# container names must start with a letter or number, so these are reserved instead.
+REPLACEMENT_SUFFIX = '.gcontainer-new'
+RETIRED_SUFFIX = '.gcontainer-old'
+
+
 def legal_name(name):
     """Check whether a given name is legal."""
 
@@ -15,6 +25,47 @@ def legal_name(name):
         if c.isspace():
             return False
 
+    # must not be the temporary container name of another service
+    if name.endswith(REPLACEMENT_SUFFIX) or name.endswith(RETIRED_SUFFIX):
+        return False
+
+    return True
+
+
+def is_pattern(name):
+    """Check whether a given name is a glob pattern (e.g. 'web-*')."""
+
+    return any(c in name for c in '*?[')
+
+
+def disk_usage(path):
+    """Returns the used space of the file system that contains path in percent."""
+
+    stat = os.statvfs(path)
+    used = stat.f_blocks - stat.f_bfree
+    available = used + stat.f_bavail
+    return 100.0 * used / available if available else 0.0
+
+
+def sd_notify(state):
+    """Send a state (e.g. 'READY=1') to systemd. Returns false if the process was not started by a
+    Type=notify unit."""
+
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return False
+
+    # abstract socket
+    if address[0] == '@':
+        address = '\0' + address[1:]
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        sock.connect(address)
+        sock.sendall(state)
+    finally:
+        sock.close()
+
     return True
 
 
@@ -46,3 +97,21 @@ def parse_environment(lines=[]):
         environment[key] = value
 
     return environment
+
+
+def parallel_map(f, items, parallelism=1):
+    """Apply f to all items on a bounded pool of worker threads. The results are returned in the order of the items."""
+
+    items = list(items)
+    workers = min(max(int(parallelism), 1), len(items))
+    if workers <= 1:
+        return [f(item) for item in items]
+
+    from multiprocessing.pool import ThreadPool
+
+    pool = ThreadPool(workers)
+    try:
+        return pool.map(f, items)
+    finally:
+        pool.close()
+        pool.join()
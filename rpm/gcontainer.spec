@@ -42,6 +42,12 @@ ln -s %{_bindir}/python %{buildroot}%{_libexecdir}/gcontainer/bin/python
 
 install -d %{buildroot}%{_bindir}
 ln -s %{_libexecdir}/gcontainer/bin/gcontainer %{buildroot}%{_bindir}/gcontainer
+ln -s %{_libexecdir}/gcontainer/bin/gcontainerd %{buildroot}%{_bindir}/gcontainerd
+
+install -d %{buildroot}%{_unitdir}
+install -m 0644 rpm/gcontainerd.service %{buildroot}%{_unitdir}/gcontainerd.service
+install -m 0644 rpm/gcontainerd-boot.service %{buildroot}%{_unitdir}/gcontainerd-boot.service
+install -m 0644 rpm/gcontainerd-watch.service %{buildroot}%{_unitdir}/gcontainerd-watch.service
 
 %clean
 exit 0
@@ -50,7 +56,11 @@ exit 0
 %files
 %defattr(-, root, root)
 %{_bindir}/gcontainer
+%{_bindir}/gcontainerd
 %{_libexecdir}/gcontainer
+%{_unitdir}/gcontainerd.service
+%{_unitdir}/gcontainerd-boot.service
+%{_unitdir}/gcontainerd-watch.service
 
 
 %changelog
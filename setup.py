@@ -30,7 +30,8 @@ setup(
     install_requires=dependencies,
     entry_points={
         'console_scripts': [
-            'gcontainer = gcontainer.cli:main',
+            'gcontainer = gcontainer.cli:run',
+            'gcontainerd = gcontainer.daemon:main',
         ],
     },
     classifiers=[
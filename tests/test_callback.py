@@ -0,0 +1,190 @@
+import json
+import os
+import pytest
+
+from click.testing import CliRunner
+from requests.exceptions import ConnectionError
+
+from gcontainer import callback
+from gcontainer.callback import CallbackSender
+from gcontainer.context import CmdContext
+
+
+class MockResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class MockReceiver:
+    """Records the callbacks and fails while 'down' is set."""
+
+    def __init__(self):
+        self.posts = []
+        self.batches = []
+        self.sessions = 0
+        self.down = False
+
+    def Session(self):
+        self.sessions += 1
+        return self
+
+    def post(self, uri, data=None, headers=None, timeout=None):
+        if self.down:
+            raise ConnectionError('down')
+
+        if uri.endswith('/batch'):
+            self.batches.append((uri, [(event['event'], event['name'], event.get('restarted', False))
+                                       for event in json.loads(data)['events']]))
+        else:
+            self.posts.append((uri, data['name'], data['deployment']))
+        return MockResponse(200)
+
+
+@pytest.fixture
+def receiver(monkeypatch):
+    receiver = MockReceiver()
+    monkeypatch.setattr(callback.requests, 'Session', receiver.Session)
+    return receiver
+
+
+@pytest.fixture
+def root():
+    return CliRunner().isolated_filesystem()
+
+
+def _callback():
+    ctx = CmdContext.init(CmdContext(), '/no-such-path', skip_root_check=True)
+    ctx.config.set('layout', 'root', 'gcontainer')
+    ctx.config.set('callback', 'max_attempts', '3')
+
+    cb = ctx.callback
+    # deliver from the test, not from a background process
+    cb.sender = CallbackSender(cb)
+    return cb
+
+
+def _spooled(cb, service_name):
+    service_dir = os.path.join(cb.spool_dir, service_name)
+    return sorted(os.listdir(service_dir)) if os.path.isdir(service_dir) else []
+
+
+def test_spool(root, receiver):
+    with root:
+        cb = _callback()
+        cb.running('http://callback', name='web', deployment='web:1', config='initial')
+        cb.stopped('http://callback/', name='web', deployment='web:1', config='initial')
+
+        # nothing is sent when the event is spooled
+        assert receiver.posts == []
+        assert len(_spooled(cb, 'web')) == 2
+
+        assert cb.sender.deliver() is None
+        assert receiver.posts == [('http://callback/running', 'web', 'web:1'),
+                                  ('http://callback/stopped', 'web', 'web:1')]
+        assert _spooled(cb, 'web') == []
+
+        # one session per callback host
+        cb.running('http://callback/other', name='web', deployment='web:1', config='initial')
+        cb.running('http://receiver', name='web', deployment='web:1', config='initial')
+        cb.sender.deliver()
+        assert receiver.sessions == 2
+
+
+def test_batch(root, receiver):
+    with root:
+        cb = _callback()
+        cb.batch_window = 0.2
+
+        for service_name in ('web-1', 'web-2'):
+            cb.stopped('http://callback', mode='collapse', name=service_name, deployment='web:1', config='initial')
+        cb.running('http://callback', mode='collapse', name='web-1', deployment='web:1', config='initial')
+        cb.running('http://other', mode='batch', name='db', deployment='db:1', config='initial')
+        cb.stopped('http://other', mode='batch', name='db', deployment='db:1', config='initial')
+
+        # events are held back for the batch window
+        delay = cb.sender.deliver()
+        assert 0 < delay <= 0.2
+        assert receiver.batches == []
+
+        cb.sender.drain()
+        assert receiver.posts == []
+        assert receiver.batches == [('http://callback/batch', [('running', 'web-1', True),
+                                                               ('stopped', 'web-2', False)]),
+                                    ('http://other/batch', [('running', 'db', False),
+                                                            ('stopped', 'db', False)])]
+
+
+def test_retry(root, receiver):
+    with root:
+        cb = _callback()
+        receiver.down = True
+        cb.running('http://callback', name='web', deployment='web:1', config='initial')
+        cb.stopped('http://callback', name='web', deployment='web:1', config='initial')
+        cb.running('http://callback', name='db', deployment='db:1', config='initial')
+
+        # the first event of every service is retried after the backoff, later events wait for it
+        delay = cb.sender.deliver()
+        assert 0 < delay <= cb.backoff
+        assert len(_spooled(cb, 'web')) == 2
+        assert cb.sender.deliver() == pytest.approx(delay, abs=0.1)
+
+        receiver.down = False
+        cb.sender.drain()
+        assert receiver.posts == [('http://callback/running', 'db', 'db:1'),
+                                  ('http://callback/running', 'web', 'web:1'),
+                                  ('http://callback/stopped', 'web', 'web:1')]
+
+
+def test_max_attempts(root, receiver, monkeypatch):
+    with root:
+        cb = _callback()
+        receiver.down = True
+        monkeypatch.setattr(callback.time, 'sleep', lambda delay: None)
+        cb.running('http://callback', name='web', deployment='web:1', config='initial')
+
+        # retry right away
+        cb.backoff = 0
+        cb.sender.drain()
+
+        assert _spooled(cb, 'web') == []
+        failed_dir = os.path.join(cb.spool_dir, CallbackSender.FAILED_DIR_NAME, 'web')
+        assert len(os.listdir(failed_dir)) == 1
+
+
+def test_spawn_sender(root, monkeypatch):
+    with root:
+        spawned = []
+        monkeypatch.setattr(callback.subprocess, 'Popen', lambda args, **kwargs: spawned.append(args))
+
+        cb = _callback()
+        cb.sender = None
+        cb.running('http://callback', name='web', deployment='web:1', config='initial')
+        assert spawned == [['/usr/bin/gcontainer', '--config', '/no-such-path', 'send-callbacks']]
+
+        # no sender is started while another one is running
+        with CallbackSender(cb)._lock():
+            cb.stopped('http://callback', name='web', deployment='web:1', config='initial')
+        assert len(spawned) == 1
+
+
+def test_sender_lock(root):
+    with root:
+        cb = _callback()
+        sender = CallbackSender(cb)
+
+        assert not sender.is_running()
+        with sender._lock():
+            assert CallbackSender(cb).is_running()
+
+            # a second sender leaves the spool alone
+            CallbackSender(cb).drain()
+        assert not sender.is_running()
+
+
+def test_ignore_callbacks(root, receiver):
+    with root:
+        cb = _callback()
+        cb.ignore_callbacks = True
+        cb.running('http://callback', name='web', deployment='web:1', config='initial')
+
+        assert _spooled(cb, 'web') == []
@@ -79,12 +79,13 @@ def test_cli_mock_commands_two_args(runner):
 
         assert result.exit_code == 0
         assert not result.exception
-        assert len(mock.args) == 3
+        assert len(mock.args) == 4
         assert len(mock.cmd) == 1
         assert mock.cmd[0] == cmd
         assert mock.args['service_name'] == param1
         assert mock.args['deploy_id'] == param2
         assert mock.args['callback_uri'] is None
+        assert mock.args['callback_mode'] == 'single'
 
 
 def test_cli_mock_commands_deploy_callback(runner):
@@ -95,16 +96,41 @@ def test_cli_mock_commands_deploy_callback(runner):
         param1 = str(uuid.uuid4())
         param2 = str(uuid.uuid4())
         param3 = str(uuid.uuid4())
-        result = runner.invoke(cli.main, [cmd, '--callback-uri', param3, param1, param2])
+        result = runner.invoke(cli.main, [cmd, '--callback-uri', param3, '--callback-mode', 'batch', param1, param2])
 
         assert result.exit_code == 0
         assert not result.exception
-        assert len(mock.args) == 3
+        assert len(mock.args) == 4
         assert len(mock.cmd) == 1
         assert mock.cmd[0] == cmd
         assert mock.args['service_name'] == param1
         assert mock.args['deploy_id'] == param2
         assert mock.args['callback_uri'] == param3
+        assert mock.args['callback_mode'] == 'batch'
+
+
+def test_cli_mock_commands_deploy_manifest(runner):
+    with runner.isolated_filesystem():
+        with open('manifest', 'w') as manifest:
+            manifest.write('web=registry/web:1\ndb=registry/db:2\n')
+
+        mock = MockService()
+        CmdContext.Commands['service_group'] = mock
+        result = runner.invoke(cli.main, ['deploy', '--manifest', 'manifest'])
+
+        assert result.exit_code == 0
+        assert not result.exception
+        assert mock.cmd == ['deploy_manifest']
+        assert mock.args['manifest'] == ['web=registry/web:1\n', 'db=registry/db:2\n']
+        assert mock.args['callback_uri'] is None
+
+        # a manifest can not be combined with a service name
+        mock = MockService()
+        CmdContext.Commands['service_group'] = mock
+        result = runner.invoke(cli.main, ['deploy', '--manifest', 'manifest', 'web'])
+
+        assert result.exit_code == 2
+        assert len(mock.cmd) == 0
 
 
 def test_cli_mock_commands_start_flags(runner):
@@ -113,16 +139,17 @@ def test_cli_mock_commands_start_flags(runner):
         mock = MockService()
         CmdContext.Commands['service_group'] = mock
         param1 = str(uuid.uuid4())
-        result = runner.invoke(cli.main, [cmd, '--ignore-started', '--block', param1])
+        result = runner.invoke(cli.main, [cmd, '--ignore-started', '--block', '--recreate', param1])
 
         assert result.exit_code == 0
         assert not result.exception
-        assert len(mock.args) == 3
+        assert len(mock.args) == 4
         assert len(mock.cmd) == 1
         assert mock.cmd[0] == cmd
         assert mock.args['service_name'] == param1
         assert mock.args['started_flag']
         assert mock.args['block_flag']
+        assert mock.args['recreate_flag']
 
 
 def test_cli_mock_commands_stop_flags(runner):
@@ -142,6 +169,81 @@ def test_cli_mock_commands_stop_flags(runner):
         assert mock.args['stopped_flag']
 
 
+def test_cli_mock_commands_multiple_args(runner):
+    for cmd in ('start', 'stop', 'restart', 'enable', 'disable'):
+        for args in ([str(uuid.uuid4()), str(uuid.uuid4())], ['web-*'], ['--all']):
+            with runner.isolated_filesystem():
+                mock = MockService()
+                CmdContext.Commands['service_group'] = mock
+                result = runner.invoke(cli.main, [cmd] + args)
+
+                assert result.exit_code == 0
+                assert not result.exception
+                assert mock.cmd == ['bulk']
+                assert mock.args['command'] == cmd
+                if args == ['--all']:
+                    assert mock.args['all_services']
+                    assert mock.args['service_names'] == ()
+                else:
+                    assert not mock.args['all_services']
+                    assert mock.args['service_names'] == tuple(args)
+
+
+def test_cli_mock_commands_bulk_failure(runner):
+    with runner.isolated_filesystem():
+        mock = MockService()
+        mock.exit_code = 1
+        CmdContext.Commands['service_group'] = mock
+        result = runner.invoke(cli.main, ['stop', '--all'])
+
+        assert result.exit_code == 1
+        assert mock.cmd == ['bulk']
+
+
+def test_cli_mock_commands_set(runner):
+    for args, priority, after, timeout in (([], None, None, None),
+                                           (['--priority', '10'], 10, None, None),
+                                           (['--after', 'a', '--after', 'b'], None, ['a', 'b'], None),
+                                           (['--no-after'], None, [], None),
+                                           (['--readiness-timeout', '120'], None, None, 120)):
+        with runner.isolated_filesystem():
+            mock = MockService()
+            CmdContext.Commands['service_group'] = mock
+            param = str(uuid.uuid4())
+            result = runner.invoke(cli.main, ['set'] + args + [param])
+
+            assert result.exit_code == 0
+            assert not result.exception
+            assert mock.cmd == ['set']
+            assert mock.args['service_name'] == param
+            assert mock.args['priority'] == priority
+            assert mock.args['after'] == after
+            assert mock.args['readiness_timeout'] == timeout
+
+
+def test_cli_mock_commands_fields(runner):
+    for cmd in (['status', 'web'], ['list']):
+        with runner.isolated_filesystem():
+            mock = MockService()
+            CmdContext.Commands['service_group'] = mock
+            result = runner.invoke(cli.main, cmd + ['--fields', 'running, deployment,'])
+
+            assert result.exit_code == 0
+            assert not result.exception
+            assert mock.cmd == [cmd[0]]
+            assert mock.args['fields'] == ['running', 'deployment']
+
+
+def test_cli_mock_boot(runner):
+    with runner.isolated_filesystem():
+        mock = MockService()
+        CmdContext.Commands['service_group'] = mock
+        result = runner.invoke(cli.main, ['boot'])
+
+        assert result.exit_code == 0
+        assert mock.cmd == ['boot']
+
+
 def test_cli_mock_config_list(runner):
     with runner.isolated_filesystem():
         mock = MockConfig()
@@ -208,6 +310,7 @@ class MockService:
     def __init__(self):
         self.args = {}
         self.cmd = []
+        self.exit_code = 0
 
     def create(self, ctx, service_name):
         self.cmd.append('create')
@@ -217,11 +320,12 @@ class MockService:
         self.cmd.append('remove')
         self.args['service_name'] = service_name
 
-    def deploy(self, ctx, service_name, deploy_id, callback_uri=None):
+    def deploy(self, ctx, service_name, deploy_id, callback_uri=None, callback_mode=None):
         self.cmd.append('deploy')
         self.args['service_name'] = service_name
         self.args['deploy_id'] = deploy_id
         self.args['callback_uri'] = callback_uri
+        self.args['callback_mode'] = callback_mode
 
     def start(self, ctx, service_name):
         self.cmd.append('start')
@@ -233,6 +337,9 @@ class MockService:
         if ctx.block_flag:
             self.args['block_flag'] = True
 
+        if ctx.recreate_flag:
+            self.args['recreate_flag'] = True
+
     def stop(self, ctx, service_name):
         self.cmd.append('stop')
         self.args['service_name'] = service_name
@@ -252,12 +359,41 @@ class MockService:
         self.cmd.append('disable')
         self.args['service_name'] = service_name
 
-    def status(self, ctx, service_name):
+    def bulk(self, ctx, command, service_names, all_services=False):
+        self.cmd.append('bulk')
+        self.args['command'] = command
+        self.args['service_names'] = service_names
+        self.args['all_services'] = all_services
+        return self.exit_code
+
+    def set(self, ctx, service_name, priority=None, after=None, readiness_timeout=None):
+        self.cmd.append('set')
+        self.args['service_name'] = service_name
+        self.args['priority'] = priority
+        self.args['after'] = after
+        self.args['readiness_timeout'] = readiness_timeout
+
+    def deploy_manifest(self, ctx, manifest, callback_uri=None, callback_mode=None):
+        self.cmd.append('deploy_manifest')
+        self.args['manifest'] = manifest
+        self.args['callback_uri'] = callback_uri
+        self.args['callback_mode'] = callback_mode
+        return self.exit_code
+
+    def boot(self, ctx):
+        self.cmd.append('boot')
+        return self.exit_code
+
+    def status(self, ctx, service_name, fields=None):
         self.cmd.append('status')
         self.args['service_name'] = service_name
+        if fields:
+            self.args['fields'] = fields
 
-    def list(self, ctx):
+    def list(self, ctx, fields=None):
         self.cmd.append('list')
+        if fields:
+            self.args['fields'] = fields
 
 
 class MockConfig:
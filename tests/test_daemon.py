@@ -0,0 +1,55 @@
+import os
+import threading
+
+from click.testing import CliRunner
+
+from gcontainer.context import CmdContext
+from gcontainer.daemon import DaemonServer, forward, forwardable
+from tests.test_cli import MockService
+
+
+def test_forwardable():
+    assert forwardable(['list'])
+    assert forwardable(['--json', 'status', 'foo'])
+    assert forwardable(['start', '--ignore-started', 'foo'])
+    assert not forwardable([])
+    assert not forwardable(['--config', 'foo.conf', 'list'])
+    assert not forwardable(['--config=foo.conf', 'list'])
+    assert not forwardable(['start', '--block', 'foo'])
+    assert not forwardable(['--json', 'boot'])
+    assert not forwardable(['send-callbacks'])
+    assert not forwardable(['watch', '--callbacks'])
+    assert not forwardable(['deploy', '--manifest', 'release.txt'])
+
+
+def test_forward_no_daemon():
+    with CliRunner().isolated_filesystem():
+        assert forward(['list'], os.path.abspath('no-such-socket')) is None
+
+
+def test_daemon_roundtrip():
+    with CliRunner().isolated_filesystem():
+        mock = MockService()
+        CmdContext.Commands['service_group'] = mock
+        ctx = CmdContext.init(CmdContext(), '/no-such-path', skip_root_check=True)
+
+        socket_path = os.path.abspath('gcontainerd.sock')
+        server = DaemonServer(socket_path, ctx)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        try:
+            assert forward(['list'], socket_path) == (0, '', '')
+            assert forward(['status', 'foo'], socket_path) == (0, '', '')
+            assert mock.cmd == ['list', 'status']
+            assert mock.args['service_name'] == 'foo'
+
+            exit_code, stdout, stderr = forward(['no-such-command'], socket_path)
+            assert exit_code == 2
+            assert 'No such command' in stderr
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        assert not os.path.exists(socket_path)
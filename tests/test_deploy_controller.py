@@ -5,7 +5,10 @@ import uuid
 
 from click.testing import CliRunner
 
-from gcontainer.deploy_controller import DeployController, DeployStatus
+from gcontainer.deploy_controller import DeployController, DeployTransaction
+from gcontainer import deploy_state
+from gcontainer.deploy_state import DeployStatus
+from gcontainer.error import GContainerException
 from gcontainer.file_manager import FileSystemController
 
 
@@ -139,3 +142,196 @@ def test_deploy(root):
         info = deploy.info(deploy_name)
         assert info['deployment'] == deploy2
         assert 'callback_uri' not in info
+
+
+def test_deploy_history(root):
+    with root:
+        deploy = DeployController('')
+        deploy.add('web')
+
+        for deploy_id in ('web:1', 'web:2', 'web:3', 'web:2', 'web:2'):
+            deploy.save_deploy('web', deploy_id)
+
+        # newest first, every deploy id once, the current deployment is not part of the history
+        info = deploy.info('web')
+        assert info['deployment'] == 'web:2'
+        assert info['history'] == ['web:3', 'web:1']
+
+        for i in range(20):
+            deploy.save_deploy('web', 'web:%d' % (i + 10))
+
+        assert len(deploy.info('web')['history']) == DeployTransaction.HISTORY_SIZE
+        assert deploy.info('web')['history'][0] == 'web:28'
+
+
+def test_cache(root, monkeypatch):
+    with root:
+        deploy = DeployController('')
+        deploy_name = str(uuid.uuid4())
+        deploy.add(deploy_name)
+
+        loads = []
+        json_load = deploy_state.json.load
+
+        def _counting_load(fd):
+            loads.append(fd.name)
+            return json_load(fd)
+
+        monkeypatch.setattr(deploy_state.json, 'load', _counting_load)
+
+        # the writer keeps what it wrote, repeated reads do not parse the file
+        assert deploy.exists(deploy_name)
+        assert not deploy.info(deploy_name)['running']
+        deploy.load()
+        assert len(loads) == 0
+
+        # callers get copies
+        deploy.info(deploy_name)['running'] = True
+        deploys, count = deploy.load()
+        deploys[deploy_name]['enabled'] = True
+        assert not deploy.info(deploy_name)['running']
+        assert not deploy.info(deploy_name)['enabled']
+
+        # changes from another controller (or process) replace the file and are picked up
+        DeployController('').set_running(deploy_name, True)
+        del loads[:]
+
+        assert deploy.info(deploy_name)['running']
+        assert deploy.exists(deploy_name)
+        assert len(loads) == 1
+
+        # a new version with the same inode, mtime and size is told apart by its count
+        deploy_file = FileSystemController.create_path_name('', DeployController.DEPLOY_FILE_NAME)
+        stat = os.stat(deploy_file)
+        with open(deploy_file) as fd:
+            contents = fd.read()
+        with open(deploy_file, 'r+') as fd:
+            fd.write(contents.replace('"count": 2', '"count": 3').replace('"running": true', '"running": 1234'))
+        os.utime(deploy_file, (stat.st_atime, stat.st_mtime))
+        assert os.stat(deploy_file).st_size == stat.st_size
+        assert os.stat(deploy_file).st_ino == stat.st_ino
+        del loads[:]
+
+        assert deploy.info(deploy_name)['running'] == 1234
+        assert len(loads) == 1
+
+
+def test_transaction(root):
+    with root:
+        deploy = DeployController('')
+        deploy_name = str(uuid.uuid4())
+        other_name = str(uuid.uuid4())
+        deploy1 = str(uuid.uuid4())
+
+        deploy.add(deploy_name)
+        deploys, count = deploy.load()
+
+        with deploy.transaction() as tx:
+            tx.add(other_name)
+            tx.set_running(deploy_name, True)
+            tx.save_deploy(deploy_name, deploy1)
+
+            # reads within the transaction see its changes, everybody else sees the old state
+            assert tx.exists(other_name)
+            assert tx.info(deploy_name)['running']
+            assert tx.info(deploy_name)['deployment'] == deploy1
+            assert not deploy.exists(other_name)
+            assert not deploy.info(deploy_name)['running']
+
+        # all changes are written at once
+        deploys, new_count = deploy.load()
+        assert new_count == count + 1
+        assert deploys[deploy_name]['running']
+        assert deploys[deploy_name]['deployment'] == deploy1
+        assert other_name in deploys
+
+
+def test_transaction_discard(root):
+    with root:
+        deploy = DeployController('')
+        deploy_name = str(uuid.uuid4())
+
+        deploy.add(deploy_name)
+
+        with pytest.raises(ValueError):
+            with deploy.transaction() as tx:
+                tx.set_enabled(deploy_name, True)
+                raise ValueError()
+
+        assert not deploy.info(deploy_name)['enabled']
+
+        # mutations that do not fit the state are rejected
+        with deploy.transaction() as tx:
+            with pytest.raises(GContainerException):
+                tx.add(deploy_name)
+            with pytest.raises(GContainerException):
+                tx.info(str(uuid.uuid4()))
+
+
+def test_journal(root):
+    with root:
+        deploy = DeployController('', journal=True)
+        deploy_name = str(uuid.uuid4())
+
+        deploy.add(deploy_name)
+        deploy.set_running(deploy_name, True)
+
+        deploy_file = FileSystemController.create_path_name('', DeployController.DEPLOY_FILE_NAME)
+        journal_file = FileSystemController.create_path_name('', deploy_state.JsonDeployState.JOURNAL_FILE_NAME)
+
+        # changes only go to the journal
+        with open(deploy_file) as fd:
+            assert len(DeployStatus(json.load(fd))[DeployStatus.DEPLOYS_KEY]) == 0
+        with open(journal_file) as fd:
+            assert len(fd.readlines()) == 2
+
+        # other controllers replay the journal, with or without journal mode
+        assert DeployController('', journal=True).info(deploy_name)['running']
+        deploys, count = DeployController('').load()
+        assert deploys[deploy_name]['running']
+        assert count == 2
+
+        # an incomplete record is ignored and overwritten by the next change
+        with open(journal_file, 'a') as fd:
+            fd.write('{"count": 3, "ops": [["update", ')
+
+        other = DeployController('', journal=True)
+        assert other.info(deploy_name)['running']
+        other.set_enabled(deploy_name, True)
+
+        with open(journal_file) as fd:
+            assert len(fd.readlines()) == 3
+
+        info = deploy.info(deploy_name)
+        assert info['running']
+        assert info['enabled']
+
+
+def test_journal_compaction(root):
+    with root:
+        deploy = DeployController('', journal=True, journal_compact_size=200)
+        deploy_name = str(uuid.uuid4())
+
+        deploy.add(deploy_name)
+        for i in range(10):
+            deploy.set_running(deploy_name, i % 2 == 0)
+
+        deploy_file = FileSystemController.create_path_name('', DeployController.DEPLOY_FILE_NAME)
+        journal_file = FileSystemController.create_path_name('', deploy_state.JsonDeployState.JOURNAL_FILE_NAME)
+
+        assert os.stat(journal_file).st_size <= 200
+        with open(deploy_file) as fd:
+            assert deploy_name in DeployStatus(json.load(fd))[DeployStatus.DEPLOYS_KEY]
+
+        # an interrupted compaction leaves records in the journal that are already in the snapshot
+        with open(journal_file) as fd:
+            records = fd.read()
+        deploy.set_enabled(deploy_name, True)
+        deploy.state._save_atomic(deploy.state._load_deploy())
+        with open(journal_file, 'a') as fd:
+            fd.write(records)
+
+        deploys, count = DeployController('').load()
+        assert count == 12
+        assert not deploys[deploy_name]['running']
+        assert deploys[deploy_name]['enabled']
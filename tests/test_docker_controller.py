@@ -0,0 +1,243 @@
+import json
+import pytest
+
+from docker.errors import APIError
+
+from gcontainer import docker_controller
+from gcontainer.context import CmdContext
+from gcontainer.docker_controller import Docker
+from gcontainer.error import ErrorConstants, GContainerException
+
+
+class MockResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.content = ''
+
+
+class MockClient:
+    def __init__(self, *args, **kwargs):
+        self.local_images = set()
+        self.pulls = []
+        self.image_ids = {}
+        self.images_list = []
+        self.new_containers = []
+        self.names = ['web']
+        self.running = set(['web'])
+        self.failing = set()
+        self.failing_renames = set()
+        self.calls = []
+        self.labels = {}
+        self._version = '1.18'
+
+    def inspect_image(self, image_id):
+        if image_id not in self.local_images:
+            raise APIError('not found', MockResponse(404))
+        return {'Id': self.image_ids.get(image_id, image_id)}
+
+    def images(self):
+        return self.images_list
+
+    def containers(self, all=False):
+        return [{'Names': ['/' + name], 'Image': 'registry/web:2', 'Id': 'id-' + name}
+                for name in self.names] + self.new_containers
+
+    def inspect_container(self, name):
+        return {'Id': 'id-' + name, 'State': {'Running': name in self.running},
+                'Config': {'Labels': self.labels.get(name)}}
+
+    def create_container_from_config(self, config, name=None):
+        self.calls.append(('create', name))
+        self.labels[name] = config['Labels']
+        if name not in self.names:
+            self.names.append(name)
+        return {'Id': 'id-' + name}
+
+    def stop(self, name):
+        self.calls.append(('stop', name))
+        self.running.discard(name)
+
+    def start(self, name):
+        self.calls.append(('start', name))
+        # fails once
+        if name in self.failing:
+            self.failing.remove(name)
+            raise APIError('can not start', MockResponse(500))
+        self.running.add(name)
+
+    def rename(self, name, new_name):
+        self.calls.append(('rename', name, new_name))
+        if name in self.failing_renames:
+            raise APIError('can not rename', MockResponse(500))
+
+        self.names[self.names.index(name)] = new_name
+        if name in self.running:
+            self.running.remove(name)
+            self.running.add(new_name)
+
+    def remove_container(self, name):
+        self.calls.append(('remove', name))
+        self.names.remove(name)
+
+    def events(self, since=None, filters=None):
+        self.filters = filters
+        stream = json.dumps({'status': 'die', 'id': 'id-web'}) + json.dumps({'status': 'start', 'id': 'id-web'})
+        return [stream[:10], stream[10:]]
+
+    def pull(self, repository, tag=None, stream=False, insecure_registry=False):
+        self.pulls.append((repository, tag))
+        self.local_images.add('%s:%s' % (repository, tag))
+
+        stream = json.dumps({'status': 'Pulling fs layer', 'progressDetail': {}, 'id': 'aaa'}) + '\r\n' + \
+            json.dumps({'status': 'Pull complete', 'progressDetail': {}, 'id': 'aaa'}) + '\r\n'
+
+        # the chunks do not line up with the progress messages
+        return [stream[:20], stream[20:]]
+
+
+@pytest.fixture
+def docker(monkeypatch):
+    monkeypatch.setattr(docker_controller, 'Client', MockClient)
+
+    ctx = CmdContext()
+    ctx.config = CmdContext._load_configuration()
+    return Docker(ctx)
+
+
+def test_pull_image(docker):
+    summary = docker.pull_image('registry/web:1')
+
+    assert docker.cli.pulls == [('registry/web', '1')]
+    assert summary['layers'] == 1
+    assert summary['complete'] == 1
+
+
+def test_pull_digest(docker):
+    docker.pull_image('registry/web@sha256:1234')
+
+    assert docker.cli.pulls == [('registry/web', 'sha256:1234')]
+
+
+def test_pull_policy(docker):
+    assert docker.pull_policy == 'always'
+
+    assert not docker.has_image('registry/web:1')
+    assert docker.ensure_image('registry/web:1', 'if-missing')
+    assert docker.has_image('registry/web:1')
+
+    # the image is present now
+    assert not docker.ensure_image('registry/web:1', 'if-missing')
+    assert not docker.ensure_image('registry/web:1', 'never')
+    assert docker.ensure_image('registry/web:1')
+    assert len(docker.cli.pulls) == 2
+
+    with pytest.raises(GContainerException) as e:
+        docker.ensure_image('registry/web:2', 'never')
+    assert e.value.error_code == ErrorConstants.IMAGE_NOT_AVAILABLE.value
+
+    with pytest.raises(GContainerException) as e:
+        docker.ensure_image('registry/web:2', 'sometimes')
+    assert e.value.error_code == ErrorConstants.UNKNOWN_PULL_POLICY.value
+    assert len(docker.cli.pulls) == 2
+
+
+def test_unused_images(docker):
+    docker.cli.local_images = set(['registry/web:1', 'registry/web:2', 'registry/web:3', 'registry/web:4'])
+    docker.cli.image_ids = {'registry/web:2': 'id2', 'registry/web:3': 'id3', 'registry/web:4': 'id4'}
+    docker.cli.images_list = [
+        {'Id': 'id4', 'Created': 4, 'RepoTags': ['registry/web:4']},
+        {'Id': 'id1', 'Created': 1, 'RepoTags': ['registry/web:1', 'other/tool:1']},
+        {'Id': 'id2', 'Created': 2, 'RepoTags': ['registry/web:2']},
+        {'Id': 'id3', 'Created': 3, 'RepoTags': ['registry/web:3', 'registry/web:three']},
+        {'Id': 'id5', 'Created': 0, 'RepoTags': ['other/tool:2']},
+        {'Id': 'id6', 'Created': 5, 'RepoTags': None},
+    ]
+
+    # images of other repositories, images in use by containers and kept images are not returned
+    images = docker.unused_images(set(['registry/web:4', 'registry/web:gone']), set(['registry/web']))
+    assert [(image['id'], image['tags']) for image in images] == \
+        [('id1', ['registry/web:1']), ('id3', ['registry/web:3', 'registry/web:three'])]
+
+
+def test_events(docker):
+    assert [event['status'] for event in docker.events()] == ['die', 'start']
+    assert docker.cli.filters == {'event': ['start', 'die', 'oom']}
+
+
+def test_service_name(docker):
+    assert docker.service_name('id-web') == 'web'
+
+    # containers created later are found after reloading the inventory
+    docker.cli.new_containers.append({'Names': ['/db'], 'Image': 'registry/db:1', 'Id': 'id-db'})
+    assert docker.service_name('id-db') == 'db'
+    assert docker.service_name('id-other') is None
+
+
+def test_replace_container(docker, monkeypatch):
+    monkeypatch.setattr(docker, '_host_config', lambda service_name: {'NetworkMode': 'host'})
+
+    # the containers of other services that look like temporary names are left alone
+    docker.cli.names.extend(['web.new', 'web.old'])
+    docker.prepare_container('web', 'registry/web:2')
+
+    assert docker.replace_container('web') >= 0
+    assert docker.cli.calls == [('create', 'web.gcontainer-new'),
+                                ('stop', 'web'),
+                                ('rename', 'web', 'web.gcontainer-old'),
+                                ('rename', 'web.gcontainer-new', 'web'),
+                                ('start', 'web'),
+                                ('remove', 'web.gcontainer-old')]
+    assert sorted(docker.cli.names) == ['web', 'web.new', 'web.old']
+    assert docker.cli.running == set(['web'])
+
+
+def test_replace_container_fails(docker):
+    docker.cli.names.append('web.gcontainer-new')
+    docker.cli.failing.add('web')
+
+    # the new container does not start, the old one is started again
+    with pytest.raises(APIError):
+        docker.replace_container('web')
+
+    assert docker.cli.calls[3:] == [('start', 'web'),
+                                    ('rename', 'web', 'web.gcontainer-new'),
+                                    ('rename', 'web.gcontainer-old', 'web'),
+                                    ('start', 'web')]
+    assert sorted(docker.cli.names) == ['web', 'web.gcontainer-new']
+    assert docker.cli.running == set(['web'])
+
+
+def test_replace_container_rename_fails(docker):
+    docker.cli.names.append('web.gcontainer-new')
+    docker.cli.failing_renames.add('web.gcontainer-new')
+
+    # the old container was renamed but the new one could not take its name
+    with pytest.raises(APIError):
+        docker.replace_container('web')
+
+    assert docker.cli.calls == [('stop', 'web'),
+                                ('rename', 'web', 'web.gcontainer-old'),
+                                ('rename', 'web.gcontainer-new', 'web'),
+                                ('rename', 'web.gcontainer-old', 'web'),
+                                ('start', 'web')]
+    assert sorted(docker.cli.names) == ['web', 'web.gcontainer-new']
+    assert docker.cli.running == set(['web'])
+
+
+def test_create_container(docker, monkeypatch):
+    monkeypatch.setattr(docker, '_host_config', lambda service_name: {'NetworkMode': 'host'})
+    docker.cli.local_images.update(['registry/web:1', 'registry/web:2'])
+    docker.cli.image_ids['registry/web:2'] = 'image-2'
+
+    # the existing container has no fingerprint
+    assert docker.create_container('web', 'registry/web:1', environment={'A': '1'})
+    assert docker.cli.calls == [('remove', 'web'), ('create', 'web')]
+
+    # nothing changed, the container is kept
+    assert not docker.create_container('web', 'registry/web:1', environment={'A': '1'})
+    assert docker.cli.calls == [('remove', 'web'), ('create', 'web')]
+
+    assert docker.create_container('web', 'registry/web:1', environment={'A': '1'}, recreate=True)
+    assert docker.create_container('web', 'registry/web:1', environment={'A': '2'})
+    assert docker.create_container('web', 'registry/web:2', environment={'A': '2'})
+    assert len(docker.cli.calls) == 8
@@ -28,7 +28,7 @@ def test_basic(fs_base, ctx):
     with fs_base:
         FileSystemController(ctx)
 
-        for key in ('config_dir', 'log_dir', 'script_dir', 'archive_dir'):
+        for key in ('config_dir', 'log_dir', 'script_dir', 'archive_dir', 'spool_dir'):
             dir_name = FileSystemController.create_path_name(TEST_NAME, CmdContext.DefaultValues['layout'][key])
             assert os.access(dir_name, os.F_OK | os.R_OK | os.W_OK)
 
@@ -0,0 +1,83 @@
+import json
+
+from gcontainer.progress import NdjsonRenderer, PullProgress, StreamDecoder
+
+PULL = [{'status': 'Pulling from g/httpd', 'id': '3.0'},
+        {'status': 'Pulling fs layer', 'progressDetail': {}, 'id': 'aaa'},
+        {'status': 'Already exists', 'progressDetail': {}, 'id': 'bbb'},
+        {'status': 'Downloading', 'progressDetail': {'current': 100, 'total': 1000}, 'id': 'aaa'},
+        {'status': 'Downloading', 'progressDetail': {'current': 500, 'total': 1000}, 'id': 'aaa'},
+        {'status': 'Download complete', 'progressDetail': {}, 'id': 'aaa'},
+        {'status': 'Pull complete', 'progressDetail': {}, 'id': 'aaa'},
+        {'status': 'Status: Downloaded newer image for g/httpd:3.0'}]
+
+
+def test_stream_decoder():
+    stream = '\r\n'.join(json.dumps(fields) for fields in PULL)
+
+    # the chunks do not line up with the objects
+    for chunk_size in (1, 7, 64, len(stream)):
+        decoder = StreamDecoder()
+        objects = []
+        for i in range(0, len(stream), chunk_size):
+            objects.extend(decoder.feed(stream[i:i + chunk_size]))
+
+        assert objects == PULL
+        assert decoder.buffer == ''
+
+    decoder = StreamDecoder()
+    assert decoder.feed('{"status": "Downl') == []
+    assert decoder.buffer == '{"status": "Downl'
+    assert decoder.feed('oading"}{"error": "x"}\n') == [{'status': 'Downloading'}, {'error': 'x'}]
+
+    # malformed objects are skipped up to the next newline instead of staying in the buffer
+    decoder = StreamDecoder()
+    assert decoder.feed('{"status": bad}') == []
+    assert decoder.feed('\r\n{"status": "Downloading"}{"status": x}\n{"id": "aaa"}\n') == \
+        [{'status': 'Downloading'}, {'id': 'aaa'}]
+    assert decoder.buffer == ''
+
+
+def test_pull_progress():
+    progress = PullProgress('g/httpd:3.0')
+    for fields in PULL[:5]:
+        progress.update(fields)
+
+    summary = progress.summary()
+    assert summary['layers'] == 2
+    assert summary['complete'] == 1
+    assert summary['current'] == 500
+    assert summary['total'] == 1000
+
+    for fields in PULL[5:]:
+        progress.update(fields)
+
+    summary = progress.summary()
+    assert summary['complete'] == 2
+    assert summary['current'] == 1000
+    assert summary['status'] == 'Status: Downloaded newer image for g/httpd:3.0'
+    assert not progress.errors
+
+    progress.update({'error': 'manifest unknown'})
+    assert progress.errors == ['manifest unknown']
+
+
+def test_ndjson_renderer(capsys):
+    renderer = NdjsonRenderer()
+    progress = PullProgress('g/httpd:3.0')
+
+    renderer.start(progress)
+    for fields in PULL:
+        progress.update(fields)
+        renderer.update(progress, fields)
+    renderer.finish(progress)
+
+    out, err = capsys.readouterr()
+    records = [json.loads(line) for line in err.splitlines()]
+
+    assert out == ''
+    assert len(records) == len(PULL) + 1
+    assert records[3] == {'image': 'g/httpd:3.0', 'status': 'Downloading', 'layer': 'aaa', 'current': 100,
+                          'total': 1000}
+    assert records[-1]['status'] == 'done'
+    assert records[-1]['complete'] == 2
@@ -0,0 +1,602 @@
+import json
+import pytest
+
+from contextlib import contextmanager
+
+from click.testing import CliRunner
+
+from gcontainer.context import CmdContext
+from gcontainer.deploy_controller import DeployController
+from gcontainer.error import ErrorConstants, GContainerException
+from gcontainer import service
+from gcontainer.service import Service
+
+
+@pytest.fixture
+def root():
+    return CliRunner().isolated_filesystem()
+
+
+class MockSystemd:
+    def __init__(self):
+        self.enabled = set()
+        self.batches = 0
+
+    def enable(self, service_name):
+        self.enabled.add(service_name)
+
+    def disable(self, service_name):
+        self.enabled.discard(service_name)
+
+    def units(self):
+        return set(self.enabled)
+
+    @contextmanager
+    def batch(self):
+        self.batches += 1
+        yield self
+
+
+def _context():
+    ctx = CmdContext(json_flag=True)
+    CmdContext._set_format_function(ctx)
+    ctx.config = CmdContext._load_configuration()
+    ctx.deploy = DeployController('')
+    ctx.systemd = MockSystemd()
+    ctx.fs = None
+    ctx.callback = None
+    return ctx
+
+
+def test_select():
+    deploys = {'web-1': {}, 'web-2': {}, 'db': {}}
+
+    assert Service._select(deploys, (), True) == ['db', 'web-1', 'web-2']
+    assert Service._select(deploys, ('web-*',), False) == ['web-1', 'web-2']
+    assert Service._select(deploys, ('db', 'web-2', 'web-*'), False) == ['db', 'web-2', 'web-1']
+    assert Service._select(deploys, ('cache-*', 'other'), False) == ['cache-*', 'other']
+
+
+class NoDocker:
+    def __getattr__(self, name):
+        raise AssertionError('docker was used')
+
+
+def test_bulk(root, capsys):
+    with root:
+        ctx = _context()
+        ctx.docker = NoDocker()
+        for service_name in ('web-1', 'web-2', 'db'):
+            ctx.deploy.add(service_name)
+        ctx.deploy.save_deploy('web-1', 'registry/web:1')
+        ctx.deploy.save_deploy('db', 'registry/db:1')
+        deploys, count = ctx.deploy.load()
+
+        exit_code = Service().bulk(ctx, 'enable', ('web-*', 'db', 'missing', 'wbe-*'))
+        res = json.loads(capsys.readouterr()[0])
+
+        # failures (including patterns that match nothing) are reported per service and do not stop the others
+        assert exit_code == 1
+        assert res['error_code'] == ErrorConstants.SERVICES_FAILED.value
+        assert [(result['name'], result['error_code']) for result in res['results']] == \
+            [('web-1', 0), ('web-2', 0), ('db', 0), ('missing', ErrorConstants.NO_SUCH_DEPLOY.value),
+             ('wbe-*', ErrorConstants.NO_SUCH_DEPLOY.value)]
+
+        # all changes are written at once
+        deploys, new_count = ctx.deploy.load()
+        assert new_count == count + 1
+        assert all(deploys[service_name]['enabled'] for service_name in deploys)
+        assert ctx.systemd.enabled == set(['web-1', 'db'])
+        assert ctx.systemd.batches == 1
+
+        exit_code = Service().bulk(ctx, 'disable', (), all_services=True)
+        res = json.loads(capsys.readouterr()[0])
+
+        assert exit_code == 0
+        assert res['error_code'] == 0
+        assert len(res['results']) == 3
+        assert not any(info['enabled'] for info in ctx.deploy.load()[0].values())
+        assert not ctx.systemd.enabled
+
+
+class MockDocker:
+    def __init__(self, missing=()):
+        self.missing = missing
+        self.pulls = []
+        self.parallelism = 8
+        self.pull_parallelism = 4
+        self.removed = []
+        self.created = []
+        self.health = {}
+        self.stopped = []
+        self.running = set()
+        self.replaced = []
+        self.waited = []
+        self.in_use = set()
+
+    def connected(self):
+        return True
+
+    def ensure_image(self, deploy_id, pull_policy=None, renderer=None):
+        self.pulls.append(deploy_id)
+        if deploy_id in self.missing:
+            raise GContainerException(ErrorConstants.IMAGE_NOT_AVAILABLE, deploy_id, 'not found')
+        return True
+
+    def is_running(self, service_name):
+        return service_name in self.running
+
+    def repository(self, deploy_id):
+        return deploy_id.rsplit(':', 1)[0]
+
+    def unused_images(self, keep, repositories):
+        self.keep = keep
+        self.repositories = repositories
+        return [{'id': 'a', 'tags': ['registry/web:1']},
+                {'id': 'b', 'tags': ['registry/web:2', 'registry/web:two']}]
+
+    def remove_image(self, tag):
+        if tag in self.in_use:
+            raise GContainerException(ErrorConstants.IMAGE_NOT_REMOVED, tag, '409 Client Error: Conflict')
+        self.removed.append(tag)
+
+    def events(self, since=None):
+        self.since = since
+        return iter(self.event_list)
+
+    def service_name(self, container_id):
+        return self.container_ids.get(container_id)
+
+    def containers(self):
+        return self.container_list
+
+    def image_references(self):
+        return set(['registry/web:1', 'registry/db:1'])
+
+    def create_container(self, service_name, deploy_id, destroy_existing=True, environment={}, recreate=False):
+        self.created.append(service_name)
+
+    def start(self, service_name):
+        pass
+
+    def prepare_container(self, service_name, deploy_id, environment={}):
+        self.replaced.append((service_name, deploy_id))
+
+    def replace_container(self, service_name):
+        return 0.25
+
+    def stop(self, service_name):
+        self.stopped.append(service_name)
+        return True
+
+    def readiness(self, service_name):
+        return self.health.get(service_name, 'running')
+
+    def wait(self, service_name):
+        self.waited.append(service_name)
+
+
+def test_boot_waves():
+    deploys = {'db': {'priority': 10},
+               'cache': {},
+               'app': {'after': ['db', 'cache', 'not-booted']},
+               'web': {'after': ['app'], 'priority': 5},
+               'metrics': {'priority': 20},
+               'a': {'after': ['b']},
+               'b': {'after': ['a']},
+               'c': {'after': ['a']}}
+
+    waves, blocked = Service._boot_waves(deploys)
+
+    assert waves == [['metrics', 'db', 'cache'], ['app'], ['web']]
+    assert blocked == ['a', 'b', 'c']
+
+
+def test_set(root):
+    with root:
+        ctx = _context()
+        ctx.deploy.add('app')
+
+        Service().set(ctx, 'app', priority=10, after=['db', 'cache', 'db'])
+        info = ctx.deploy.info('app')
+        assert info['priority'] == 10
+        assert info['after'] == ['cache', 'db']
+
+        Service().set(ctx, 'app', after=[])
+        info = ctx.deploy.info('app')
+        assert info['priority'] == 10
+        assert info['after'] == []
+
+
+def test_boot(root, capsys, monkeypatch):
+    with root:
+        ctx = _context()
+        ctx.docker = MockDocker()
+
+        for service_name in ('db', 'app', 'web', 'disabled'):
+            ctx.deploy.add(service_name)
+            ctx.deploy.save_deploy(service_name, 'registry/%s:1' % service_name)
+            if service_name != 'disabled':
+                ctx.deploy.set_enabled(service_name, True)
+
+        Service().set(ctx, 'app', after=['db'])
+        Service().set(ctx, 'web', after=['app'])
+        capsys.readouterr()
+
+        started = []
+
+        def _start(cls, ctx, service_name, deploy=None):
+            if service_name == 'app':
+                raise GContainerException(ErrorConstants.NO_IMAGE_ASSIGNED, service_name)
+            started.append(service_name)
+            deploy.set_running(service_name, True)
+
+        monkeypatch.setattr(Service, '_start', classmethod(_start))
+
+        exit_code = Service().boot(ctx)
+        res = json.loads(capsys.readouterr()[0])
+
+        # services that depend on a failed service are not started
+        assert exit_code == 1
+        assert started == ['db']
+        assert [(result['name'], result['wave'], result['error_code']) for result in res['results']] == \
+            [('db', 0, 0),
+             ('app', 1, ErrorConstants.NO_IMAGE_ASSIGNED.value),
+             ('web', 2, ErrorConstants.DEPENDENCY_FAILED.value)]
+        assert ctx.deploy.info('db')['running']
+
+
+def test_boot_readiness(root, capsys, monkeypatch):
+    with root:
+        ctx = _context()
+        ctx.docker = MockDocker()
+        ctx.docker.health['db'] = 'unhealthy'
+
+        for service_name in ('db', 'app'):
+            ctx.deploy.add(service_name)
+            ctx.deploy.save_deploy(service_name, 'registry/%s:1' % service_name)
+            ctx.deploy.set_enabled(service_name, True)
+
+        Service().set(ctx, 'app', after=['db'])
+        Service().set(ctx, 'db', readiness_timeout=0)
+        capsys.readouterr()
+
+        monkeypatch.setattr(Service, '_start', classmethod(lambda cls, ctx, service_name, deploy=None:
+                                                           deploy.set_running(service_name, True)))
+
+        exit_code = Service().boot(ctx)
+        res = json.loads(capsys.readouterr()[0])
+
+        # a service that is not ready is stopped and the services after it are not started
+        assert exit_code == 1
+        assert ctx.docker.stopped == ['db']
+        assert [(result['name'], result['error_code']) for result in res['results']] == \
+            [('db', ErrorConstants.SERVICE_NOT_READY.value), ('app', ErrorConstants.DEPENDENCY_FAILED.value)]
+        assert not ctx.deploy.info('db')['running']
+
+
+def test_wait_ready(root, monkeypatch):
+    with root:
+        ctx = _context()
+        ctx.docker = MockDocker()
+        ctx.deploy.add('web')
+
+        states = ['starting', 'starting', 'healthy']
+        monkeypatch.setattr(ctx.docker, 'readiness', lambda service_name: states.pop(0))
+        monkeypatch.setattr(Service, 'READINESS_POLL_INTERVAL', 0)
+
+        Service._wait_ready(ctx, 'web')
+        assert states == []
+        assert ctx.docker.stopped == []
+
+
+def test_start_block(root, capsys, monkeypatch):
+    with root:
+        ctx = _context()
+        ctx.docker = MockDocker()
+        ctx.docker.health['web'] = 'unhealthy'
+        ctx.block_flag = True
+        ctx.started_flag = False
+        ctx.recreate_flag = False
+
+        ctx.deploy.add('web')
+        Service().set(ctx, 'web', readiness_timeout=0)
+
+        notified = []
+        monkeypatch.setattr(Service, '_start', classmethod(lambda cls, ctx, service_name, deploy=None:
+                                                           deploy.set_running(service_name, True)))
+        monkeypatch.setattr(service, 'sd_notify', notified.append)
+
+        # Type=simple units are not held to the readiness timeout
+        Service().start(ctx, 'web')
+        assert ctx.docker.waited == ['web']
+        assert ctx.docker.stopped == []
+        assert notified == []
+
+        # Type=notify units report readiness, a service that is not ready is stopped
+        ctx.config.set('systemd', 'notify', 'true')
+        with pytest.raises(SystemExit):
+            Service().start(ctx, 'web')
+        assert ctx.docker.waited == ['web']
+        assert ctx.docker.stopped == ['web']
+        assert notified == []
+        assert json.loads(capsys.readouterr()[0].splitlines()[-1])['error_code'] == \
+            ErrorConstants.SERVICE_NOT_READY.value
+
+        ctx.docker.health['web'] = 'healthy'
+        Service().start(ctx, 'web')
+        assert ctx.docker.waited == ['web', 'web']
+        assert notified == ['READY=1']
+
+
+def test_deploy_manifest(root, capsys):
+    with root:
+        ctx = _context()
+        ctx.docker = MockDocker(missing=['registry/db:2'])
+
+        for service_name in ('web-1', 'web-2', 'db'):
+            ctx.deploy.add(service_name)
+        ctx.deploy.set_enabled('web-1', True)
+        deploys, count = ctx.deploy.load()
+
+        manifest = ['# release 2\n', 'web-1=registry/web:2\n', 'web-2=registry/web:2\n', 'db=registry/db:2\n']
+
+        # nothing is saved if an image is missing
+        exit_code = Service().deploy_manifest(ctx, manifest)
+        res = json.loads(capsys.readouterr()[0])
+
+        assert exit_code == 1
+        assert sorted(ctx.docker.pulls) == ['registry/db:2', 'registry/web:2']
+        assert [(result['name'], result['error_code']) for result in res['results']] == \
+            [('db', ErrorConstants.IMAGE_NOT_AVAILABLE.value),
+             ('web-1', ErrorConstants.DEPLOY_NOT_SAVED.value),
+             ('web-2', ErrorConstants.DEPLOY_NOT_SAVED.value)]
+        assert ctx.deploy.load() == (deploys, count)
+
+        # shared images are pulled once, all deploy ids are saved at once
+        ctx.docker = MockDocker()
+        exit_code = Service().deploy_manifest(ctx, manifest, callback_uri='http://callback')
+        res = json.loads(capsys.readouterr()[0])
+
+        assert exit_code == 0
+        assert res['error_code'] == 0
+        assert sorted(ctx.docker.pulls) == ['registry/db:2', 'registry/web:2']
+
+        deploys, new_count = ctx.deploy.load()
+        assert new_count == count + 1
+        assert deploys['web-1']['deployment'] == 'registry/web:2'
+        assert deploys['db']['callback_uri'] == 'http://callback'
+        assert ctx.systemd.enabled == set(['web-1'])
+
+
+def test_gc(root, capsys, monkeypatch):
+    with root:
+        ctx = _context()
+        ctx.docker = MockDocker()
+        ctx.deploy.add('web')
+        ctx.deploy.add('new')
+        for deploy_id in ('registry/web:1', 'registry/web:2', 'registry/web:3', 'registry/web:4'):
+            ctx.deploy.save_deploy('web', deploy_id)
+
+        exit_code = Service().gc(ctx, dry_run=True, keep=1)
+        res = json.loads(capsys.readouterr()[0])
+
+        # the current deployment and the last deploy id are kept, nothing is removed in a dry run
+        assert exit_code == 0
+        assert ctx.docker.keep == set(['registry/web:4', 'registry/web:3'])
+        assert ctx.docker.repositories == set(['registry/web'])
+        assert res['removed'] == ['registry/web:1', 'registry/web:2', 'registry/web:two']
+        assert ctx.docker.removed == []
+
+        # below the high watermark, nothing is removed
+        ctx.config.set('gc', 'high_watermark', '80')
+        monkeypatch.setattr(service, 'disk_usage', lambda path: 50.0)
+        Service().gc(ctx)
+        res = json.loads(capsys.readouterr()[0])
+        assert res['removed'] == []
+        assert res['disk_usage'] == 50.0
+
+        # above the high watermark, the oldest images are removed until the disk usage is below it
+        usage = [90.0, 90.0, 70.0]
+        monkeypatch.setattr(service, 'disk_usage', lambda path: usage.pop(0))
+        Service().gc(ctx)
+        res = json.loads(capsys.readouterr()[0])
+        assert res['removed'] == ['registry/web:1']
+        assert ctx.docker.removed == ['registry/web:1']
+
+        # images that can not be removed are reported, gc goes on with the next image
+        ctx.config.set('gc', 'high_watermark', '0')
+        ctx.docker.in_use.add('registry/web:1')
+        exit_code = Service().gc(ctx, keep=1)
+        res = json.loads(capsys.readouterr()[0])
+        assert exit_code == 1
+        assert res['error_code'] == ErrorConstants.IMAGES_NOT_REMOVED.value
+        assert res['removed'] == ['registry/web:2', 'registry/web:two']
+        assert [(result['tag'], result['error_code']) for result in res['failed']] == \
+            [('registry/web:1', ErrorConstants.IMAGE_NOT_REMOVED.value)]
+
+
+def test_gc_after_deploy(root, capsys):
+    with root:
+        ctx = _context()
+        ctx.docker = MockDocker()
+        ctx.deploy.add('web')
+
+        Service().deploy(ctx, 'web', 'registry/web:1')
+        assert 'gc' not in json.loads(capsys.readouterr()[0])
+
+        ctx.config.set('gc', 'after_deploy', 'true')
+        Service().deploy(ctx, 'web', 'registry/web:2')
+        res = json.loads(capsys.readouterr()[0])
+
+        assert res['error_code'] == 0
+        assert res['gc']['kept'] == ['registry/web:1', 'registry/web:2']
+        assert ctx.docker.removed == ['registry/web:1', 'registry/web:2', 'registry/web:two']
+
+
+class MockCallback:
+    def __init__(self):
+        self.reports = []
+
+    def running(self, uri, **payload):
+        self.reports.append(('running', payload['name']))
+
+    def stopped(self, uri, **payload):
+        self.reports.append(('stopped', payload['name']))
+
+
+class MockFs:
+    def current_config(self, service_name):
+        return 'initial'
+
+    def load_environment(self, service_name):
+        return {}
+
+
+def test_watch(root, capsys):
+    with root:
+        ctx = _context()
+        ctx.docker = MockDocker()
+        ctx.callback = MockCallback()
+        ctx.fs = MockFs()
+
+        for service_name in ('web', 'db'):
+            ctx.deploy.add(service_name)
+            ctx.deploy.save_deploy(service_name, 'registry/%s:1' % service_name, callback_uri='http://callback')
+        ctx.deploy.set_running('web', True)
+
+        ctx.docker.container_ids = {'c-web': 'web', 'c-db': 'db'}
+        ctx.docker.event_list = [{'status': 'start', 'id': 'c-db'},
+                                 {'status': 'start', 'id': 'c-other'},
+                                 {'status': 'oom', 'id': 'c-db', 'time': 1000},
+                                 {'status': 'die', 'id': 'c-db'},
+                                 {'status': 'die', 'id': 'c-db'}]
+
+        Service().watch(ctx, callbacks=True)
+        lines = [json.loads(line) for line in capsys.readouterr()[0].splitlines()]
+
+        # the web container is not running, the state is synced first
+        assert [(line.get('name'), line.get('state')) for line in lines] == \
+            [('web', 'stopped'), ('db', 'running'), ('db', 'oom'), ('db', 'stopped'), (None, None)]
+        assert ctx.callback.reports == [('stopped', 'web'), ('running', 'db'), ('stopped', 'db')]
+
+        deploys, count = ctx.deploy.load()
+        assert not deploys['web']['running']
+        assert not deploys['db']['running']
+        assert deploys['db']['last_oom'] == 1000
+        assert ctx.docker.since > 0
+
+
+def test_restart(root, capsys):
+    with root:
+        ctx = _context()
+        ctx.docker = MockDocker()
+        ctx.callback = MockCallback()
+        ctx.fs = MockFs()
+
+        for service_name in ('web', 'db'):
+            ctx.deploy.add(service_name)
+            ctx.deploy.save_deploy(service_name, 'registry/%s:1' % service_name, callback_uri='http://callback')
+        ctx.docker.running.add('web')
+
+        exit_code = Service().bulk(ctx, 'restart', ('web', 'db'))
+        res = json.loads(capsys.readouterr()[0])
+
+        # the replacement is prepared before the old container is stopped
+        assert exit_code == 1
+        assert [(result['name'], result['error_code'], result.get('downtime')) for result in res['results']] == \
+            [('web', 0, 0.25), ('db', ErrorConstants.SERVICE_IS_NOT_RUNNING.value, None)]
+        assert ctx.docker.replaced == [('web', 'registry/web:1')]
+        assert ctx.callback.reports == [('stopped', 'web'), ('running', 'web')]
+        assert ctx.deploy.info('web')['running']
+
+
+def test_status_fields(root, capsys):
+    with root:
+        ctx = _context()
+        ctx.docker = NoDocker()
+        ctx.fs = MockFs()
+
+        for service_name in ('web', 'db'):
+            ctx.deploy.add(service_name)
+            ctx.deploy.save_deploy(service_name, 'registry/%s:1' % service_name)
+        ctx.deploy.set_running('web', True)
+
+        # state only fields do not touch docker
+        assert Service().status(ctx, 'web', fields=['running', 'deployment']) == 0
+        res = json.loads(capsys.readouterr()[0])
+        assert res == {'name': 'web', 'running': True, 'deployment': 'registry/web:1', 'error_code': 0}
+
+        # the text output shows the selected fields in order
+        ctx.json = False
+        CmdContext._set_format_function(ctx)
+        assert Service().status(ctx, 'web', fields=['deployment', 'running']) == 0
+        assert capsys.readouterr()[0] == 'deployment: registry/web:1\nrunning: True\n'
+        ctx.json = True
+        CmdContext._set_format_function(ctx)
+
+        assert Service().list(ctx, fields=['running', 'config']) == 0
+        res = json.loads(capsys.readouterr()[0])
+        assert res['deploys'] == {'web': {'name': 'web', 'running': True, 'config': 'initial'},
+                                  'db': {'name': 'db', 'running': False, 'config': 'initial'}}
+
+        for service_name, fields, error_code in (('web', ['running', 'color'], ErrorConstants.UNKNOWN_FIELD),
+                                                 ('missing', ['running'], ErrorConstants.NO_SUCH_DEPLOY)):
+            with pytest.raises(SystemExit):
+                Service().status(ctx, service_name, fields=fields)
+            assert json.loads(capsys.readouterr()[0])['error_code'] == error_code.value
+
+
+def test_drift():
+    deploy_info = {'deployment': 'registry/web:1', 'running': True, 'enabled': True}
+    images = set(['registry/web:1'])
+
+    assert Service._drift(deploy_info, {'running': True, 'image': 'registry/web:1'}, images, True) == []
+    assert Service._drift(deploy_info, None, set(), False) == ['image_missing', 'container_not_running',
+                                                               'unit_missing']
+    assert Service._drift(deploy_info, {'running': False, 'image': 'registry/web:0'}, images, True) == \
+        ['image_mismatch', 'container_not_running']
+
+    deploy_info = {'deployment': '-', 'running': False, 'enabled': False}
+    assert Service._drift(deploy_info, {'running': True, 'image': 'registry/web:0'}, images, True) == \
+        ['flag_not_running', 'unit_stale']
+
+
+def test_reconcile(root, capsys):
+    with root:
+        ctx = _context()
+        ctx.docker = MockDocker()
+        ctx.fs = MockFs()
+        ctx.callback = MockCallback()
+
+        for service_name in ('web', 'db', 'cache'):
+            ctx.deploy.add(service_name)
+        ctx.deploy.save_deploy('web', 'registry/web:1')
+        ctx.deploy.save_deploy('db', 'registry/db:1')
+        ctx.deploy.set_running('web', True)
+        ctx.deploy.set_enabled('db', True)
+        ctx.systemd.enabled = set(['cache', 'removed'])
+
+        ctx.docker.container_list = {'db': {'running': True, 'image': 'registry/db:1'}}
+
+        exit_code = Service().reconcile(ctx, dry_run=True)
+        res = json.loads(capsys.readouterr()[0])
+
+        plan = [(result['name'], [(drift['kind'], drift['action']) for drift in result['drift']])
+                for result in res['results']]
+        assert exit_code == 0
+        assert plan == [('cache', [('unit_stale', 'disable')]),
+                        ('db', [('unit_missing', 'enable'), ('flag_not_running', 'set_running')]),
+                        ('removed', [('unit_stale', 'disable')]),
+                        ('web', [('container_not_running', 'start')])]
+        assert ctx.docker.created == []
+
+        exit_code = Service().reconcile(ctx)
+        res = json.loads(capsys.readouterr()[0])
+
+        assert exit_code == 0
+        assert not res['dry_run']
+        assert ctx.docker.created == ['web']
+        assert ctx.systemd.enabled == set(['db'])
+        deploys, count = ctx.deploy.load()
+        assert deploys['db']['running'] and deploys['web']['running']
@@ -0,0 +1,113 @@
+import fcntl
+import os
+import pytest
+import threading
+import uuid
+
+from click.testing import CliRunner
+
+from gcontainer import deploy_state
+from gcontainer.deploy_controller import DeployController
+from gcontainer.error import GContainerException
+from gcontainer.file_manager import FileSystemController
+from gcontainer.sharded_state import ShardedDeployState
+
+
+@pytest.fixture
+def root():
+    return CliRunner().isolated_filesystem()
+
+
+def test_shard_files(root):
+    with root:
+        deploy = DeployController('', 'sharded')
+        deploy_name = str(uuid.uuid4())
+
+        shard_dir = FileSystemController.create_path_name('', ShardedDeployState.SHARD_DIR_NAME)
+        index_file = FileSystemController.create_path_name(shard_dir, ShardedDeployState.INDEX_FILE_NAME)
+        assert os.access(index_file, os.F_OK | os.R_OK | os.W_OK)
+
+        # every service has a record file of its own
+        deploy.add(deploy_name)
+        assert os.access(deploy.state._record_file(deploy_name), os.F_OK)
+
+        deploy.remove(deploy_name)
+        assert not os.access(deploy.state._record_file(deploy_name), os.F_OK)
+        assert not os.access(deploy.state._lock_file(deploy_name), os.F_OK)
+
+        # services that do not exist leave no lock files behind
+        missing_name = str(uuid.uuid4())
+        with pytest.raises(GContainerException):
+            deploy.info(missing_name)
+        assert not deploy.exists(missing_name)
+        with pytest.raises(GContainerException):
+            deploy.set_running(missing_name, True)
+        assert not os.access(deploy.state._lock_file(missing_name), os.F_OK)
+        assert sorted(os.listdir(shard_dir)) == ['.index.json', '.index.lock']
+
+
+def test_stale_index_entry(root):
+    with root:
+        deploy = DeployController('', 'sharded')
+        deploy_name = str(uuid.uuid4())
+
+        deploy.add(deploy_name)
+        os.unlink(deploy.state._record_file(deploy_name))
+
+        deploys, count = deploy.load()
+        assert len(deploys) == 0
+
+        # the service can be created again
+        deploy.add(deploy_name)
+        assert deploy.exists(deploy_name)
+
+
+def test_unrelated_services_do_not_block(root):
+    with root:
+        deploy = DeployController('', 'sharded')
+        locked_name = str(uuid.uuid4())
+        other_name = str(uuid.uuid4())
+
+        deploy.add(locked_name)
+        deploy.add(other_name)
+
+        done = threading.Event()
+
+        def _set_running():
+            deploy.set_running(other_name, True)
+            done.set()
+
+        with deploy.state._service_lock(locked_name, fcntl.LOCK_EX):
+            thread = threading.Thread(target=_set_running)
+            thread.start()
+            assert done.wait(5)
+
+        thread.join()
+        assert deploy.info(other_name)['running']
+
+
+def test_removed_lock_file(root, monkeypatch):
+    with root:
+        deploy = DeployController('', 'sharded')
+        deploy_name = str(uuid.uuid4())
+        deploy.add(deploy_name)
+        lock_file = deploy.state._lock_file(deploy_name)
+
+        lockf = deploy_state.fcntl.lockf
+        locked = []
+
+        def _lockf(fd, mode):
+            # the service is removed (and its lock file with it) while the first lock waits
+            if not locked:
+                os.unlink(lock_file)
+            locked.append(os.fstat(fd.fileno()).st_ino)
+            return lockf(fd, mode)
+
+        monkeypatch.setattr(deploy_state.fcntl, 'lockf', _lockf)
+
+        # the lock is taken again on the new lock file
+        with deploy.state._service_lock(deploy_name, fcntl.LOCK_SH):
+            pass
+
+        assert len(locked) == 2
+        assert locked[1] == os.stat(lock_file).st_ino
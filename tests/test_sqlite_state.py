@@ -0,0 +1,46 @@
+import os
+import pytest
+import sqlite3
+
+from click.testing import CliRunner
+
+from gcontainer.deploy_controller import DeployController
+from gcontainer.file_manager import FileSystemController
+from gcontainer.sqlite_state import SqliteDeployState
+
+
+@pytest.fixture
+def root():
+    return CliRunner().isolated_filesystem()
+
+
+def test_database_file(root):
+    with root:
+        DeployController('', 'sqlite')
+
+        database_file = FileSystemController.create_path_name('', SqliteDeployState.DATABASE_FILE_NAME)
+        assert os.access(database_file, os.F_OK | os.R_OK | os.W_OK)
+
+
+def test_failed_migration(root, monkeypatch):
+    with root:
+        json_deploy = DeployController('')
+        json_deploy.add('web')
+
+        initialize = SqliteDeployState._initialize
+
+        def _failing_initialize(self, deploys, count):
+            initialize(self, deploys, count)
+            raise sqlite3.OperationalError('database or disk is full')
+
+        # the deploy file stays in place until the migrated records are committed
+        monkeypatch.setattr(SqliteDeployState, '_initialize', _failing_initialize)
+        with pytest.raises(sqlite3.OperationalError):
+            DeployController('', 'sqlite')
+        assert os.access(DeployController.DEPLOY_FILE_NAME, os.F_OK)
+
+        monkeypatch.setattr(SqliteDeployState, '_initialize', initialize)
+        deploys, count = DeployController('', 'sqlite').load()
+        assert 'web' in deploys
+        assert count == 1
+        assert not os.access(DeployController.DEPLOY_FILE_NAME, os.F_OK)
@@ -0,0 +1,61 @@
+import json
+import os
+import subprocess
+import sys
+
+from click.testing import CliRunner
+
+# Third party modules that must not be loaded by commands that do not talk to docker or callback endpoints.
+HEAVY_MODULES = ('docker', 'requests', 'urllib3', 'OpenSSL', 'iso8601')
+
+# Wall clock budgets in seconds. These are generous on purpose, they are meant to catch
+# regressions such as a heavy import moving back onto the startup path.
+IMPORT_BUDGET = 1.0
+STARTUP_BUDGET = 1.0
+
+STARTUP_SCRIPT = '''
+import json
+import sys
+import time
+
+start = time.time()
+from gcontainer import cli
+from gcontainer.context import CmdContext
+imported = time.time()
+
+ctx = CmdContext.init(CmdContext(), sys.argv[1], skip_root_check=True)
+ctx.fs.root
+ctx.deploy.exists('no-such-service')
+initialized = time.time()
+
+print(json.dumps({'import': imported - start,
+                  'startup': initialized - imported,
+                  'modules': sorted(sys.modules.keys())}))
+'''
+
+
+def _run_startup():
+    with open('gcontainer.conf', 'w') as config_file:
+        config_file.write("[layout]\nroot = %s\n" % os.path.abspath('root'))
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    output = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT, 'gcontainer.conf'], env=env)
+    return json.loads(output.splitlines()[-1])
+
+
+def test_no_heavy_imports():
+    with CliRunner().isolated_filesystem():
+        result = _run_startup()
+
+        for module in HEAVY_MODULES:
+            assert module not in result['modules']
+
+
+def test_startup_budget():
+    with CliRunner().isolated_filesystem():
+        result = _run_startup()
+
+        assert result['import'] < IMPORT_BUDGET
+        assert result['startup'] < STARTUP_BUDGET
@@ -0,0 +1,131 @@
+import json
+import os
+import pytest
+import uuid
+
+from click.testing import CliRunner
+
+from gcontainer.deploy_controller import DeployController
+from gcontainer.deploy_state import DeployStatus, JsonDeployState
+from gcontainer.error import GContainerException, ErrorConstants
+
+
+@pytest.fixture
+def root():
+    return CliRunner().isolated_filesystem()
+
+
+@pytest.fixture(params=['sqlite', 'sharded'])
+def backend(request):
+    return request.param
+
+
+def test_basic(root, backend):
+    with root:
+        deploy = DeployController('', backend)
+        assert not os.access(DeployController.DEPLOY_FILE_NAME, os.F_OK)
+
+        deploys, count = deploy.load()
+        assert len(deploys) == 0
+        assert count == 0
+
+
+def test_unknown_backend(root):
+    with root:
+        with pytest.raises(GContainerException) as e:
+            DeployController('', str(uuid.uuid4()))
+
+        assert e.value.error_code == ErrorConstants.UNKNOWN_STATE_BACKEND.value
+
+
+def test_create_remove(root, backend):
+    with root:
+        deploy = DeployController('', backend)
+        deploy_name = str(uuid.uuid4())
+
+        assert not deploy.exists(deploy_name)
+        deploy.add(deploy_name)
+        assert deploy.exists(deploy_name)
+
+        with pytest.raises(GContainerException) as e:
+            deploy.add(deploy_name)
+        assert e.value.error_code == ErrorConstants.DEPLOY_EXISTS.value
+
+        info = deploy.info(deploy_name)
+        assert info['name'] == deploy_name
+        assert not info['running']
+        assert not info['enabled']
+        assert info['deployment'] == '-'
+
+        # a second controller sees the same state
+        deploys, count = DeployController('', backend).load()
+        assert deploy_name in deploys
+        assert count == 1
+
+        deploy.remove(deploy_name)
+        assert not deploy.exists(deploy_name)
+
+        with pytest.raises(GContainerException) as e:
+            deploy.info(deploy_name)
+        assert e.value.error_code == ErrorConstants.NO_SUCH_DEPLOY.value
+
+        deploys, count = deploy.load()
+        assert len(deploys) == 0
+        assert count == 2
+
+
+def test_flags_and_deploy(root, backend):
+    with root:
+        deploy = DeployController('', backend)
+        deploy_name = str(uuid.uuid4())
+        other_name = str(uuid.uuid4())
+        deploy_id = str(uuid.uuid4())
+        callback = str(uuid.uuid4())
+
+        deploy.add(deploy_name)
+        deploy.add(other_name)
+
+        deploy.set_running(deploy_name, True)
+        deploy.set_enabled(deploy_name, True)
+        deploy.save_deploy(deploy_name, deploy_id, callback_uri=callback)
+
+        info = deploy.info(deploy_name)
+        assert info['running']
+        assert info['enabled']
+        assert info['deployment'] == deploy_id
+        assert info['callback_uri'] == callback
+
+        deploy.save_deploy(deploy_name, deploy_id)
+        assert 'callback_uri' not in deploy.info(deploy_name)
+
+        # other services are not touched
+        info = deploy.info(other_name)
+        assert not info['running']
+        assert not info['enabled']
+
+        with pytest.raises(GContainerException) as e:
+            deploy.set_running(str(uuid.uuid4()), True)
+        assert e.value.error_code == ErrorConstants.NO_SUCH_DEPLOY.value
+
+
+def test_migration(root, backend):
+    with root:
+        json_deploy = DeployController('')
+        deploy_name = str(uuid.uuid4())
+        deploy_id = str(uuid.uuid4())
+
+        json_deploy.add(deploy_name)
+        json_deploy.save_deploy(deploy_name, deploy_id)
+
+        deploy = DeployController('', backend)
+
+        assert not os.access(DeployController.DEPLOY_FILE_NAME, os.F_OK)
+        assert os.access(DeployController.DEPLOY_FILE_NAME + JsonDeployState.MIGRATED_SUFFIX, os.F_OK)
+
+        deploys, count = deploy.load()
+        assert count == 2
+        assert deploys[deploy_name]['deployment'] == deploy_id
+
+        with open(DeployController.DEPLOY_FILE_NAME + JsonDeployState.MIGRATED_SUFFIX) as fd:
+            contents = DeployStatus(json.load(fd))
+            assert contents[DeployStatus.DEPLOYS_KEY] == deploys
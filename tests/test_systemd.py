@@ -0,0 +1,262 @@
+import os
+import pytest
+import sys
+import types
+
+from click.testing import CliRunner
+
+from gcontainer import systemd
+from gcontainer.context import CmdContext
+from gcontainer.error import ErrorConstants, GContainerException
+from gcontainer.systemd import Systemd, SystemctlManager
+
+
+class MockFs:
+    def __init__(self):
+        self.scripts = {}
+
+    def info_deploy(self, service_name):
+        return {'script': os.path.abspath('script')}
+
+    def load_scripts(self, service_name):
+        return self.scripts.get(service_name, [])
+
+
+class MockManager:
+    def __init__(self):
+        self.calls = []
+
+    def enable(self, units):
+        self.calls.append(('enable', units))
+
+    def disable(self, units):
+        self.calls.append(('disable', units))
+
+    def reload(self):
+        self.calls.append(('reload',))
+
+
+@pytest.fixture
+def root():
+    return CliRunner().isolated_filesystem()
+
+
+def _systemd(backend='auto', unit_mode='file'):
+    ctx = CmdContext()
+    ctx.config = CmdContext._load_configuration()
+    ctx.config.set('systemd', 'config_dir', os.path.abspath('.'))
+    ctx.config.set('systemd', 'backend', backend)
+    ctx.config.set('systemd', 'unit_mode', unit_mode)
+    ctx.fs = MockFs()
+    return Systemd(ctx)
+
+
+def test_enable_disable(root):
+    with root:
+        sd = _systemd()
+        sd.manager = MockManager()
+
+        sd.enable('web')
+        sd.enable('web')
+        assert sd.units() == set(['web'])
+        assert sd.manager.calls == [('enable', ['gcontainer-web.service'])]
+
+        sd.disable('web')
+        assert sd.units() == set()
+        assert sd.manager.calls[1:] == [('disable', ['gcontainer-web.service']), ('reload',)]
+
+
+def test_helper_unit_names(root):
+    with root:
+        sd = _systemd()
+        sd.manager = MockManager()
+
+        # services named like the helper units do not order themselves after themselves
+        sd.enable('boot')
+        with open('gcontainer-boot.service') as unit_file:
+            assert 'After=docker.service gcontainerd-boot.service\n' in unit_file.read()
+
+
+def test_batch(root):
+    with root:
+        sd = _systemd()
+        sd.manager = MockManager()
+
+        with sd.batch():
+            for service_name in ('web-1', 'web-2', 'db'):
+                sd.enable(service_name)
+            assert sd.manager.calls == []
+
+        assert sd.manager.calls == [('enable', ['gcontainer-web-1.service', 'gcontainer-web-2.service',
+                                                'gcontainer-db.service'])]
+
+        sd.manager.calls = []
+        with sd.batch():
+            sd.disable('web-1')
+            sd.disable('web-2')
+            # disabled and enabled again, nothing changes
+            sd.disable('db')
+            sd.enable('db')
+
+            # the unit files are removed when the batch ends
+            assert sd.units() == set(['web-1', 'web-2', 'db'])
+
+        assert sd.manager.calls == [('disable', ['gcontainer-web-1.service', 'gcontainer-web-2.service']), ('reload',)]
+        assert sd.units() == set(['db'])
+
+
+def test_template(root):
+    with root:
+        os.mkdir('script')
+        open('script/exec-start-pre.sh', 'w').close()
+
+        sd = _systemd(unit_mode='template')
+        sd.manager = MockManager()
+        sd.ctx.fs.scripts['db'] = ['exec-start-pre.sh']
+
+        # the template is written once, enabling more services only links their instances
+        with sd.batch():
+            sd.enable('web')
+            sd.enable('db')
+        sd.enable('cache')
+
+        assert sd.manager.calls == [('reload',)]
+        assert sd.units() == set(['web', 'db', 'cache'])
+        assert os.readlink('multi-user.target.wants/gcontainer@web.service') == os.path.abspath('gcontainer@.service')
+        assert 'ExecStart=/usr/bin/gcontainer start --block --ignore-started %I' in open('gcontainer@.service').read()
+
+        with open('gcontainer@db.service.d/scripts.conf') as drop_in:
+            assert drop_in.read() == '[Service]\nExecStartPre=%s\n' % os.path.abspath('script/exec-start-pre.sh')
+        assert not os.path.exists('gcontainer@web.service.d')
+
+        # no drop-in, no reload
+        sd.disable('web')
+        assert sd.manager.calls == [('reload',)]
+        sd.disable('db')
+        assert sd.manager.calls == [('reload',), ('reload',)]
+        assert sd.units() == set(['cache'])
+        assert not os.path.exists('gcontainer@db.service.d')
+
+
+def test_template_migration(root):
+    with root:
+        sd = _systemd()
+        sd.manager = MockManager()
+        sd.enable('web')
+
+        sd = _systemd(unit_mode='template')
+        sd.manager = MockManager()
+        sd.enable('web')
+
+        assert not os.path.exists('gcontainer-web.service')
+        assert os.path.lexists('multi-user.target.wants/gcontainer@web.service')
+        assert sd.manager.calls == [('disable', ['gcontainer-web.service']), ('reload',), ('reload',)]
+
+
+def test_instance_name():
+    # %I turns '-' back into '/', so '-' must be escaped
+    assert Systemd._instance_name('web-1') == 'gcontainer@web\\x2d1.service'
+    assert Systemd._instance_name('my service') == 'gcontainer@my\\x20service.service'
+    assert Systemd._instance_name('a/b.c') == 'gcontainer@a-b.c.service'
+
+    for name in ('web-1', 'my service', 'a/b.c', 'web_1:x', 'x\\y-z'):
+        assert Systemd._unescape(Systemd._escape(name)) == name
+
+
+def test_template_units(root):
+    with root:
+        sd = _systemd(unit_mode='template')
+        sd.manager = MockManager()
+
+        sd.enable('web-1')
+        assert os.path.lexists('multi-user.target.wants/gcontainer@web\\x2d1.service')
+        assert sd.units() == set(['web-1'])
+
+
+def test_backend(root, monkeypatch):
+    with root:
+        # python-dbus is not installed here, auto falls back to systemctl
+        monkeypatch.setattr(systemd.DbusManager, '__init__', lambda self: __import__('no_such_dbus_module'))
+        assert isinstance(_systemd()._manager(), SystemctlManager)
+
+        with pytest.raises(GContainerException) as e:
+            _systemd('dbus')._manager()
+        assert e.value.error_code == ErrorConstants.SYSTEMD_NOT_AVAILABLE.value
+
+        with pytest.raises(GContainerException) as e:
+            _systemd('upstart')
+        assert e.value.error_code == ErrorConstants.UNKNOWN_SYSTEMD_BACKEND.value
+
+        with pytest.raises(GContainerException) as e:
+            _systemd(unit_mode='generated')
+        assert e.value.error_code == ErrorConstants.UNKNOWN_UNIT_MODE.value
+
+
+class FakeDbusException(Exception):
+    pass
+
+
+class FakeBus:
+    def get_object(self, name, path):
+        return name, path
+
+
+class FakeSystemdManager:
+    def __init__(self):
+        self.calls = []
+        self.failing = set()
+
+    def __getattr__(self, method):
+        def _call(*args):
+            self.calls.append((method,) + args)
+            if method in self.failing:
+                raise FakeDbusException('org.freedesktop.DBus.Error.AccessDenied')
+        return _call
+
+
+def test_dbus(root, monkeypatch):
+    manager = FakeSystemdManager()
+
+    dbus = types.ModuleType('dbus')
+    dbus.exceptions = types.ModuleType('dbus.exceptions')
+    dbus.exceptions.DBusException = FakeDbusException
+    dbus.SystemBus = FakeBus
+    dbus.Interface = lambda obj, interface: manager
+    monkeypatch.setitem(sys.modules, 'dbus', dbus)
+
+    with root:
+        sd = _systemd('dbus')
+        sd.enable('web')
+        sd.disable('web')
+
+        assert manager.calls == [('PresetUnitFiles', ['gcontainer-web.service'], False, False),
+                                 ('EnableUnitFiles', ['gcontainer-web.service'], False, False),
+                                 ('Reload',),
+                                 ('DisableUnitFiles', ['gcontainer-web.service'], False),
+                                 ('Reload',)]
+
+        # a failed enable is reported and the unit file is written again by the next enable
+        manager.failing.add('EnableUnitFiles')
+        with pytest.raises(GContainerException) as e:
+            sd.enable('web')
+        assert e.value.error_code == ErrorConstants.SYSTEMD_CALL_FAILED.value
+        assert sd.units() == set()
+
+        manager.failing.clear()
+        del manager.calls[:]
+        sd.enable('web')
+        assert sd.units() == set(['web'])
+        assert [call[0] for call in manager.calls] == ['PresetUnitFiles', 'EnableUnitFiles', 'Reload']
+
+
+def test_systemctl(monkeypatch):
+    calls = []
+    monkeypatch.setattr(systemd, 'call', lambda args: calls.append(args))
+
+    manager = SystemctlManager('systemctl')
+    manager.enable(['gcontainer-web.service', 'gcontainer-db.service'])
+    manager.disable(['gcontainer-web.service'])
+
+    assert calls == [['systemctl', 'preset', 'gcontainer-web.service', 'gcontainer-db.service'],
+                     ['systemctl', '--quiet', 'enable', 'gcontainer-web.service', 'gcontainer-db.service'],
+                     ['systemctl', '--quiet', 'disable', 'gcontainer-web.service']]
@@ -1,4 +1,9 @@
-from gcontainer.util import legal_name, parse_environment
+import os
+import socket
+import tempfile
+import threading
+
+from gcontainer.util import is_pattern, legal_name, parse_environment, parallel_map, sd_notify
 
 
 def test_basic_name():
@@ -12,6 +17,20 @@ def test_basic_name():
     assert not legal_name("")
 
 
+def test_reserved_name():
+    # the temporary container names of a restarting service
+    assert legal_name('web.new')
+    assert not legal_name('web.gcontainer-new')
+    assert not legal_name('web.gcontainer-old')
+
+
+def test_is_pattern():
+    assert is_pattern("web-*")
+    assert is_pattern("web-?")
+    assert is_pattern("web-[12]")
+    assert not is_pattern("web-1")
+
+
 def _test_keys(lines, values):
     env = parse_environment(lines)
     assert len(env) == len(values)
@@ -60,3 +79,41 @@ def test_parse_environment():
 
     _test_keys(["a=b\n", "foo = bar\n", "hello= world\n", "# a comment\n", "# bar=baz\n", "yes=\"another=value\"\n"],
                {'a': 'b', 'foo': 'bar', 'hello': 'world', 'yes': 'another=value'})
+
+
+def test_parallel_map():
+    assert parallel_map(lambda x: x, []) == []
+    assert parallel_map(lambda x: x * 2, [1, 2, 3]) == [2, 4, 6]
+    assert parallel_map(lambda x: x * 2, range(100), 8) == [x * 2 for x in range(100)]
+
+
+def test_parallel_map_bounded():
+    lock = threading.Lock()
+    state = {'active': 0, 'max': 0}
+
+    def _work(x):
+        with lock:
+            state['active'] += 1
+            state['max'] = max(state['max'], state['active'])
+        threading.Event().wait(0.01)
+        with lock:
+            state['active'] -= 1
+        return x
+
+    assert parallel_map(_work, range(20), 4) == range(20)
+    assert 1 <= state['max'] <= 4
+
+
+def test_sd_notify(monkeypatch):
+    monkeypatch.delenv('NOTIFY_SOCKET', raising=False)
+    assert not sd_notify('READY=1')
+
+    address = os.path.join(tempfile.mkdtemp(), 'notify')
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(address)
+    try:
+        monkeypatch.setenv('NOTIFY_SOCKET', address)
+        assert sd_notify('READY=1')
+        assert sock.recv(64) == 'READY=1'
+    finally:
+        sock.close()